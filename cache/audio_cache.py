@@ -0,0 +1,142 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""synthesized speech kept on disk, named after what was synthesized"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+AUDIO_CACHE_FOLDER = os.path.expanduser("~/.pollexy/.cache/speech")
+AUDIO_CACHE_MAX_BYTES = 200 * 1024 * 1024
+AUDIO_EXTENSIONS = {'ogg_vorbis': '.ogg', 'mp3': '.mp3', 'pcm': '.pcm'}
+
+
+def audio_key(text, text_type, voice, output_format, lexicons=None):
+    """the same for every request Polly would answer with the same audio"""
+    key = json.dumps([text, text_type, voice, output_format,
+                      sorted(lexicons or [])])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class AudioCache(object):
+    """a folder of audio files named by audio_key. files are written to a
+    temp file and renamed into place, so a reader never sees half a file.
+    when the folder grows past MaxBytes the least recently played files
+    are removed"""
+    def __init__(self, **kwargs):
+        self.folder = kwargs.get('Folder', AUDIO_CACHE_FOLDER)
+        self.max_bytes = kwargs.get('MaxBytes', AUDIO_CACHE_MAX_BYTES)
+        self.lock = threading.Lock()
+        self.size = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path(self, key, output_format='ogg_vorbis'):
+        return os.path.join(self.folder, key +
+                            AUDIO_EXTENSIONS.get(output_format, '.audio'))
+
+    def get(self, key, output_format='ogg_vorbis'):
+        """the cached file for key, or None"""
+        path = self.path(key, output_format)
+        try:
+            # the modification time is what eviction goes by
+            os.utime(path, None)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return path
+
+    def has(self, key, output_format='ogg_vorbis'):
+        """whether key is cached, without counting it as a hit or miss"""
+        return os.path.exists(self.path(key, output_format))
+
+    def put(self, key, stream, output_format='ogg_vorbis'):
+        """store everything read from stream under key, returns the path"""
+        if not os.path.isdir(self.folder):
+            try:
+                os.makedirs(self.folder)
+            except OSError:
+                if not os.path.isdir(self.folder):
+                    raise
+        path = self.path(key, output_format)
+        fd, tmp = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(64 * 1024)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+            os.rename(tmp, path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+        with self.lock:
+            if self.size is not None:
+                self.size += os.path.getsize(path)
+        self.evict()
+        return path
+
+    def files(self):
+        """(mtime, size, path) for every cached file, oldest first"""
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.folder, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        with self.lock:
+            if self.size is not None and self.size <= self.max_bytes:
+                return
+            entries = self.files()
+            self.size = sum(e[1] for e in entries)
+            for mtime, size, path in entries:
+                if self.size <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                logging.debug('Evicted {} from the audio cache'.format(path))
+                self.size -= size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            if os.path.isdir(self.folder):
+                for mtime, size, path in self.files():
+                    os.unlink(path)
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': self.size,
+                    'max_size': self.max_bytes}
+
+
+audio_cache = AudioCache()
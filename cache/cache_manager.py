@@ -20,7 +20,7 @@
 # or implied. See the License for the specific language governing permissions 
 # and limitations under the License.
 
-import boto3
+from helpers import aws
 import os
 import os.path
 import logging
@@ -51,7 +51,7 @@ class CacheManager(object):
                 raise
 
     def sync_remote_folder(self):
-        client = boto3.client('s3')
+        client = aws.client('s3')
         files = self.get_remote_file_list()
         if files:
             logging.info("Syncing %s/%s" % (self.bucket_name,
@@ -72,7 +72,7 @@ class CacheManager(object):
                                                 self.cache_name))
 
     def get_remote_file_list(self):
-        client = boto3.client('s3')
+        client = aws.client('s3')
         print("{}/{}".format(self.bucket_name, self.cache_name))
         logging.info("Syncing %s/%s" % (self.bucket_name, self.cache_name))
         objects = client.list_objects(Bucket=self.bucket_name,
@@ -12,14 +12,24 @@
 
 import click
 from messages.message import ScheduledMessage
-from messages.message_manager import MessageManager, LibraryManager
-from scheduler.scheduler import Scheduler
+from messages.message_manager import MessageManager, LibraryManager, \
+    MessagePublisher
+from scheduler.scheduler import Scheduler, queue_lookahead, delivery_time, \
+    occurrence_time, after_delivery
+from scheduler.forecast import forecast, FORECAST_HORIZON_DAYS
+from scheduler.daemon import SchedulerDaemon, RESYNC_SECONDS
 from speaker.speaker import Speaker
+from speaker.engine import audio_engine
+from speaker.prefetch import SpeechPrefetcher
 from cache.cache_manager import CacheManager
+from cache.audio_cache import audio_cache
 from person.person import PersonManager
 from face.face import FaceManager
 from locator.locator import LocationManager, LocationVerification
 from helpers.config import ConfigHelper
+from helpers.recurrence import rule_cache_stats
+from helpers.schema import schema_registry
+from messages.queue_registry import FIFO_QUEUES_ENV, fifo_queues
 import random
 import arrow
 import logging
@@ -49,13 +59,16 @@ class Config():
 @click.option('--verbose/--no-verbose', default=False)
 @click.option('--profile', default='pollexy')
 @click.option('--region')
-def cli(profile, region, verbose):
+@click.option('--fifo/--no-fifo', default=None)
+def cli(profile, region, verbose, fifo):
     if verbose:
         os.environ['LOG_LEVEL'] = 'DEBUG'
     os.environ['AWS_PROFILE'] = profile
     if region:
         print 'region = {}'.format(region)
         os.environ['AWS_DEFAULT_REGION'] = region
+    if fifo is not None:
+        os.environ[FIFO_QUEUES_ENV] = str(fifo).lower()
     pass
 
 
@@ -259,6 +272,30 @@ def person_show(name):
                            p.require_physical_confirmation))
 
 
+@cli.group('schema')
+def schema():
+    pass
+
+
+@schema.command('ensure')
+@click.option('--write_marker/--no_write_marker', default=True)
+def schema_ensure(write_marker):
+    # check every table against DynamoDB, whatever the marker says
+    schema_registry.clear()
+    schema_registry.use_marker = False
+    Scheduler()
+    LocationManager()
+    LibraryManager()
+    for table in sorted(schema_registry.validated):
+        click.echo('{} ok'.format(table))
+    if write_marker:
+        if schema_registry.write_marker() is None:
+            click.echo('Could not write {}'
+                       .format(schema_registry.marker_path))
+        else:
+            click.echo('Wrote {}'.format(schema_registry.marker_path))
+
+
 @cli.group('location')
 def location():
     pass
@@ -292,7 +329,7 @@ def location_list():
         click.echo("There are no locations")
     else:
         for l in locs:
-            click.echo(l.location_name['S'])
+            click.echo(l.location_name)
 
 
 @cli.group('message')
@@ -335,6 +372,53 @@ def list(person_name, include_expired, verbose):
                 bool(m.is_queued))
 
 
+@message.command('reindex')
+def message_reindex():
+    s = Scheduler()
+    count = s.reindex_messages()
+    click.echo('Reindexed {} scheduled messages'.format(count))
+
+
+@message.command('forecast')
+@click.option('--days', default=FORECAST_HORIZON_DAYS)
+@click.option('--start_date')
+@click.option('--output', default='forecast.csv')
+@click.option('--format', 'output_format', default='csv',
+              type=click.Choice(['csv', 'npz']))
+@click.option('--processes', type=int)
+def message_forecast(days, start_date, output, output_format, processes):
+    plan = forecast(Start=start_date, HorizonDays=days, Processes=processes)
+    if output_format == 'csv':
+        with open(output, 'wb') as f:
+            plan.write_csv(f)
+    else:
+        plan.save(output)
+    minutes, counts = plan.per_minute()
+    click.echo('Wrote {} occurrences to {}'.format(len(plan), output))
+    if len(counts):
+        busiest = counts.argmax()
+        click.echo('Busiest minute: {} ({} deliveries)'.format(
+            arrow.get(int(minutes[busiest]) * 60).to('local'),
+            counts[busiest]))
+
+
+@message.command('daemon')
+@click.option('--simulate/--dont_simulate', default=False)
+@click.option('--resync_seconds', default=RESYNC_SECONDS)
+@click.option('--verbose/--no-verbose', default=False)
+def message_daemon(simulate, resync_seconds, verbose):
+    log = logging.getLogger('PollexyCli')
+    if verbose:
+        os.environ['LOG_LEVEL'] = 'DEBUG'
+        log.setLevel(logging.DEBUG)
+    d = SchedulerDaemon(Simulate=simulate, ResyncSeconds=resync_seconds)
+    click.echo('Scheduler daemon running, press Ctrl+C to stop')
+    try:
+        d.run()
+    except KeyboardInterrupt:
+        d.stop()
+
+
 @message.command('speak')
 @click.argument('person_name')
 @click.argument('location_name')
@@ -345,6 +429,10 @@ def list(person_name, include_expired, verbose):
 @click.option('--simulate/--dont_simulate', default=False)
 @click.option('--voice_id')
 @click.option('--fail_confirm/--dont_fail_confirm', default=False)
+@click.option('--stream/--no_stream', default=True,
+              help='Start playing speech before Polly has finished it')
+@click.option('--prerender/--no_prerender', default=True,
+              help='Render upcoming messages into the audio cache early')
 @click.option('--verbose/--no-verbose', default=False)
 def speak(person_name,
           location_name,
@@ -354,22 +442,39 @@ def speak(person_name,
           no_audio,
           simulate,
           fail_confirm,
+          stream,
+          prerender,
           verbose):
     log = logging.getLogger('PollexyCli')
     if verbose:
         os.environ['LOG_LEVEL'] = 'DEBUG'
         log.setLevel(logging.DEBUG)
+    message_manager = None
+    prefetcher = None
     try:
+        # one manager for the whole loop, so its long poll and prefetch
+        # buffer carry over from one message to the next
+        message_manager = MessageManager(LocationName=location_name,
+                                         BufferAcks=True)
+        if prerender and not no_audio:
+            prefetcher = SpeechPrefetcher(LocationName=location_name,
+                                          Stream=stream,
+                                          Render=Speaker().render)
+            prefetcher.start()
         while True:
             lm = LocationManager()
             loc = lm.get_location(location_name)
             if not ignore_motion and not loc.is_motion:
                 print 'Exiting. No motion detected at ' + location_name
+                message_manager.close()
+                if prefetcher:
+                    prefetcher.stop()
                 exit(1)
             speaker = Speaker(NoAudio=no_audio)
-            message_manager = MessageManager(LocationName=location_name)
+            # the wait happens on the message queue in write_speech
             bm = message_manager.get_messages(MessageType='Bot',
-                                              PersonName=person_name)
+                                              PersonName=person_name,
+                                              WaitTimeSeconds=0)
             if bm and len(bm) > 0:
                 log.debug('Bot count = {}'.format(len(bm)))
                 for bot in bm:
@@ -391,11 +496,19 @@ def speak(person_name,
                         print 'Bot failed: {}'.format(e)
                         raise
                 message_manager.succeed_messages(dont_delete=simulate)
+                # a conversation can take longer than the ack deadline, so
+                # don't leave these for the end of the loop
+                message_manager.flush_acks()
+                log.debug('Heartbeat: {}'
+                          .format(message_manager.heartbeat.stats()))
 
             cache_manager = CacheManager(BucketName='pollexy-media',
                                          CacheName='chimes')
             cache_manager.sync_remote_folder()
-            vid, speech = message_manager.write_speech(PersonName=person_name)
+            if not no_audio:
+                audio_engine.preload()
+            vid, speech = message_manager.compose_speech(
+                PersonName=person_name)
             if vid:
                 voice_id = vid
             if not speech:
@@ -406,10 +519,16 @@ def speak(person_name,
                     pm = PersonManager()
                     p = pm.get_person(person_name)
                     do_speech = True
+                    reason = None
                     if fail_confirm:
                         log.warn("FORCE FAILING confirmation")
                         reason, do_speech = "NoResponse", False
 
+                    elif not message_manager.windows_current(p):
+                        log.warn('{} is no longer expected at {}'
+                                 .format(person_name, location_name))
+                        reason, do_speech = "NotAvailable", False
+
                     elif not no_audio and p.require_physical_confirmation and \
                             not ignore_confirmation:
                         lv = LocationVerification(PersonName=person_name,
@@ -418,22 +537,38 @@ def speak(person_name,
                         do_speech, retry_count, timeout = \
                             lv.verify_person_at_location(SpeechMethod=say)
                     log.debug('do_speech={}'.format(bool(do_speech)))
-                    if fail_confirm:
+                    if reason:
                         message_manager.fail_messages(Reason=reason)
                     else:
                         if do_speech:
                             log.debug('starting speech')
                             speaker = Speaker(NoAudio=no_audio)
-                            speaker.generate_audio(Message=speech,
-                                                   TextType='ssml',
-                                                   VoiceId=voice_id)
-                            speaker.speak(IncludeChime=True)
+                            if stream:
+                                speaker.stream(Messages=speech.documents(),
+                                               TextType='ssml',
+                                               VoiceId=voice_id,
+                                               IncludeChime=True)
+                            else:
+                                for i, d in enumerate(speech.documents()):
+                                    speaker.generate_audio(Message=d,
+                                                           TextType='ssml',
+                                                           VoiceId=voice_id)
+                                    speaker.speak(IncludeChime=(i == 0))
+                                    speaker.cleanup()
                         log.debug('Succeeding messages')
                         message_manager.succeed_messages(dont_delete=simulate)
                 finally:
                     speaker.cleanup()
+                    log.debug('Audio cache: {}'.format(audio_cache.stats()))
+                    if prefetcher:
+                        log.debug('Prerender: {}'.format(prefetcher.stats()))
+            message_manager.flush_acks()
 
     except Exception as exc:
+        if message_manager:
+            message_manager.close()
+        if prefetcher:
+            prefetcher.stop()
         exc_type, exc_value, exc_traceback = sys.exc_info()
         print repr(traceback.format_exception(exc_type, exc_value,
                    exc_traceback))
@@ -444,8 +579,10 @@ def speak(person_name,
 @message.command('queue')
 @click.option('--simulate/--dont_simulate')
 @click.option('--simulated_date')
+@click.option('--lookahead', type=int,
+              help='Publish this many seconds ahead, delayed in the queue')
 @click.option('--verbose/--no-verbose', default=False)
-def queue(simulate, simulated_date, verbose):
+def queue(simulate, simulated_date, lookahead, verbose):
     log = logging.getLogger('PollexyCli')
     if verbose:
         os.environ['LOG_LEVEL'] = 'DEBUG'
@@ -456,13 +593,15 @@ def queue(simulate, simulated_date, verbose):
         else:
             dt = arrow.utcnow()
         scheduler = Scheduler()
-        msgs = scheduler.get_messages()
-        if len(msgs) == 0:
-            click.echo("No messages are ready to be queued")
-            return
-
-        log.debug("Number of messages to be scheduled: %s" % len(msgs))
-        for m in msgs:
+        publisher = MessagePublisher()
+        if lookahead is None:
+            lookahead = queue_lookahead()
+        if fifo_queues():
+            lookahead = 0
+        count = 0
+        for m in scheduler.iter_messages(dt.replace(seconds=+lookahead)):
+            count += 1
+            deliver_at = delivery_time(m, dt)
             if not simulate:
                 pm = PersonManager()
                 p = pm.get_person(m.person_name)
@@ -471,15 +610,15 @@ def queue(simulate, simulated_date, verbose):
                              "does not have an entry in the " +
                              "Person table")
                     continue
-                if p.all_available_count(dt) == 0:
+                avail_windows = p.all_available(deliver_at)
+                if len(avail_windows) == 0:
                     log.debug('No locations available for %s' %
                               m.person_name)
                     continue
-                avail_windows = p.all_available(dt)
                 log.debug('# of locations avail: {}, last_loc={}'
-                          .format(p.all_available_count(dt),
+                          .format(len(avail_windows),
                                   m.last_loc))
-                if m.last_loc == p.all_available_count(dt)-1:
+                if m.last_loc == len(avail_windows)-1:
                     log.debug('Resetting to first location')
                     idx = 0
                 else:
@@ -488,22 +627,40 @@ def queue(simulate, simulated_date, verbose):
 
                 active_window = avail_windows[int(idx)]
                 next_exp = m.next_expiration_utc.isoformat()
-                mm = MessageManager(LocationName=active_window.location_name)
+                occurrence = occurrence_time(m, deliver_at)
                 log.debug("Publishing message for person %s to location %s"
                           % (m.person_name, active_window.location_name))
-                mm.publish_message(Body=m.body, UUID=m.uuid_key,
-                                   PersonName=m.person_name,
-                                   NoMoreOccurrences=m.no_more_occurrences,
-                                   BotNames=m.bot_names,
-                                   RequiredBots=m.required_bots,
-                                   IceBreaker=m.ice_breaker,
-                                   Introduction=m.introduction,
-                                   ExpirationDateTimeInUtc=next_exp)
-                scheduler.update_queue_status(m.uuid_key, m.person_name, True)
-                scheduler.update_last_location(m.uuid_key, m.person_name, idx)
+                publisher.add(LocationName=active_window.location_name,
+                              Context=idx,
+                              Body=m.body, UUID=m.uuid_key,
+                              PersonName=m.person_name,
+                              NoMoreOccurrences=m.no_more_occurrences,
+                              BotNames=m.bot_names,
+                              RequiredBots=m.required_bots,
+                              IceBreaker=m.ice_breaker,
+                              VoiceId=m.voice_id,
+                              WindowsVersion=p.windows_version,
+                              DeliverAtUtc=deliver_at,
+                              OccurrenceDateTimeInUtc=occurrence
+                              .isoformat(),
+                              AfterDelivery=after_delivery(m, occurrence),
+                              ExpirationDateTimeInUtc=next_exp)
             else:
                 click.echo("Publishing message(simulated):")
                 click.echo(str(m))
+        results = publisher.flush()
+        scheduler.mark_queued_batch([{'UUID': r.uuid_key,
+                                      'PersonName': r.person_name,
+                                      'LocationIndex': r.context}
+                                     for r in results if r.succeeded])
+        for r in results:
+            if not r.succeeded:
+                click.echo('Could not publish {} for {}: {}'
+                           .format(r.uuid_key, r.person_name, r.error))
+        if count == 0:
+            click.echo("No messages are ready to be queued")
+        log.debug("Number of messages scheduled: %s" % count)
+        log.debug("Rule cache: %s" % rule_cache_stats())
 
     except Exception:
         print 'here'
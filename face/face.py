@@ -9,7 +9,7 @@
 # or implied. See the License for the specific language governing permissions 
 # and limitations under the License.
 
-import boto3
+from helpers import aws
 import os.path
 import uuid
 from botocore.client import ClientError
@@ -34,7 +34,7 @@ class FaceManager(object):
 
     def does_bucket_exist(self, bucket):
         try:
-            s3 = boto3.resource('s3')
+            s3 = aws.resource('s3')
             s3.meta.client.head_bucket(Bucket=bucket)
             return True
         except ClientError as exc:
@@ -45,7 +45,7 @@ class FaceManager(object):
         return open(path, 'rb')
 
     def upload_to_s3(self, path, person):
-        client = boto3.client('s3')
+        client = aws.client('s3')
         filename = os.path.basename(path)
         id = uuid.uuid4()
         key = '%s-%s' % (id, filename)
@@ -72,7 +72,7 @@ class FaceManager(object):
         error_if_missing(kwargs, ['Path', 'Collection'])
         collection = kwargs.get("Collection", "")
         path = kwargs.get("Path", "")
-        reko = boto3.client('rekognition')
+        reko = aws.client('rekognition')
         with open(path, 'rb') as image:
             response = reko.search_faces_by_image(
                 CollectionId=collection,
@@ -88,7 +88,7 @@ class FaceManager(object):
             reko = kwargs.get('RekognitionStub')
             print "Faking out a Rekognition"
         else:
-            reko = boto3.client('rekognition')
+            reko = aws.client('rekognition')
 
         person = kwargs.get("Person")
         collection = kwargs.get("Collection", "")
@@ -0,0 +1,87 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""shared boto3 clients and resources.
+
+one session for the whole process, built under a lock, and one client or
+resource per service/endpoint/region built from it and reused by every
+thread for the life of the process, along with its connection pool.
+botocore clients are thread safe; the resources are only used for their
+actions (Table.query, Table.update_item, ...), which go straight through
+to the client, never for lazily loaded attributes"""
+import os
+import threading
+import boto3
+from botocore.config import Config
+
+MAX_POOL_CONNECTIONS = 25
+MAX_RETRY_ATTEMPTS = 5
+
+_lock = threading.Lock()
+_env = None
+_session = None
+_objects = {}
+
+
+def config():
+    return Config(max_pool_connections=MAX_POOL_CONNECTIONS,
+                  retries={'max_attempts': MAX_RETRY_ATTEMPTS})
+
+
+def _check_env():
+    # the cli picks the profile/region through the environment, so a
+    # change there has to start over with a new session. called with the
+    # lock held
+    global _env, _session, _objects
+    env = (os.environ.get('AWS_PROFILE'), os.environ.get('AWS_DEFAULT_REGION'))
+    if _env != env or _session is None:
+        _env = env
+        _session = boto3.session.Session()
+        _objects = {}
+
+
+def client(service_name, **kwargs):
+    """the shared client for service_name. EndpointUrl and Region pick a
+    different endpoint"""
+    return _get('client', service_name, **kwargs)
+
+
+def resource(service_name, **kwargs):
+    return _get('resource', service_name, **kwargs)
+
+
+def _get(kind, service_name, **kwargs):
+    key = (kind, service_name, kwargs.get('EndpointUrl'),
+           kwargs.get('Region'))
+    env = (os.environ.get('AWS_PROFILE'), os.environ.get('AWS_DEFAULT_REGION'))
+    obj = _objects.get(key)
+    if obj is not None and _env == env:
+        return obj
+    with _lock:
+        _check_env()
+        obj = _objects.get(key)
+        if obj is None:
+            # building clients from one session isn't thread safe
+            factory = _session.client if kind == 'client' \
+                else _session.resource
+            obj = factory(service_name, endpoint_url=key[2],
+                          region_name=key[3], config=config())
+            _objects[key] = obj
+        return obj
+
+
+def reset():
+    """drop the session and every client and resource"""
+    global _env, _session, _objects
+    with _lock:
+        _env = None
+        _session = None
+        _objects = {}
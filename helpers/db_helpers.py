@@ -9,13 +9,23 @@
 # or implied. See the License for the specific language governing permissions 
 # and limitations under the License.
 
-import boto3
+from helpers import aws
+import sys
+import threading
+import Queue
+
+# number of parallel Segment/TotalSegments workers used by scan_table
+DEFAULT_SCAN_SEGMENTS = 4
+# items buffered between the scan workers and the consumer
+SCAN_BUFFER_SIZE = 1000
+
+_SEGMENT_DONE = object()
 
 
 def does_table_exist(table_name):
     table_exists = False
     try:
-        client = boto3.client('dynamodb')
+        client = aws.client('dynamodb')
         client.describe_table(TableName=table_name)
         table_exists = True
 
@@ -27,5 +37,76 @@ def does_table_exist(table_name):
 
 
 def validate_table(table_name, create_table):
-    if (not does_table_exist(table_name)):
-        create_table()
+    # only the first call per table in a process goes to DynamoDB
+    from schema import schema_registry
+    schema_registry.ensure(table_name, create_table)
+
+
+class _SegmentError(object):
+    # the worker's sys.exc_info(), so the traceback survives the hand-off
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+def _scan_segment(table_name, segment, total_segments, scan_kwargs, items,
+                  stop, endpoint_url):
+    try:
+        table = aws.resource('dynamodb', EndpointUrl=endpoint_url) \
+            .Table(table_name)
+        kwargs = dict(scan_kwargs)
+        if total_segments > 1:
+            kwargs['Segment'] = segment
+            kwargs['TotalSegments'] = total_segments
+        while not stop.is_set():
+            response = table.scan(**kwargs)
+            for item in response['Items']:
+                _put(items, item, stop)
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    except Exception:
+        _put(items, _SegmentError(sys.exc_info()), stop)
+    finally:
+        _put(items, _SEGMENT_DONE, stop)
+
+
+def _put(items, value, stop):
+    while not stop.is_set():
+        try:
+            items.put(value, timeout=0.5)
+            return
+        except Queue.Full:
+            continue
+
+
+def scan_table(table_name, **kwargs):
+    """scan a whole table, following LastEvaluatedKey, split into parallel
+    segments. items are yielded as soon as any segment returns them, so the
+    order isn't stable. any other kwargs (FilterExpression,
+    ProjectionExpression, ...) are passed on to every scan call"""
+    total_segments = kwargs.pop('Segments', DEFAULT_SCAN_SEGMENTS)
+    endpoint_url = kwargs.pop('EndpointUrl', None)
+    items = Queue.Queue(maxsize=SCAN_BUFFER_SIZE)
+    stop = threading.Event()
+    workers = []
+    for segment in range(total_segments):
+        t = threading.Thread(target=_scan_segment,
+                             args=(table_name, segment, total_segments,
+                                   kwargs, items, stop, endpoint_url))
+        t.daemon = True
+        t.start()
+        workers.append(t)
+
+    done = 0
+    try:
+        while done < total_segments:
+            item = items.get()
+            if item is _SEGMENT_DONE:
+                done += 1
+            elif isinstance(item, _SegmentError):
+                exc_type, exc_value, exc_traceback = item.exc_info
+                raise exc_type, exc_value, exc_traceback
+            else:
+                yield item
+    finally:
+        stop.set()
@@ -0,0 +1,183 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""process-wide cache of compiled recurrence rules"""
+import copy
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from dateutil.rrule import rrulestr
+from icalendar import Calendar
+
+RULE_CACHE_SIZE = 4096
+
+# rules made only of these parts have evenly spaced occurrences
+SIMPLE_RULE_PERIODS = {
+    'WEEKLY': 7 * 24 * 60 * 60,
+    'DAILY': 24 * 60 * 60,
+    'HOURLY': 60 * 60,
+    'MINUTELY': 60
+}
+SIMPLE_RULE_PARTS = set(['FREQ', 'INTERVAL', 'COUNT', 'WKST'])
+
+
+class SimpleRule(object):
+    """a FREQ=WEEKLY/DAILY/HOURLY/MINUTELY rule with a fixed INTERVAL and
+    no BY* parts. occurrences are dtstart + k * period, so after/before are
+    computed directly instead of walking every occurrence since dtstart.
+    matches dateutil's rrule for the same rule"""
+    def __init__(self, dtstart, freq, interval=1, count=None):
+        # dateutil drops the microseconds, so occurrences are whole seconds
+        self.dtstart = dtstart.replace(microsecond=0)
+        self.period = timedelta(seconds=SIMPLE_RULE_PERIODS[freq] * interval)
+        self.count = count
+
+    def _occurrence(self, k):
+        if k < 0 or (self.count is not None and k >= self.count):
+            return None
+        return self.dtstart + self.period * k
+
+    def _index(self, dt):
+        # index of the last occurrence at or before dt (-1 before dtstart)
+        return int((_micros(dt - self.dtstart)) //
+                   _micros(self.period))
+
+    def after(self, dt, inc=False):
+        k = self._index(dt)
+        occurrence = self._occurrence(k)
+        if not (inc and occurrence is not None and occurrence == dt):
+            k += 1
+        return self._occurrence(max(k, 0))
+
+    def before(self, dt, inc=False):
+        k = self._index(dt)
+        if self.count is not None:
+            k = min(k, self.count - 1)
+        occurrence = self._occurrence(k)
+        if occurrence is not None and occurrence == dt and not inc:
+            k -= 1
+        return self._occurrence(k)
+
+    def between(self, after, before, inc=False):
+        occurrences = []
+        occurrence = self.after(after, inc=inc)
+        while occurrence is not None and \
+                (occurrence < before or (inc and occurrence == before)):
+            occurrences.append(occurrence)
+            occurrence = self.after(occurrence)
+        return occurrences
+
+
+def _micros(delta):
+    return (delta.days * 86400 + delta.seconds) * 1000000 + \
+        delta.microseconds
+
+
+def has_fixed_offset(dt):
+    # dateutil walks rules in wall-clock time, so evenly spaced occurrences
+    # only hold when the offset can't change (UTC, EST, ...)
+    if dt.tzinfo is None:
+        return True
+    offset = dt.utcoffset()
+    return all(dt.tzinfo.utcoffset(dt + timedelta(days=d)) == offset
+               for d in (91, 182, 273))
+
+
+class RuleCache(object):
+    """bounded LRU of (ical, dtstart, skip) -> compiled rule. the value is
+    None when the ical has no RRULE, so those are cached too"""
+    def __init__(self, **kwargs):
+        self.max_size = kwargs.get('MaxSize', RULE_CACHE_SIZE)
+        self.rules = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, ical, dtstart, skip=0):
+        key = (ical, dtstart, skip)
+        with self.lock:
+            if key in self.rules:
+                self.hits += 1
+                rule = self.rules.pop(key)
+                self.rules[key] = rule
+                return rule
+            self.misses += 1
+        rule = compile_rule(ical, dtstart, skip)
+        with self.lock:
+            self.rules[key] = rule
+            while len(self.rules) > self.max_size:
+                self.rules.popitem(last=False)
+        return rule
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': len(self.rules),
+                    'max_size': self.max_size}
+
+    def clear(self):
+        with self.lock:
+            self.rules.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def compile_rule(ical, dtstart, skip=0):
+    """compile the RRULE in ical anchored at dtstart. skip is the number of
+    occurrences already consumed before dtstart, which only matters for
+    rules with a COUNT"""
+    cal = Calendar.from_ical(ical)
+    recur = cal.get('RRULE')
+    if not recur:
+        return None
+    count = recur.get('COUNT', [None])[0]
+    if count is not None:
+        count = int(count) - skip
+        if count <= 0:
+            return None
+    if set(recur.keys()) <= SIMPLE_RULE_PARTS and \
+            recur['FREQ'][0] in SIMPLE_RULE_PERIODS and \
+            has_fixed_offset(dtstart):
+        return SimpleRule(dtstart, recur['FREQ'][0],
+                          int(recur.get('INTERVAL', [1])[0]), count)
+    if skip:
+        recur = copy.deepcopy(recur)
+        recur['COUNT'] = [count]
+    return rrulestr(recur.to_ical(), dtstart=dtstart)
+
+
+def advance_cursor(ical, dtstart, dt, cursor=None, skip=0):
+    """move an occurrence cursor forward to the last occurrence at or before
+    dt. returns (cursor, skip) where skip counts the occurrences before the
+    cursor. walking starts at the old cursor instead of dtstart, so each
+    call only pays for the occurrences since the previous one"""
+    anchor = cursor or dtstart
+    rule = get_rule(ical, anchor, skip)
+    if rule is None or isinstance(rule, SimpleRule):
+        return cursor, skip
+    occurrence = rule.before(dt, inc=True)
+    if occurrence is None or occurrence == anchor:
+        return cursor, skip
+    if getattr(rule, '_count', None):
+        skip += len(rule.between(anchor, occurrence, inc=True)) - 1
+    return occurrence, skip
+
+
+rule_cache = RuleCache()
+
+
+def get_rule(ical, dtstart, skip=0):
+    return rule_cache.get(ical, dtstart, skip)
+
+
+def rule_cache_stats():
+    return rule_cache.stats()
@@ -0,0 +1,115 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""validates (and creates) each DynamoDB table once"""
+import logging
+import os
+import threading
+
+# written by `pollexy schema ensure`; tables listed here are trusted
+# without a DescribeTable until the marker is removed
+SCHEMA_MARKER = os.environ.get(
+    'POLLEXY_SCHEMA_MARKER',
+    os.path.join(os.path.expanduser('~'), '.pollexy', 'schema'))
+
+
+def table_key(table_name):
+    # the same table name means a different table in another region
+    return '{}/{}'.format(os.environ.get('AWS_DEFAULT_REGION', ''),
+                          table_name)
+
+
+class SchemaRegistry(object):
+    """remembers which tables this process has validated, so only the
+    first manager that needs a table pays for the DescribeTable"""
+    def __init__(self, **kwargs):
+        self.marker_path = kwargs.get('MarkerPath', SCHEMA_MARKER)
+        self.use_marker = kwargs.get('UseMarker', True)
+        self.validated = set()
+        # steps are never written to the marker, see ensure_step
+        self.steps = set()
+        self.lock = threading.Lock()
+        self._marked = None
+
+    def ensure(self, table_name, create_table, **kwargs):
+        """create table_name with create_table unless it's known to
+        exist. Force skips both the memo and the marker"""
+        from db_helpers import does_table_exist
+        force = kwargs.get('Force', False)
+        key = table_key(table_name)
+        if not force and key in self.validated:
+            return
+        with self.lock:
+            known = key in self.validated or \
+                (self.use_marker and key in self.marked())
+            if not force and known:
+                self.validated.add(key)
+                return
+            if not does_table_exist(table_name):
+                logging.info('Creating table {}'.format(table_name))
+                create_table()
+            self.validated.add(key)
+
+    def ensure_step(self, name, step):
+        """run step, a check such as an index backfill, until it returns
+        True. it runs in every process, whatever the marker says: the
+        marker only vouches for tables, and the step may have work to do
+        that a previous process didn't"""
+        if name in self.steps:
+            return True
+        with self.lock:
+            if name in self.steps:
+                return True
+            if not step():
+                return False
+            self.steps.add(name)
+            return True
+
+    def marked(self):
+        if self._marked is None:
+            try:
+                with open(self.marker_path) as f:
+                    self._marked = set(line.strip() for line in f
+                                       if line.strip())
+            except IOError:
+                self._marked = set()
+        return self._marked
+
+    def write_marker(self):
+        """record every table validated so far for later processes.
+        returns the tables recorded, or None when the marker can't be
+        written (a read-only home, as on Lambda)"""
+        tables = self.marked() | self.validated
+        try:
+            folder = os.path.dirname(self.marker_path)
+            if folder and not os.path.isdir(folder):
+                os.makedirs(folder)
+            with open(self.marker_path, 'w') as f:
+                f.write('\n'.join(sorted(tables)) + '\n')
+        except (IOError, OSError) as e:
+            logging.warn('Could not write schema marker {}: {}'
+                         .format(self.marker_path, e))
+            return None
+        self._marked = tables
+        return tables
+
+    def clear(self, **kwargs):
+        """forget the memo; RemoveMarker also deletes the marker file"""
+        with self.lock:
+            self.validated.clear()
+            self.steps.clear()
+            self._marked = None
+            if kwargs.get('RemoveMarker') and \
+                    os.path.exists(self.marker_path):
+                os.remove(self.marker_path)
+
+
+schema_registry = SchemaRegistry()
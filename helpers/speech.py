@@ -16,23 +16,31 @@ from helpers.weather import Weather
 class SpeechHelper(object):
     def __init__(self, **kwargs):
         self.person = kwargs.get('PersonName', '')
+        # when the speech will be heard, for speech rendered ahead of time
+        self.at = kwargs.get('At')
+        self.weather = None
 
     def replace_tokens(self, msg):
         msg = msg.replace('{person}', self.person)
         msg = msg.replace('{greeting}', self.greeting())
 
         if '{weather}' in msg:
-            w = Weather()
-            msg = msg.replace('{weather}', w.describe())
+            # one forecast per helper, however many messages ask for it
+            if self.weather is None:
+                self.weather = Weather().describe()
+            msg = msg.replace('{weather}', self.weather)
         msg = msg.replace('{datetime}', self.time_and_date())
         return msg
 
+    def now(self):
+        return arrow.get(self.at) if self.at else arrow.utcnow()
+
     def time_and_date(self):
-        d = arrow.utcnow().format('dddd, MMMM DD, YYYY')
+        d = self.now().format('dddd, MMMM DD, YYYY')
         return "Today is {}.".format(d)
 
     def greeting(self):
-        d = arrow.now()
+        d = self.now().to('local')
         if d.hour < 12:
             tod = "morning"
         elif 12 <= d.hour < 18:
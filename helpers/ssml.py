@@ -0,0 +1,104 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""builds <speak> documents out of paragraphs, split to fit Polly"""
+import re
+from xml.sax.saxutils import escape
+
+# Polly bills at most 3000 characters of a request, and rejects anything
+# over 6000 with the tags counted; keeping whole documents to 3000 stays
+# clear of both
+SSML_MAX_CHARACTERS = 3000
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+WHITESPACE = re.compile(r'\s+')
+
+
+class SsmlComposer(object):
+    """collects paragraphs of plain text and writes them out as one
+    <speak> document, or as a run of documents each no longer than
+    MaxCharacters. documents split between paragraphs where they can,
+    between sentences where a paragraph is too long on its own, and
+    between words as a last resort"""
+    def __init__(self, **kwargs):
+        self.max_characters = kwargs.get('MaxCharacters', SSML_MAX_CHARACTERS)
+        self.paragraphs = []
+
+    def __len__(self):
+        return len(self.paragraphs)
+
+    def paragraph(self, text):
+        text = (text or '').strip()
+        if text:
+            self.paragraphs.append(escape(text))
+        return self
+
+    def document(self):
+        """everything in a single document, however long"""
+        if not self.paragraphs:
+            return None
+        return self._speak([u'<p>{}</p>'.format(p) for p in self.paragraphs])
+
+    def documents(self):
+        """everything, in documents short enough for one Polly request"""
+        # room for <speak></speak> and <p></p>
+        room = self.max_characters - len('<speak></speak>') - len('<p></p>')
+        documents = []
+        current = []
+        length = len('<speak></speak>')
+        for p in self.paragraphs:
+            for piece in self._split(p, room):
+                tagged = u'<p>{}</p>'.format(piece)
+                if current and length + len(tagged) > self.max_characters:
+                    documents.append(self._speak(current))
+                    current, length = [], len('<speak></speak>')
+                current.append(tagged)
+                length += len(tagged)
+        if current:
+            documents.append(self._speak(current))
+        return documents
+
+    def _speak(self, tagged):
+        return u'<speak>{}</speak>'.format(''.join(tagged))
+
+    def _split(self, text, room):
+        if len(text) <= room:
+            return [text]
+        pieces = []
+        for sentence in SENTENCE_END.split(text):
+            if len(sentence) > room:
+                pieces.extend(self._pack(WHITESPACE.split(sentence), room))
+            else:
+                pieces.append(sentence)
+        return self._pack(pieces, room)
+
+    def _pack(self, words, room):
+        """join words with spaces into as few pieces as fit in room. a
+        word longer than room is cut"""
+        pieces = []
+        current = ''
+        for word in words:
+            while len(word) > room:
+                if current:
+                    pieces.append(current)
+                    current = ''
+                # don't cut an escaped character in half
+                cut = word.rfind('&', 0, room)
+                cut = cut if cut > 0 and ';' not in word[cut:room] else room
+                pieces.append(word[:cut])
+                word = word[cut:]
+            if current and len(current) + 1 + len(word) > room:
+                pieces.append(current)
+                current = word
+            else:
+                current = u'{} {}'.format(current, word) if current else word
+        if current:
+            pieces.append(current)
+        return pieces
@@ -1,6 +1,6 @@
 #!/usr/bin/python
 import yaml
-import boto3
+from helpers import aws
 import os
 import pprint
 import time
@@ -13,7 +13,7 @@ from botocore.exceptions import ClientError
 
 class LexSlotManager:
     def __init__(self, **kwargs):
-        self.client = boto3.client('lex-models')
+        self.client = aws.client('lex-models')
         self.config_path = kwargs.get('ConfigPath')
 
     def load(self):
@@ -74,7 +74,7 @@ class LexSlotManager:
 
 class LexIntentManager:
     def __init__(self, **kwargs):
-        self.client = boto3.client('lex-models')
+        self.client = aws.client('lex-models')
         self.config_path = kwargs.get('ConfigPath')
 
     def load(self):
@@ -145,7 +145,7 @@ class LexIntentManager:
 
 class LexBotManager:
     def __init__(self, **kwargs):
-        self.client = boto3.client('lex-models')
+        self.client = aws.client('lex-models')
         self.config_path = kwargs.get('ConfigPath')
         pass
 
@@ -171,7 +171,7 @@ class LexBotManager:
         self.versionOrAlias = kwargs.get('VersionOrAlias', '$LATEST')
         print 'Getting bot {}:{}'.format(self.name, self.versionOrAlias)
         try:
-            client = boto3.client('lex-models')
+            client = aws.client('lex-models')
             resp = client.get_bot(
                 name=self.name,
                 versionOrAlias=self.versionOrAlias
@@ -304,7 +304,7 @@ class LexBot(object):
         self.bot_name = kwargs.get('BotName')
         self.voice_id = kwargs.get('VoiceId', 'Joanna')
         self.last_response = {}
-        self.client = boto3.client('lex-runtime')
+        self.client = aws.client('lex-runtime')
         self.restart = False
         self.ice_breaker = kwargs.get('IceBreaker')
         self.load_bot()
@@ -491,7 +491,7 @@ class LexPlayer(object):
         self.no_audio = bool(kwargs.get('NoAudio', False))
         self.history = []
         self.voice_id = kwargs.get('VoiceId', 'Joanna')
-        self.client = boto3.client('lex-runtime')
+        self.client = aws.client('lex-runtime')
         introduction = kwargs.get('Introduction', '')
         if kwargs.get('BotsRequired'):
             self.bots_required = kwargs.get('BotsRequired').split(',')
@@ -9,7 +9,7 @@
 # or implied. See the License for the specific language governing permissions 
 # and limitations under the License.
 
-import boto3
+from helpers import aws
 from helpers.db_helpers import validate_table
 from boto3.dynamodb.conditions import Key
 
@@ -30,7 +30,7 @@ class LocationManager(object):
         return Location(Name=item['name'])
 
     def create__table(self):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.create_table(
                     TableName=LOCATION_TABLE,
                     KeySchema=[
@@ -48,7 +48,7 @@ class LocationManager(object):
             .wait(TableName=LOCATION_TABLE)
 
     def get_location(self, name):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(LOCATION_TABLE)
         response = table.query(
             Select='ALL_ATTRIBUTES',
@@ -59,7 +59,7 @@ class LocationManager(object):
             return self.convert_to_person(response['Items'][0])
 
     def get_all(self):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         response = dynamodb.scan(
             Select='ALL_ATTRIBUTES',
             TableName=LOCATION_TABLE)
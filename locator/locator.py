@@ -10,13 +10,14 @@
 # and limitations under the License.
 
 import arrow
-import boto3
+from helpers import aws
 import json
-from helpers.db_helpers import validate_table
+from helpers.db_helpers import validate_table, scan_table
 from boto3.dynamodb.conditions import Key
 from babylex import LexSession
 from person.person import PersonManager
 from time_window import TimeWindow, TimeWindowSet
+from time_window.timeline import availability_timeline, location_key
 import logging
 import uuid
 import random
@@ -46,7 +47,7 @@ class LocationAvailability(object):
         self.input_capabilities = {}
 
     def add_window(self, w):
-        self.time_windows.set_list.append(w)
+        self.time_windows.add_time_window(w)
 
     def add_input_capability(self, **kwargs):
         id = kwargs.get('HardwareId', str(uuid.uuid4()))
@@ -68,7 +69,8 @@ class LocationAvailability(object):
     def is_available(self, dt=None):
         if not dt:
             dt = arrow.utcnow()
-        return self.time_windows.is_available(dt=dt)
+        return availability_timeline.is_available(
+            location_key(self.location_name), self.time_windows, dt)
 
 
 class LocationStatus(object):
@@ -83,7 +85,7 @@ class LocationManager(object):
         validate_table(LOCATION_TABLE, self.create_location_table)
 
     def create_location_table(self):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.create_table(
                     TableName=LOCATION_TABLE,
                     KeySchema=[
@@ -108,7 +110,7 @@ class LocationManager(object):
 
     def upsert(self, **kwargs):
         name = kwargs.get('Name')
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(LOCATION_TABLE)
         table.update_item(
             Key={
@@ -122,7 +124,7 @@ class LocationManager(object):
 
     def delete(self, **kwargs):
         name = kwargs.get('Name')
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(LOCATION_TABLE)
         table.delete_item(
             Key={
@@ -131,7 +133,7 @@ class LocationManager(object):
         )
 
     def update_location_activity(self, loc_name):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(LOCATION_TABLE)
         table.update_item(
             Key={
@@ -144,7 +146,7 @@ class LocationManager(object):
         )
 
     def toggle_mute(self, loc_name, is_muted=False):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(LOCATION_TABLE)
         table.update_item(
             Key={
@@ -157,7 +159,7 @@ class LocationManager(object):
         )
 
     def update_input_capabilities(self, loc_avail):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(LOCATION_TABLE)
         table.update_item(
             Key={
@@ -170,7 +172,7 @@ class LocationManager(object):
         )
 
     def update_window_set(self, loc_avail):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(LOCATION_TABLE)
         table.update_item(
             Key={
@@ -181,6 +183,8 @@ class LocationManager(object):
                 ':ws': loc_avail.time_windows.to_json(),
             }
         )
+        availability_timeline.update(location_key(loc_avail.location_name),
+                                     loc_avail.time_windows)
 
     def convert_to_loc_avail(self, db_loc):
         la = LocationAvailability()
@@ -216,7 +220,7 @@ class LocationManager(object):
         return la
 
     def get_location(self, loc_name):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(LOCATION_TABLE)
         response = table.query(
             Select='ALL_ATTRIBUTES',
@@ -227,18 +231,11 @@ class LocationManager(object):
             return self.convert_to_loc_avail(response['Items'][0])
 
     def get_all(self):
-        dynamodb = boto3.client('dynamodb')
-        response = dynamodb.scan(
-            Select='ALL_ATTRIBUTES',
-            TableName=LOCATION_TABLE)
-
-        locs = []
-        if len(response['Items']) == 0:
+        locs = [self.convert_to_loc_avail(i)
+                for i in scan_table(LOCATION_TABLE)]
+        if len(locs) == 0:
             return None
-        else:
-            for i in response['Items']:
-                locs.append(self.convert_to_loc_avail(i))
-            return locs
+        return locs
 
 
 class LocationVerification(object):
@@ -0,0 +1,177 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""buffers deletes and visibility changes for received SQS messages"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from helpers import aws
+
+# delete_message_batch/change_message_visibility_batch take ten entries
+ACK_BATCH_SIZE = 10
+# flush before the default 30s visibility timeout hands the message to
+# someone else and our receipt handle goes stale
+ACK_DEADLINE_SECONDS = 20
+
+
+class AckFailure(object):
+    def __init__(self, message, action, code, error):
+        self.message = message
+        self.action = action
+        self.code = code
+        self.error = error
+
+
+class AckResult(object):
+    def __init__(self):
+        self.deleted = 0
+        self.released = 0
+        self.failed = []
+
+    @property
+    def succeeded(self):
+        return not self.failed
+
+
+class AckBuffer(object):
+    """collects acknowledgements for received messages (anything with
+    queue_url and receipt_handle) and sends them ten per call. pending acks
+    are flushed by flush(), or by a timer once DeadlineSeconds have passed
+    since the oldest one. a message being deleted stays held by Heartbeat
+    (a VisibilityHeartbeat) until its delete has gone out"""
+    def __init__(self, **kwargs):
+        self.log = logging.getLogger("AckBuffer")
+        if os.environ.get('LOG_LEVEL') == 'DEBUG':
+            self.log.setLevel(logging.DEBUG)
+        self.deadline_seconds = kwargs.get('DeadlineSeconds',
+                                           ACK_DEADLINE_SECONDS)
+        self.heartbeat = kwargs.get('Heartbeat')
+        # the timer sends from its own thread
+        self.lock = threading.RLock()
+        self.timer = None
+        self.deletes = OrderedDict()
+        self.releases = OrderedDict()
+        self.oldest = None
+        self.result = AckResult()
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(v) for v in self.deletes.values()) + \
+                sum(len(v) for v in self.releases.values())
+
+    def delete(self, message):
+        self._add(self.deletes, message, None)
+
+    def release(self, message, **kwargs):
+        """make message visible again after VisibilityTimeout seconds
+        (0, straight away, by default)"""
+        self._add(self.releases, message, kwargs.get('VisibilityTimeout', 0))
+
+    def extend(self, message, timeout):
+        """keep message hidden for another timeout seconds"""
+        self._add(self.releases, message, timeout)
+
+    def _add(self, pending, message, timeout):
+        with self.lock:
+            pending.setdefault(message.queue_url, []).append(
+                (message, timeout))
+            if self.oldest is None:
+                self.oldest = time.time()
+            if self.overdue():
+                self._send()
+            else:
+                self._arm(self.deadline_seconds)
+
+    def _arm(self, seconds):
+        # called with the lock held
+        if self.timer is None:
+            self.timer = threading.Timer(seconds, self._deadline)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _deadline(self):
+        with self.lock:
+            self.timer = None
+            try:
+                if self.overdue():
+                    self._send()
+                elif self.oldest is not None:
+                    self._arm(self.deadline_seconds -
+                              (time.time() - self.oldest))
+            except Exception as e:
+                self.log.error('Could not send acks: {}'.format(e))
+
+    def overdue(self):
+        return self.oldest is not None and \
+            time.time() - self.oldest >= self.deadline_seconds
+
+    def flush(self):
+        """send every pending ack. returns the AckResult for everything
+        sent since the last flush; failures are also logged"""
+        with self.lock:
+            self._send()
+            result, self.result = self.result, AckResult()
+            return result
+
+    def flush_releases(self):
+        """send just the pending releases, leaving deletes buffered"""
+        with self.lock:
+            releases, self.releases = self.releases, OrderedDict()
+            self._send_releases(aws.client('sqs'), releases)
+            if not self.deletes:
+                self.oldest = None
+
+    def _send(self):
+        client = aws.client('sqs')
+        deletes, self.deletes = self.deletes, OrderedDict()
+        releases, self.releases = self.releases, OrderedDict()
+        self.oldest = None
+        for url, acks in deletes.items():
+            for i in range(0, len(acks), ACK_BATCH_SIZE):
+                batch = acks[i:i + ACK_BATCH_SIZE]
+                try:
+                    response = client.delete_message_batch(
+                        QueueUrl=url,
+                        Entries=[{'Id': str(n),
+                                  'ReceiptHandle': m.receipt_handle}
+                                 for n, (m, _) in enumerate(batch)])
+                finally:
+                    # deleted, or left to come back on its own
+                    if self.heartbeat is not None:
+                        for m, _ in batch:
+                            self.heartbeat.drop(m)
+                self.result.deleted += self._check('delete', batch, response)
+        self._send_releases(client, releases)
+
+    def _send_releases(self, client, releases):
+        for url, acks in releases.items():
+            for i in range(0, len(acks), ACK_BATCH_SIZE):
+                batch = acks[i:i + ACK_BATCH_SIZE]
+                response = client.change_message_visibility_batch(
+                    QueueUrl=url,
+                    Entries=[{'Id': str(n),
+                              'ReceiptHandle': m.receipt_handle,
+                              'VisibilityTimeout': timeout}
+                             for n, (m, timeout) in enumerate(batch)])
+                self.result.released += self._check('release', batch,
+                                                    response)
+
+    def _check(self, action, batch, response):
+        for f in response.get('Failed', []):
+            message = batch[int(f['Id'])][0]
+            self.log.error('Could not {} message {}: {}'
+                           .format(action, message.receipt_handle,
+                                   f.get('Message') or f['Code']))
+            self.result.failed.append(
+                AckFailure(message, action, f['Code'], f.get('Message')))
+        return len(response.get('Successful', []))
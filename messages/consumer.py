@@ -0,0 +1,176 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""long-polling, prefetching reader for a location's queues"""
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from message import QueuedMessage
+from queue_registry import queue_registry, queue_names, fifo_queues
+from acks import AckBuffer
+from envelope import ENVELOPE_ATTRIBUTE
+
+# the longest wait SQS allows for a receive
+LONG_POLL_SECONDS = 20
+RECEIVE_BATCH_SIZE = 10
+PREFETCH_LIMIT = 30
+# how long we hide a message for on receive (and on every extension)
+VISIBILITY_TIMEOUT_SECONDS = 30
+# extend when a buffered message has less than this left
+VISIBILITY_MARGIN_SECONDS = 10
+# a message nobody has asked for goes back to the queue after this long.
+# well under the visibility timeout, so a message for someone else is kept
+# from other devices for less time than a receive that skipped it would
+PREFETCH_HOLD_SECONDS = 10
+# the envelope, and the attributes it replaced for messages published
+# before it
+MESSAGE_ATTRIBUTES = [ENVELOPE_ATTRIBUTE,
+                      'NoMoreOccurrences',
+                      'ExpirationDateTimeInUtc',
+                      'PersonName',
+                      'Voice',
+                      'BotNames',
+                      'RequiredBots',
+                      'IceBreaker',
+                      'UUID']
+
+
+class BufferedMessage(object):
+    def __init__(self, message, visibility_timeout):
+        self.message = message
+        self.queued = QueuedMessage(QueuedMessage=message)
+        self.received = time.time()
+        self.visible_at = self.received + visibility_timeout
+
+
+class QueueConsumer(object):
+    """receives ten messages at a time from a location's message and bot
+    queues, waiting up to WaitTimeSeconds for them, and keeps what the
+    caller didn't ask for (up to MaxBuffered) for the next take. buffered
+    messages stay hidden until HoldSeconds, then go back to the queue"""
+    def __init__(self, **kwargs):
+        self.log = logging.getLogger("QueueConsumer")
+        if os.environ.get('LOG_LEVEL') == 'DEBUG':
+            self.log.setLevel(logging.DEBUG)
+        location_name = kwargs.get('LocationName', '').lower()
+        if not location_name:
+            raise ValueError('Missing location name')
+        self.wait_time_seconds = kwargs.get('WaitTimeSeconds',
+                                            LONG_POLL_SECONDS)
+        self.max_buffered = kwargs.get('MaxBuffered', PREFETCH_LIMIT)
+        self.visibility_timeout = kwargs.get('VisibilityTimeout',
+                                             VISIBILITY_TIMEOUT_SECONDS)
+        self.hold_seconds = kwargs.get('HoldSeconds', PREFETCH_HOLD_SECONDS)
+        self.acks = kwargs.get('Acks') or AckBuffer()
+        # a VisibilityHeartbeat takes over extending buffered messages
+        self.keepalive = kwargs.get('Heartbeat')
+        queue_name, bot_queue_name = queue_names(
+            location_name, kwargs.get('Fifo', fifo_queues()))
+        self.queues = {
+            'Message': queue_registry.get_queue(queue_name, Create=True),
+            'Bot': queue_registry.get_queue(bot_queue_name, Create=True)
+        }
+        # (message type, person name) -> BufferedMessages, oldest first
+        self.buffer = OrderedDict()
+        self.receives = 0
+        self.empty_receives = 0
+
+    def __len__(self):
+        return sum(len(v) for v in self.buffer.values())
+
+    def poll(self, message_type, wait_time_seconds=None):
+        """one receive into the buffer. returns the number received"""
+        if wait_time_seconds is None:
+            wait_time_seconds = self.wait_time_seconds
+        room = self.max_buffered - len(self)
+        if room <= 0:
+            # nothing can be received until a buffered message is taken or
+            # given back, so wait as a receive would instead of spinning
+            oldest = min(b.received for q in self.buffer.values()
+                         for b in q)
+            time.sleep(max(0, min(wait_time_seconds,
+                                  oldest + self.hold_seconds - time.time())))
+            self.heartbeat()
+            room = self.max_buffered - len(self)
+            if room <= 0:
+                return 0
+        messages = self.queues[message_type].receive_messages(
+            MessageAttributeNames=MESSAGE_ATTRIBUTES,
+            VisibilityTimeout=self.visibility_timeout,
+            WaitTimeSeconds=wait_time_seconds,
+            MaxNumberOfMessages=min(RECEIVE_BATCH_SIZE, room))
+        self.receives += 1
+        if not messages:
+            self.empty_receives += 1
+        for m in messages:
+            b = BufferedMessage(m, self.visibility_timeout)
+            if self.keepalive is not None:
+                self.keepalive.hold(m)
+            self.buffer.setdefault((message_type, b.queued.person_name),
+                                   deque()).append(b)
+        self.log.debug('Received {} {} messages, {} buffered'
+                       .format(len(messages), message_type, len(self)))
+        return len(messages)
+
+    def take(self, **kwargs):
+        """every buffered message of MessageType for PersonName (anyone
+        if not given), receiving once if none are buffered"""
+        person_name = kwargs.get('PersonName', '')
+        message_type = kwargs.get('MessageType', 'Message')
+        taken = self._pop(message_type, person_name)
+        if not taken:
+            self.poll(message_type, kwargs.get('WaitTimeSeconds'))
+            taken = self._pop(message_type, person_name)
+        self.heartbeat()
+        return taken
+
+    def _pop(self, message_type, person_name):
+        taken = []
+        for key in self.buffer.keys():
+            if key[0] == message_type and \
+                    (not person_name or key[1] == person_name):
+                taken.extend(self.buffer.pop(key))
+        return taken
+
+    def heartbeat(self):
+        """extend buffered messages that are about to reappear and give
+        back the ones held too long"""
+        now = time.time()
+        for key in self.buffer.keys():
+            kept = deque()
+            for b in self.buffer[key]:
+                if now - b.received >= self.hold_seconds:
+                    self.release(b.message)
+                    continue
+                if self.keepalive is None and \
+                        b.visible_at - now < VISIBILITY_MARGIN_SECONDS:
+                    self.acks.extend(b.message, self.visibility_timeout)
+                    b.visible_at = now + self.visibility_timeout
+                kept.append(b)
+            if kept:
+                self.buffer[key] = kept
+            else:
+                del self.buffer[key]
+        self.acks.flush_releases()
+
+    def close(self):
+        """hand every buffered message back to the queue"""
+        for messages in self.buffer.values():
+            for b in messages:
+                self.release(b.message)
+        self.buffer = OrderedDict()
+        self.acks.flush_releases()
+
+    def release(self, message):
+        if self.keepalive is not None:
+            self.keepalive.drop(message)
+        self.acks.release(message)
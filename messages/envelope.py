@@ -0,0 +1,64 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""the metadata of a queued message, packed into one message attribute.
+
+the attribute is a json list, version first:
+    [version, uuid, person name, expiration (utc, iso), no more occurrences
+     (0/1), voice, bot names, required bots, ice breaker, windows version,
+     after delivery]
+the person's windows travel as a version (see person.windows_version)
+rather than the whole window set. after delivery is the schedule row as it
+will be once the occurrence is spoken (see scheduler.after_delivery), so
+the acknowledgement doesn't have to read the row back. version 1 messages,
+published before it was added, decode with it empty"""
+import json
+
+ENVELOPE_ATTRIBUTE = 'Pollexy'
+ENVELOPE_VERSION = 2
+ENVELOPE_VERSIONS = (1, 2)
+ENVELOPE_FIELDS = ('uuid_key', 'person_name', 'expiration',
+                   'no_more_occurrences', 'voice_id', 'bot_names',
+                   'required_bots', 'ice_breaker', 'windows_version',
+                   'after_delivery')
+
+
+def encode(**kwargs):
+    """the message attributes holding the envelope"""
+    packed = [ENVELOPE_VERSION,
+              kwargs['UUID'],
+              kwargs['PersonName'],
+              kwargs.get('ExpirationDateTimeInUtc', ''),
+              1 if kwargs.get('NoMoreOccurrences') else 0,
+              kwargs.get('VoiceId', 'Joanna'),
+              kwargs.get('BotNames') or '',
+              kwargs.get('RequiredBots') or '',
+              kwargs.get('IceBreaker') or '',
+              kwargs.get('WindowsVersion') or '',
+              kwargs.get('AfterDelivery') or '']
+    return {ENVELOPE_ATTRIBUTE: {
+        'StringValue': json.dumps(packed, separators=(',', ':')),
+        'DataType': 'String'}}
+
+
+def decode(message_attributes):
+    """the envelope fields as a list in ENVELOPE_FIELDS order, or None if
+    the message doesn't carry an envelope"""
+    attr = (message_attributes or {}).get(ENVELOPE_ATTRIBUTE)
+    if attr is None:
+        return None
+    packed = json.loads(attr['StringValue'])
+    if packed[0] not in ENVELOPE_VERSIONS:
+        raise ValueError('Unsupported envelope version {}'.format(packed[0]))
+    fields = packed[1:]
+    fields += [''] * (len(ENVELOPE_FIELDS) - len(fields))
+    fields[3] = bool(fields[3])
+    return fields
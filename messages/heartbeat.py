@@ -0,0 +1,133 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""keeps received messages hidden while they're being worked on"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from helpers import aws
+from consumer import VISIBILITY_TIMEOUT_SECONDS
+from acks import ACK_BATCH_SIZE
+
+# extend three times per timeout, so one slow or failed call doesn't let
+# the message reappear
+HEARTBEAT_FRACTION = 3
+
+
+class VisibilityHeartbeat(object):
+    """a background thread that keeps extending the visibility of every
+    message held, until it's dropped (on ack or fail) or stop() is called.
+    a bot conversation can outlast any visibility timeout, and a message
+    that reappears mid-conversation gets delivered twice"""
+    def __init__(self, **kwargs):
+        self.log = logging.getLogger("VisibilityHeartbeat")
+        if os.environ.get('LOG_LEVEL') == 'DEBUG':
+            self.log.setLevel(logging.DEBUG)
+        self.visibility_timeout = kwargs.get('VisibilityTimeout',
+                                             VISIBILITY_TIMEOUT_SECONDS)
+        self.interval = kwargs.get('IntervalSeconds',
+                                   float(self.visibility_timeout) /
+                                   HEARTBEAT_FRACTION)
+        # receipt handle -> (message, held since)
+        self.held = OrderedDict()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.beats = 0
+        self.extensions = 0
+        self.failures = 0
+        self.longest_hold = 0.0
+
+    def hold(self, message):
+        with self.lock:
+            self.held[message.receipt_handle] = (message, time.time())
+        self.start()
+
+    def drop(self, message):
+        with self.lock:
+            entry = self.held.pop(message.receipt_handle, None)
+            if entry:
+                self.longest_hold = max(self.longest_hold,
+                                        time.time() - entry[1])
+
+    def drop_all(self):
+        with self.lock:
+            messages = [m for m, _ in self.held.values()]
+        for m in messages:
+            self.drop(m)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.held)
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None and \
+                self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.beat()
+            except Exception as e:
+                # keep beating; the next call may well succeed
+                self.log.error('Heartbeat failed: {}'.format(e))
+
+    def beat(self):
+        """extend everything held right now"""
+        with self.lock:
+            by_queue = OrderedDict()
+            for m, _ in self.held.values():
+                by_queue.setdefault(m.queue_url, []).append(m)
+            self.beats += 1
+        if not by_queue:
+            return
+        client = aws.client('sqs')
+        for url, messages in by_queue.items():
+            for i in range(0, len(messages), ACK_BATCH_SIZE):
+                batch = messages[i:i + ACK_BATCH_SIZE]
+                response = client.change_message_visibility_batch(
+                    QueueUrl=url,
+                    Entries=[{'Id': str(n),
+                              'ReceiptHandle': m.receipt_handle,
+                              'VisibilityTimeout': self.visibility_timeout}
+                             for n, m in enumerate(batch)])
+                failed = response.get('Failed', [])
+                for f in failed:
+                    self.log.warn('Could not extend message {}: {}'
+                                  .format(batch[int(f['Id'])].receipt_handle,
+                                          f.get('Message') or f['Code']))
+                with self.lock:
+                    self.extensions += len(response.get('Successful', []))
+                    self.failures += len(failed)
+
+    def stats(self):
+        with self.lock:
+            now = time.time()
+            return {'held': len(self.held),
+                    'beats': self.beats,
+                    'extensions': self.extensions,
+                    'failures': self.failures,
+                    'longest_hold': max([self.longest_hold] +
+                                        [now - t for _, t
+                                         in self.held.values()])}
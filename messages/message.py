@@ -14,12 +14,30 @@ the message object
 """
 import uuid
 import arrow
-from dateutil.rrule import rrulestr
 from helpers.datetime_helpers import check_if_timezone_naive
-from icalendar import Event, Calendar
+from helpers.recurrence import get_rule, advance_cursor
+from icalendar import Event
+from envelope import ENVELOPE_FIELDS, decode
 import logging
 
 
+def legacy_fields(ma):
+    """envelope fields from one message attribute per field"""
+    def value(name, default=''):
+        attr = ma.get(name)
+        return attr.get('StringValue') if attr else default
+    return [value('UUID', None),
+            value('PersonName'),
+            value('ExpirationDateTimeInUtc', None),
+            value('NoMoreOccurrences') == 'True',
+            value('Voice', 'Joanna'),
+            value('BotNames'),
+            value('RequiredBots'),
+            value('IceBreaker'),
+            '',
+            '']
+
+
 class ScheduledMessage(object):
     def __init__(self, **kwargs):
         self.uuid_key = kwargs.pop("UUID", str(uuid.uuid4()))
@@ -42,6 +60,11 @@ class ScheduledMessage(object):
         self.bot_names = kwargs.pop('BotNames', "")
         self.required_bots = kwargs.pop("RequiredBots", "")
         self.ice_breaker = kwargs.pop("IceBreaker", "")
+        self.voice_id = kwargs.pop("VoiceId", "Joanna")
+        self.occurrence_cursor = kwargs.pop("OccurrenceCursor", None)
+        self.occurrence_cursor_skip = kwargs.pop("OccurrenceCursorSkip", 0)
+        self._next_occurrence_key = None
+        self._next_occurrence = None
 
         if (self.last_occurrence_in_utc):
             check_if_timezone_naive(self.last_occurrence_in_utc,
@@ -56,7 +79,7 @@ class ScheduledMessage(object):
         if (not self.body):
             raise ValueError("Message body is empty")
         self.no_more_occurrences = str(self.next_occurrence_utc) == 'N/A'
-        logging.debug(self.__str__())
+        logging.debug('%s', self)
 
     def to_ical(self):
         if self.ical:
@@ -162,6 +185,19 @@ class ScheduledMessage(object):
             return False
 
     def next_occurrence(self):
+        # ical occurrences fall on whole seconds, so flooring "now" doesn't
+        # change the answer but lets repeated calls share one result
+        compare = self.compare_datetime_in_utc or \
+            arrow.utcnow().replace(microsecond=0)
+        key = (self.ical, self.start_datetime_in_utc,
+               self.end_datetime_in_utc, self.last_occurrence_in_utc,
+               self.occurrence_cursor, self.occurrence_cursor_skip, compare)
+        if self._next_occurrence_key != key:
+            self._next_occurrence = self._compute_next_occurrence(compare)
+            self._next_occurrence_key = key
+        return self._next_occurrence
+
+    def _compute_next_occurrence(self, compare):
         # if not messages have been queued yet, then the next occurrence
         # is the start time
         next_occur = None
@@ -172,33 +208,74 @@ class ScheduledMessage(object):
                 next_expire = self.end_datetime_in_utc
             return next_occur, next_expire
         else:
-            start = self.start_datetime_in_utc.datetime
-            cal = Calendar.from_ical(self.ical)
-            if cal.get('RRULE'):
-                rrule = cal.get('RRULE').to_ical()
-                rule = rrulestr(rrule, dtstart=start)
-                next_after_now = rule.after(self.compare_datetime_in_utc or
-                                            arrow.utcnow().datetime)
+            rule = self.occurrence_rule()
+            if rule:
+                next_after_now = rule.after(arrow.get(compare).datetime)
             else:
                 next_after_now = None
 
             if not next_after_now:
                 logging.info('No next_after_now, so next_occur=N/A')
-                return 'N/A', self.compare_datetime_in_utc or arrow.utcnow()
+                return 'N/A', compare
             next_before_now = rule.before(next_after_now)
             if next_before_now and \
                     (self.last_occurrence_in_utc > next_before_now):
                 next_occur = next_after_now
             else:
                 next_occur = next_before_now
-        rule = rrulestr(rrule, dtstart=next_occur)
+        if getattr(rule, 'count', None) or getattr(rule, '_count', None):
+            # counted rules restart the count at next_occur
+            rule = get_rule(self.ical, next_occur)
         expires = rule.after(next_occur)
         if not expires:
-            return 'N/A', arrow.utcnow().replace(minutes=+10)
+            return 'N/A', arrow.get(compare).replace(minutes=+10)
         if (expires > self.end_datetime_in_utc):
             expires = self.end_datetime_in_utc
         return arrow.get(next_occur), arrow.get(expires)
 
+    @property
+    def pending_occurrence_utc(self):
+        # the first occurrence that hasn't been delivered yet, independent
+        # of the current time. this is what the due index is keyed on.
+        if not self.last_occurrence_in_utc:
+            pending = self.start_datetime_in_utc
+        else:
+            rule = self.occurrence_rule()
+            if not rule:
+                return None
+            pending = rule.after(self.last_occurrence_in_utc.datetime)
+            if not pending:
+                return None
+            pending = arrow.get(pending)
+        if self.end_datetime_in_utc and pending > self.end_datetime_in_utc:
+            return None
+        return pending
+
+    def occurrence_rule(self):
+        """the compiled rule, anchored at the occurrence cursor when there
+        is one so dateutil doesn't replay everything since the start"""
+        if self.occurrence_cursor:
+            return get_rule(self.ical, self.occurrence_cursor.datetime,
+                            self.occurrence_cursor_skip)
+        return get_rule(self.ical, self.start_datetime_in_utc.datetime)
+
+    def advance_cursor(self, dt=None):
+        if not dt:
+            dt = self.last_occurrence_in_utc
+        if not dt or not self.ical:
+            return
+        cursor = None
+        if self.occurrence_cursor:
+            cursor = self.occurrence_cursor.datetime
+        cursor, skip = advance_cursor(self.ical,
+                                      self.start_datetime_in_utc.datetime,
+                                      arrow.get(dt).datetime,
+                                      cursor,
+                                      self.occurrence_cursor_skip)
+        if cursor:
+            self.occurrence_cursor = arrow.get(cursor)
+            self.occurrence_cursor_skip = skip
+
     def is_message_ready(self, **kwargs):
         if self.is_expired or self.is_queued:
             return False
@@ -221,59 +298,40 @@ class ScheduledMessage(object):
 
 
 class QueuedMessage(object):
+    """a message received from a location queue. reads the envelope when
+    there is one, otherwise the attributes older publishers attached one by
+    one. the expiration is only parsed when it's first needed"""
+    __slots__ = ENVELOPE_FIELDS + ('body', 'original_message',
+                                   '_expiration_datetime')
+
     def __init__(self, **kwargs):
         queued_message = kwargs.pop("QueuedMessage")
-        if queued_message.message_attributes is not None:
-            ma = queued_message.message_attributes
-            try:
-                self.uuid_key = queued_message.message_attributes \
-                    .get('UUID').get('StringValue')
-            except ValueError:
-                raise ValueError("Missing uuid from queued message")
-            expiration_date = queued_message.message_attributes \
-                .get('ExpirationDateTimeInUtc').get('StringValue')
-            self.no_more_occurrences = bool(queued_message.message_attributes
-                                            .get('NoMoreOccurrences')
-                                            .get('StringValue'))
-            if ma.get('IceBreaker'):
-                self.ice_breaker = queued_message.message_attributes \
-                    .get('IceBreaker').get('StringValue')
-            else:
-                self.ice_breaker = ""
-
-            if ma.get('BotNames'):
-                self.bot_names = queued_message.message_attributes \
-                    .get('BotNames').get('StringValue')
-            else:
-                self.bot_names = ''
-
-            if ma.get('RequiredBots'):
-                self.required_bots = queued_message.message_attributes \
-                    .get('RequiredBots').get('StringValue')
-            else:
-                self.required_bots = ''
+        ma = queued_message.message_attributes
+        fields = decode(ma)
+        if fields is None:
+            fields = legacy_fields(ma or {})
+        (self.uuid_key, self.person_name, self.expiration,
+         self.no_more_occurrences, self.voice_id, self.bot_names,
+         self.required_bots, self.ice_breaker,
+         self.windows_version, self.after_delivery) = fields
+        if not self.uuid_key:
+            raise ValueError("Missing uuid from queued message")
+        self._expiration_datetime = None
+        self.body = queued_message.body
+        self.original_message = kwargs.get("Message", "")
 
-            self.voice_id = queued_message.message_attributes \
-                .get('Voice').get('StringValue')
-            person_name = queued_message.message_attributes \
-                .get('PersonName').get('StringValue')
-            self.person_name = person_name
+    @property
+    def expiration_datetime_in_utc(self):
+        if self._expiration_datetime is None:
             try:
-                if expiration_date:
-                    self.expiration_datetime_in_utc = \
-                        arrow.get(expiration_date)
-            except ValueError:
+                self._expiration_datetime = arrow.get(self.expiration)
+            except (ValueError, TypeError):
                 raise ValueError("Unable to parse expiration date")
-        self.body = queued_message.body
-        if self.expiration_datetime_in_utc < arrow.utcnow():
-            print "%s < %s:%s" % (self.expiration_datetime_in_utc,
-                                  arrow.utcnow(), True)
-            self.is_expired = True
-        else:
-            print "%s>%s:%s" % (self.expiration_datetime_in_utc,
-                                arrow.utcnow(), False)
-            self.is_expired = False
-        self.original_message = kwargs.get("Message", "")
+        return self._expiration_datetime
+
+    @property
+    def is_expired(self):
+        return self.expiration_datetime_in_utc < arrow.utcnow()
 
     def __str__(self):
         return "\n".join([
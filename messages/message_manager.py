@@ -10,39 +10,39 @@
 # and limitations under the License.
 
 """interacts with the message queue, reading and publishing messages"""
-import boto3
+from helpers import aws
 from message import QueuedMessage
+import envelope
+from queue_registry import queue_registry, queue_names, fifo_queues
+from acks import AckBuffer
+from consumer import QueueConsumer
+from heartbeat import VisibilityHeartbeat
 from scheduler.scheduler import Scheduler
 import logging
 from person.person import PersonManager
 from helpers.speech import SpeechHelper
+from helpers.ssml import SsmlComposer
 from helpers.db_helpers import validate_table
+from collections import OrderedDict
+import arrow
+import hashlib
+import math
 import uuid
 import os
+import time
 
 MESSAGE_LIBRARY_TABLE = 'PollexyMessageLibrary'
+# send_message_batch takes at most ten entries
+SQS_BATCH_SIZE = 10
+PUBLISH_ATTEMPTS = 3
+PUBLISH_RETRY_SECONDS = 0.2
+# SQS won't hold a message back for longer than this
+MAX_DELAY_SECONDS = 15 * 60
 
 
 def get_queue(queue_name):
-    """get a queue by name"""
-    log = logging.getLogger("GetQueue")
-    if os.environ.get('LOG_LEVEL') == 'DEBUG':
-        log.setLevel(logging.DEBUG)
-    sqs = boto3.resource('sqs')
-    client = boto3.client('sqs')
-    queue_url = ""
-    try:
-        log.debug('Getting queue: {}'.format(queue_name))
-        queue_url = client.get_queue_url(QueueName=queue_name)
-
-    except Exception as e:
-        log.error('Error getting queue: {}'.format(e))
-        return None
-
-    for queue in sqs.queues.all():
-        if queue.url == queue_url['QueueUrl']:
-            log.debug('Queue already exists')
-            return queue
+    """get a queue by name, None if it doesn't exist"""
+    return queue_registry.get_queue(queue_name)
 
 
 class MessageManager(object):
@@ -55,29 +55,40 @@ class MessageManager(object):
         if len(self.location_name) == 0:
             raise ValueError('Missing location name')
 
-        self.queue_name = "pollexy-inbox-%s" % (self.location_name)
-        self.bot_queue_name = "{}-bot".format(self.queue_name)
+        # Fifo (POLLEXY_FIFO_QUEUES by default) uses the .fifo queues,
+        # which drop a second publish of the same occurrence
+        self.fifo = kwargs.get('Fifo', fifo_queues())
+        self.queue_name, self.bot_queue_name = \
+            queue_names(self.location_name, self.fifo)
         self.log.debug('Initializing queue manager, Queue name: {}'
                        .format(self.queue_name))
         self.validate_queue()
         self.messages = {}
+        self.sqs_msgs = []
+        self.queued_msgs = []
+        self._scheduler = None
+        # BufferAcks holds deletes until flush_acks (or the ack deadline),
+        # so a speech session acknowledges everything in one go
+        self.buffer_acks = kwargs.get('BufferAcks', False)
+        # keeps everything received hidden until it's acked or failed
+        self.heartbeat = VisibilityHeartbeat()
+        self.acks = AckBuffer(Heartbeat=self.heartbeat)
+        self._consumer = None
+
+    @property
+    def scheduler(self):
+        # one Scheduler (and one describe_table) per manager
+        if self._scheduler is None:
+            self._scheduler = Scheduler()
+        return self._scheduler
 
     def validate_queue(self):
         """validate the queue and create if it doesn't exist"""
-        sqs = boto3.resource('sqs')
-        queue = None
-        bot_queue = None
         self.log.debug('Validating queue')
         try:
-            bot_queue = get_queue(self.bot_queue_name)
-            if bot_queue is None:
-                self.log.debug('Bot queue does not exist, creating {}'
-                               .format(self.bot_queue_name))
-                bot_queue = sqs.create_queue(QueueName=self.bot_queue_name)
-            queue = get_queue(self.queue_name)
-            if queue is None:
-                self.log.debug('Message queue does not exist, creating . . .')
-                queue = sqs.create_queue(QueueName=self.queue_name)
+            bot_queue = queue_registry.get_queue(self.bot_queue_name,
+                                                 Create=True)
+            queue = queue_registry.get_queue(self.queue_name, Create=True)
         except Exception as e:
             self.log.error(e)
             self.is_valid_queue = False
@@ -89,78 +100,117 @@ class MessageManager(object):
             self.queue = queue
             self.bot_queue = bot_queue
 
+    @property
+    def consumer(self):
+        # kept for the life of the manager, so whatever it prefetched is
+        # there for the next call
+        if self._consumer is None:
+            self._consumer = QueueConsumer(LocationName=self.location_name,
+                                           Fifo=self.fifo,
+                                           Acks=self.acks,
+                                           Heartbeat=self.heartbeat)
+        return self._consumer
+
     def get_messages(self, **kwargs):
+        """the next messages of MessageType for PersonName, waiting up to
+        WaitTimeSeconds (LONG_POLL_SECONDS by default) for some to arrive"""
         person_name = kwargs.get('PersonName', '')
         message_type = kwargs.get('MessageType', 'Message')
-        wait_time_seconds = kwargs.get('WaitTimeSeconds', 0)
-        max_number_of_messages = kwargs.get('MaxNumberOfMessages', 10)
+        self.messages = {}
         self.sqs_msgs = []
+        self.queued_msgs = []
         self.log.debug("Checking messages in the queue, person={}, type={}"
                        .format(person_name, message_type))
-        messages = {}
-        queue = None
-        if message_type == "Message":
-            queue = self.queue
-        else:
-            queue = self.bot_queue
-        messages = queue.receive_messages(
-            MessageAttributeNames=['NoMoreOccurrences',
-                                   'ExpirationDateTimeInUtc',
-                                   'PersonName',
-                                   'Voice',
-                                   'BotNames',
-                                   'RequiredBots',
-                                   'IceBreaker',
-                                   'UUID'],
-            WaitTimeSeconds=wait_time_seconds,
-            MaxNumberOfMessages=max_number_of_messages)
-        self.log.debug(len(messages))
-        if len(messages) > 0:
-            self.log.debug('Received {}:'.format(len(messages)))
-            msgs = []
-            for m in messages:
-                qm = QueuedMessage(QueuedMessage=m)
-                if person_name and not qm.person_name == person_name:
-                    self.log.debug('Skipping message for {}, looking for {}'
-                                   .format(qm.person_name, person_name))
-                    continue
-                if qm.person_name not in self.messages:
-                    self.log.debug("First message for " + qm.person_name)
-                    self.messages[qm.person_name] = []
-                self.messages[qm.person_name].append(qm)
-                self.sqs_msgs.append(m)
-                msgs.append(qm)
-                scheduler = Scheduler()
-                scheduler.update_queue_status(qm.uuid_key,
-                                              qm.person_name,
-                                              False)
-                return msgs
+        taken = self.consumer.take(PersonName=person_name,
+                                   MessageType=message_type,
+                                   WaitTimeSeconds=kwargs.get(
+                                       'WaitTimeSeconds'))
+        if not taken:
+            return None
+        self.log.debug('Received {}:'.format(len(taken)))
+        msgs = []
+        for b in taken:
+            qm = b.queued
+            if qm.person_name not in self.messages:
+                self.log.debug("First message for " + qm.person_name)
+                self.messages[qm.person_name] = []
+            self.messages[qm.person_name].append(qm)
+            self.sqs_msgs.append(b.message)
+            self.queued_msgs.append(qm)
+            msgs.append(qm)
+        self.scheduler.mark_taken_batch([{'UUID': qm.uuid_key,
+                                          'PersonName': qm.person_name}
+                                         for qm in msgs])
+        return msgs
+
+    def close(self):
+        """give back anything prefetched and send the buffered acks"""
+        if self._consumer is not None:
+            self._consumer.close()
+        result = self.flush_acks()
+        self.heartbeat.drop_all()
+        self.heartbeat.stop()
+        return result
 
     def write_speech(self, **kwargs):
+        """the voice and a single <speak> document for the person's
+        messages, or (None, None)"""
+        voice_id, composer = self.compose_speech(**kwargs)
+        if composer is None:
+            return None, None
+        return voice_id, composer.document()
+
+    def compose_speech(self, **kwargs):
+        """the voice and an SsmlComposer holding a paragraph per unexpired
+        message for the person, or (None, None)"""
         dont_delete = kwargs.get('DontDelete', False)
         person_name = kwargs.get('PersonName', '')
-        print 'getting messages for ' + person_name
+        self.log.debug('getting messages for ' + person_name)
         self.get_messages(DontDelete=dont_delete, PersonName=person_name)
         if len(self.messages) == 0:
             return None, None
-        speech = "<speak>"
+        sh = SpeechHelper(PersonName=person_name)
+        composer = SsmlComposer()
         for m in self.messages[person_name]:
             if not m.is_expired:
-                speech = speech + "<p>%s</p>" % m.body
-        if speech == "<speak>":
+                composer.paragraph(sh.replace_tokens(m.body))
+        if not composer:
             return None, None
-        speech = "%s</speak>" % speech
-        sh = SpeechHelper(PersonName=person_name)
-        return m.voice_id, sh.replace_tokens(speech)
+        return m.voice_id, composer
+
+    def windows_current(self, person, now=None):
+        """False when a message taken for person was published against
+        other windows than the person has now and, going by the new ones,
+        the person isn't here. messages without a version count as
+        current"""
+        if person is None:
+            return True
+        stale = [qm for qm in self.queued_msgs if qm.windows_version and
+                 qm.windows_version != person.windows_version]
+        if not stale:
+            return True
+        self.log.debug('{} messages were published against older windows'
+                       .format(len(stale)))
+        return any(w.location_name.lower() == self.location_name
+                   for w in person.all_available(now))
 
     def delete_sqs_msgs(self):
-        client = boto3.client('sqs')
         self.log.debug('Deleting {} messages'.format(len(self.sqs_msgs)))
+        # the ack buffer drops each one from the heartbeat once it's gone
         for m in self.sqs_msgs:
-            self.log.debug('Deleting message from queue')
-            print m
-            client.delete_message(QueueUrl=m.queue_url,
-                                  ReceiptHandle=m.receipt_handle)
+            self.acks.delete(m)
+        self.sqs_msgs = []
+        self.queued_msgs = []
+        if not self.buffer_acks:
+            self.flush_acks()
+
+    def flush_acks(self):
+        """send the buffered deletes and releases, returns an AckResult"""
+        result = self.acks.flush()
+        self.log.debug('Deleted {}, released {}, {} failed'
+                       .format(result.deleted, result.released,
+                               len(result.failed)))
+        return result
 
     def fail_messages(self, **kwargs):
         logging.info('Speech failed: ' + kwargs.get('Reason',
@@ -168,12 +218,16 @@ class MessageManager(object):
         dont_delete = kwargs.get('DontDelete', False)
         if (dont_delete):
             logging.info('We are NOT deleting the original SQS messages')
+            # let them come back on their own
+            for m in self.sqs_msgs:
+                self.heartbeat.drop(m)
             return
-        for m in self.sqs_msgs:
-            scheduler = Scheduler()
-            qm = QueuedMessage(QueuedMessage=m)
-            logging.info("Setting messages InQueue to False")
-            scheduler.update_queue_status(qm.uuid_key, qm.person_name, False)
+        logging.info("Setting messages InQueue to False")
+        failures = []
+        for qm in self.queued_msgs:
+            failures.append({'UUID': qm.uuid_key,
+                             'PersonName': qm.person_name})
+        self.scheduler.mark_failed_batch(failures)
         self.delete_sqs_msgs()
 
     def succeed_messages(self, **kwargs):
@@ -181,104 +235,243 @@ class MessageManager(object):
         dont_delete = kwargs.get('DontDelete', False)
         if (dont_delete):
             logging.info('We are NOT deleting the original SQS messages')
+            # let them come back on their own
+            for m in self.sqs_msgs:
+                self.heartbeat.drop(m)
             return
 
-        scheduler = Scheduler()
-        for m in self.sqs_msgs:
-            logging.info('Deleting message from queue')
-            qm = QueuedMessage(QueuedMessage=m)
-            scheduler.update_last_occurrence(qm.uuid_key, qm.person_name)
-            scheduler.update_queue_status(qm.uuid_key, qm.person_name, False)
-            print('No more occurrences = {}'.format(qm.no_more_occurrences))
-            if qm.no_more_occurrences:
-                scheduler.set_expired(qm.uuid_key, qm.person_name)
+        deliveries = []
+        for qm in self.queued_msgs:
+            logging.info('No more occurrences = {}'
+                         .format(qm.no_more_occurrences))
+            deliveries.append({'UUID': qm.uuid_key,
+                               'PersonName': qm.person_name,
+                               'NoMoreOccurrences': qm.no_more_occurrences,
+                               'AfterDelivery': qm.after_delivery})
+        self.scheduler.mark_delivered_batch(deliveries)
         self.delete_sqs_msgs()
 
     def reset(self, **kwargs):
-        self.get_messages(MessageType='Bot', WaitTimeSeconds=0)
-        self.log.debug('Deleting queued bot messages')
-        self.fail_messages()
-        self.delete_sqs_msgs()
-        self.get_messages(MessageType='Message', WaitTimeSeconds=0)
-        self.log.debug('Deleting queued messages')
-        self.fail_messages()
-        self.delete_sqs_msgs()
+        """empty both queues, taking every message out of the schedule's
+        queue"""
+        for queue in (self.bot_queue, self.queue):
+            self.log.debug('Deleting queued messages from {}'
+                           .format(queue.url))
+            failures = []
+            while True:
+                # received messages stay hidden until the deletes go out,
+                # so this stops once everything has been seen
+                messages = queue.receive_messages(
+                    MessageAttributeNames=['All'],
+                    WaitTimeSeconds=0,
+                    MaxNumberOfMessages=10)
+                if not messages:
+                    break
+                for m in messages:
+                    qm = QueuedMessage(QueuedMessage=m)
+                    failures.append({'UUID': qm.uuid_key,
+                                     'PersonName': qm.person_name})
+                    self.acks.delete(m)
+            self.scheduler.mark_failed_batch(failures)
+        self.sqs_msgs = []
+        self.queued_msgs = []
+        return self.flush_acks()
 
     def publish_message(self, **kwargs):
-        expiration_date = kwargs.pop('ExpirationDateTimeInUtc',
-                                     '2299-12-31 00:00:00')
-        body = kwargs.pop('Body', '')
-        uuid_key = kwargs.pop('UUID', str(uuid.uuid4()))
-        no_more_occ = kwargs.pop('NoMoreOccurrences', False)
-        person_name = kwargs.pop('PersonName', '')
-        bot_names = kwargs.pop('BotNames', None)
-        required_bots = kwargs.pop('RequiredBots', None)
-        ice_breaker = kwargs.pop('IceBreaker', None)
-        voice = kwargs.pop('VoiceId', 'Joanna')
-        if not person_name:
-            raise ValueError("No person provided")
-        if not uuid_key:
-            raise ValueError("No uuid provided")
-        if not body:
-            raise ValueError('No message body provided')
-        if kwargs:
-            raise TypeError('Unexpected **kwargs: %r' % kwargs)
-
-        pm = PersonManager()
-        p = pm.get_person(person_name)
-        windows = p.time_windows.to_json()
-        msg_attr = {
-            'PersonName': {
-                'StringValue': person_name,
-                'DataType': 'String'
-            },
-            'Locations': {
-                'StringValue': windows,
-                'DataType': 'String'
-            },
-            'ExpirationDateTimeInUtc': {
-                'StringValue': expiration_date,
-                'DataType': 'String'
-            },
-            'UUID': {
-                'StringValue': uuid_key,
-                'DataType': 'String'
-            },
-            'NoMoreOccurrences': {
-                'StringValue': str(no_more_occ),
-                'DataType': 'String'
-            },
-            'Voice': {
-                'StringValue': voice,
-                'DataType': 'String'
-            }}
-
-        if required_bots:
-            msg_attr['RequiredBots'] = {
-                'StringValue': required_bots,
-                'DataType': 'String'
-            }
-
-        if bot_names:
-            msg_attr['BotNames'] = {
-                'StringValue': bot_names,
-                'DataType': 'String'
-            }
-
-        if ice_breaker:
-            msg_attr['IceBreaker'] = {
-                'StringValue': ice_breaker,
-                'DataType': 'String'
-            }
-        if bot_names:
+        entry, is_bot = build_message(Fifo=self.fifo, **kwargs)
+        if is_bot:
             self.log.debug('Publishing to bot queue')
-            self.bot_queue.send_message(MessageBody=body,
-                                        MessageAttributes=msg_attr)
+            self.bot_queue.send_message(**entry)
         else:
             self.log.debug('Publishing to message queue')
-            self.queue.send_message(MessageBody=body,
-                                    MessageAttributes=msg_attr)
-        self.log.debug(body)
+            self.queue.send_message(**entry)
+        self.log.debug(entry['MessageBody'])
+
+
+class PublishResult(object):
+    """what happened to one message handed to MessagePublisher.add.
+    Context is whatever the caller wants back with it"""
+    def __init__(self, **kwargs):
+        self.id = kwargs.get('Id')
+        self.uuid_key = kwargs.get('UUID')
+        self.person_name = kwargs.get('PersonName')
+        self.location_name = kwargs.get('LocationName')
+        self.queue_name = kwargs.get('QueueName')
+        self.context = kwargs.get('Context')
+        self.message_id = None
+        self.error = None
+
+    @property
+    def succeeded(self):
+        return self.message_id is not None
+
+
+class MessagePublisher(object):
+    """collects messages for any number of locations and sends them with
+    send_message_batch, ten per call to each queue. a queue's batch goes
+    out as soon as it's full, the rest on flush. a batch that can't be
+    sent is recorded in its PublishResults rather than raised, so the
+    messages that did go out can still be marked queued"""
+    def __init__(self, **kwargs):
+        self.log = logging.getLogger("MessagePublisher")
+        if os.environ.get('LOG_LEVEL') == 'DEBUG':
+            self.log.setLevel(logging.DEBUG)
+        self.max_attempts = kwargs.get('MaxAttempts', PUBLISH_ATTEMPTS)
+        self.fifo = kwargs.get('Fifo', fifo_queues())
+        self.next_id = 0
+        self.results = []
+        self.pending = OrderedDict()
+
+    def add(self, **kwargs):
+        """queue a message for LocationName; takes the same kwargs as
+        MessageManager.publish_message. sends the queue's batch once it
+        holds ten messages"""
+        location_name = kwargs.pop('LocationName', '').lower()
+        context = kwargs.pop('Context', None)
+        if not location_name:
+            raise ValueError('Missing location name')
+        kwargs.setdefault('UUID', str(uuid.uuid4()))
+        entry, is_bot = build_message(Fifo=self.fifo, **kwargs)
+        queue_name, bot_queue_name = queue_names(location_name, self.fifo)
+        if is_bot:
+            queue_name = bot_queue_name
+        result = PublishResult(Id=str(self.next_id),
+                               UUID=kwargs['UUID'],
+                               PersonName=kwargs.get('PersonName'),
+                               LocationName=location_name,
+                               QueueName=queue_name,
+                               Context=context)
+        self.next_id += 1
+        self.results.append(result)
+        entries = self.pending.setdefault(queue_name, [])
+        entries.append((result, entry))
+        if len(entries) >= SQS_BATCH_SIZE:
+            del self.pending[queue_name]
+            self._send(queue_name, entries)
+        return result
+
+    def flush(self):
+        """send everything not sent yet. returns a PublishResult per
+        message added since the last flush, in the order they were
+        added"""
+        pending, self.pending = self.pending, OrderedDict()
+        for queue_name, entries in pending.items():
+            self._send(queue_name, entries)
+        results = self.results
+        self.results = []
+        return results
+
+    def _send(self, queue_name, batch):
+        try:
+            url = queue_registry.get_url(queue_name, Create=True)
+            self._send_batch(url, batch)
+        except Exception as e:
+            # botocore has already retried; leave it to the next pass
+            for result, _ in batch:
+                if not result.succeeded:
+                    result.error = str(e)
+        for r in [result for result, _ in batch if not result.succeeded]:
+            self.log.error('Could not publish {} for {} to {}: {}'
+                           .format(r.uuid_key, r.person_name, r.queue_name,
+                                   r.error))
+
+    def _send_batch(self, url, batch):
+        client = aws.client('sqs')
+        waiting = OrderedDict((r.id, (r, entry)) for r, entry in batch)
+        for attempt in range(self.max_attempts):
+            if attempt:
+                time.sleep(PUBLISH_RETRY_SECONDS * 2 ** (attempt - 1))
+            response = client.send_message_batch(
+                QueueUrl=url,
+                Entries=[dict(entry, Id=i)
+                         for i, (r, entry) in waiting.items()])
+            for sent in response.get('Successful', []):
+                r, _ = waiting.pop(sent['Id'])
+                r.message_id = sent['MessageId']
+                r.error = None
+            for failed in response.get('Failed', []):
+                r, _ = waiting[failed['Id']]
+                r.error = failed.get('Message') or failed['Code']
+                # a bad message fails the same way every time
+                if failed.get('SenderFault'):
+                    del waiting[failed['Id']]
+            if not waiting:
+                break
+
+
+def delay_seconds(deliver_at, now=None):
+    """the DelaySeconds that makes a message visible at deliver_at"""
+    if now is None:
+        now = arrow.utcnow()
+    delay = int(math.ceil((arrow.get(deliver_at) - now).total_seconds()))
+    return max(0, min(MAX_DELAY_SECONDS, delay))
+
+
+def deduplication_id(uuid_key, occurrence):
+    """the same for every publish of one occurrence of a message"""
+    return hashlib.sha256('{}|{}'.format(uuid_key, occurrence)).hexdigest()
+
+
+def build_message(**kwargs):
+    """the send_message kwargs for publish_message, and whether it
+    belongs on the bot queue. everything but the body goes into the
+    envelope. WindowsVersion saves a Person lookup when the caller already
+    has the person. with Fifo, messages are grouped per person and
+    deduplicated on UUID and OccurrenceDateTimeInUtc (the expiration if
+    that isn't given). DeliverAtUtc holds the message back until then, up
+    to 15 minutes; FIFO queues can't delay single messages, so there it's
+    ignored. AfterDelivery (scheduler.after_delivery) rides along in the
+    envelope for the acknowledgement"""
+    expiration_date = kwargs.pop('ExpirationDateTimeInUtc',
+                                 '2299-12-31 00:00:00')
+    body = kwargs.pop('Body', '')
+    uuid_key = kwargs.pop('UUID', str(uuid.uuid4()))
+    no_more_occ = kwargs.pop('NoMoreOccurrences', False)
+    person_name = kwargs.pop('PersonName', '')
+    bot_names = kwargs.pop('BotNames', None)
+    required_bots = kwargs.pop('RequiredBots', None)
+    ice_breaker = kwargs.pop('IceBreaker', None)
+    voice = kwargs.pop('VoiceId', 'Joanna')
+    version = kwargs.pop('WindowsVersion', None)
+    fifo = kwargs.pop('Fifo', False)
+    occurrence = kwargs.pop('OccurrenceDateTimeInUtc', None)
+    deliver_at = kwargs.pop('DeliverAtUtc', None)
+    after_delivery = kwargs.pop('AfterDelivery', None)
+    if not person_name:
+        raise ValueError("No person provided")
+    if not uuid_key:
+        raise ValueError("No uuid provided")
+    if not body:
+        raise ValueError('No message body provided')
+    if kwargs:
+        raise TypeError('Unexpected **kwargs: %r' % kwargs)
+
+    if version is None:
+        pm = PersonManager()
+        p = pm.get_person(person_name)
+        # without a version the device takes the message as current
+        version = p.windows_version if p else None
+    entry = {'MessageBody': body,
+             'MessageAttributes': envelope.encode(
+                 UUID=uuid_key,
+                 PersonName=person_name,
+                 ExpirationDateTimeInUtc=expiration_date,
+                 NoMoreOccurrences=no_more_occ,
+                 VoiceId=voice,
+                 BotNames=bot_names,
+                 RequiredBots=required_bots,
+                 IceBreaker=ice_breaker,
+                 WindowsVersion=version,
+                 AfterDelivery=after_delivery)}
+    if fifo:
+        entry['MessageGroupId'] = person_name
+        entry['MessageDeduplicationId'] = deduplication_id(
+            uuid_key, occurrence or expiration_date)
+    elif deliver_at:
+        delay = delay_seconds(deliver_at)
+        if delay:
+            entry['DelaySeconds'] = delay
+    return entry, bool(bot_names)
 
 
 class LibraryManager(object):
@@ -287,7 +480,7 @@ class LibraryManager(object):
                        self.create_message_library_table)
 
     def create_message_library_table(self):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.create_table(
                     TableName=MESSAGE_LIBRARY_TABLE,
                     KeySchema=[
@@ -313,7 +506,7 @@ class LibraryManager(object):
     def update_message(self, **kwargs):
         name = kwargs.get('Name')
         message = kwargs.get('Message')
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(MESSAGE_LIBRARY_TABLE)
         table.put_item(
            Item={
@@ -324,7 +517,7 @@ class LibraryManager(object):
 
     def get_message(self, **kwargs):
         name = kwargs.get('Name')
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(MESSAGE_LIBRARY_TABLE)
         resp = table.get_item(
                 Key={
@@ -340,7 +533,7 @@ class LibraryManager(object):
 
     def delete_message(self, **kwargs):
         name = kwargs.get('Name')
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(MESSAGE_LIBRARY_TABLE)
         table.delete_item(
             Key={
@@ -0,0 +1,101 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""process-wide cache of SQS queue urls"""
+import logging
+import os
+import threading
+import time
+from helpers import aws
+from botocore.exceptions import ClientError
+
+QUEUE_URL_TTL_SECONDS = 15 * 60
+# set to true to publish to and read from the .fifo queues
+FIFO_QUEUES_ENV = 'POLLEXY_FIFO_QUEUES'
+FIFO_SUFFIX = '.fifo'
+MISSING_QUEUE_ERRORS = ('AWS.SimpleQueueService.NonExistentQueue',
+                        'QueueDoesNotExist')
+
+
+def fifo_queues():
+    return os.environ.get(FIFO_QUEUES_ENV, '').lower() in ('1', 'true', 'yes')
+
+
+def queue_names(location_name, fifo=False):
+    """the message and bot queues for a location"""
+    queue_name = "pollexy-inbox-%s" % (location_name)
+    bot_queue_name = "{}-bot".format(queue_name)
+    if fifo:
+        return queue_name + FIFO_SUFFIX, bot_queue_name + FIFO_SUFFIX
+    return queue_name, bot_queue_name
+
+
+class QueueRegistry(object):
+    """resolves queue names to urls with get_queue_url (never ListQueues),
+    creating missing queues on request. urls are kept for TtlSeconds and
+    shared by every caller in the process"""
+    def __init__(self, **kwargs):
+        self.ttl = kwargs.get('TtlSeconds', QUEUE_URL_TTL_SECONDS)
+        self.urls = {}
+        self.lock = threading.Lock()
+        self.lookups = 0
+
+    def get_url(self, queue_name, **kwargs):
+        """url for queue_name, or None if it doesn't exist and Create
+        isn't set"""
+        create = kwargs.get('Create', False)
+        now = time.time()
+        with self.lock:
+            cached = self.urls.get(queue_name)
+        if cached and cached[1] > now:
+            return cached[0]
+        url = self._resolve(queue_name, create)
+        if url:
+            with self.lock:
+                self.urls[queue_name] = (url, now + self.ttl)
+        return url
+
+    def _resolve(self, queue_name, create):
+        client = aws.client('sqs')
+        self.lookups += 1
+        try:
+            return client.get_queue_url(QueueName=queue_name)['QueueUrl']
+        except ClientError as e:
+            if e.response['Error']['Code'] not in MISSING_QUEUE_ERRORS:
+                raise
+        if not create:
+            return None
+        logging.debug('Queue {} does not exist, creating'.format(queue_name))
+        attributes = {}
+        if queue_name.endswith(FIFO_SUFFIX):
+            # dedup ids come from the sender, never from the body
+            attributes = {'FifoQueue': 'true',
+                          'ContentBasedDeduplication': 'false'}
+        # create_queue returns the existing url if another process won
+        return client.create_queue(QueueName=queue_name,
+                                   Attributes=attributes)['QueueUrl']
+
+    def get_queue(self, queue_name, **kwargs):
+        url = self.get_url(queue_name, **kwargs)
+        if url is None:
+            return None
+        return aws.resource('sqs').Queue(url)
+
+    def invalidate(self, queue_name):
+        with self.lock:
+            self.urls.pop(queue_name, None)
+
+    def clear(self):
+        with self.lock:
+            self.urls.clear()
+
+
+queue_registry = QueueRegistry()
@@ -9,12 +9,15 @@
 # or implied. See the License for the specific language governing permissions
 # and limitations under the License.
 
-import boto3
+from helpers import aws
+import hashlib
 import json
 import arrow
 import yaml
 from time_window import TimeWindowSet, TimeWindow
+from time_window.timeline import availability_timeline, person_key
 from boto3.dynamodb.conditions import Key
+from helpers.db_helpers import scan_table
 
 
 PERSON_TABLE = 'PollexyPeople'
@@ -34,11 +37,27 @@ class PersonTimeWindow(TimeWindow):
                 }
 
 
+def windows_version(windows_json):
+    """a short name for one version of a person's windows"""
+    if isinstance(windows_json, unicode):
+        windows_json = windows_json.encode('utf-8')
+    return hashlib.sha1(windows_json).hexdigest()[:12]
+
+
 class Person(object):
     def __init__(self, **kwargs):
         self.name = kwargs.get('Name', '')
         self.time_windows = TimeWindowSet()
         self.require_physical_confirmation = False
+        self._windows_version = None
+
+    @property
+    def windows_version(self):
+        # people read from the table already have it from the stored json
+        if self._windows_version is None:
+            self._windows_version = \
+                windows_version(self.time_windows.to_json())
+        return self._windows_version
 
     def add_windows(self, windows):
         for w in windows:
@@ -49,21 +68,25 @@ class Person(object):
             self.add_window(ptw)
 
     def add_window(self, w):
-        self.time_windows.set_list.append(w)
+        self.time_windows.add_time_window(w)
+        self._windows_version = None
 
     def all_available(self, dt=None):
         if not dt:
             dt = arrow.utcnow()
-        return sorted(self.time_windows.all_available(dt=dt),
-                      key=lambda a: a.priority,
-                      reverse=True)
+        return availability_timeline.all_available(person_key(self.name),
+                                                   self.time_windows, dt)
 
     def all_available_count(self, dt=None):
-        return sum(1 for _ in self.all_available(dt))
+        if not dt:
+            dt = arrow.utcnow()
+        return availability_timeline.all_available_count(
+            person_key(self.name), self.time_windows, dt)
 
     def remove_window_location(self, ln):
         self.time_windows.set_list = \
             filter(lambda w: w.location_name != ln, self.time_windows.set_list)
+        self._windows_version = None
 
 
 class PersonManager(object):
@@ -71,7 +94,7 @@ class PersonManager(object):
         pass
 
     def toggle_mute(self, person_name, is_muted=False):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(PERSON_TABLE)
         table.update_item(
             Key={
@@ -84,7 +107,7 @@ class PersonManager(object):
         )
 
     def update_window_set(self, person):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(PERSON_TABLE)
         table.update_item(
             Key={
@@ -96,6 +119,8 @@ class PersonManager(object):
                 ':pc': person.require_physical_confirmation
             }
         )
+        availability_timeline.update(person_key(person.name),
+                                     person.time_windows)
 
     def convert_to_person(self, db_person):
         p = Person(Name=db_person[PERSON_HASH_KEY])
@@ -116,11 +141,12 @@ class PersonManager(object):
                                       Priority=w['priority'])
 
                 p.add_window(tw)
+            p._windows_version = windows_version(db_person['windows'])
 
         return p
 
     def delete(self, **kwargs):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         person_name = kwargs.get('PersonName')
         table = dynamodb.Table(PERSON_TABLE)
         table.delete_item(Key={
@@ -128,7 +154,7 @@ class PersonManager(object):
                 })
 
     def update_person(self, **kwargs):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         name = kwargs.get('Name')
         windows = kwargs.get('Windows')
         req_phys_conf = kwargs.get('RequirePhysicalConfirmation')
@@ -161,30 +187,17 @@ class PersonManager(object):
                     PERSON_HASH_KEY: name
                 }
             )
+        if windows:
+            availability_timeline.invalidate(person_key(name))
 
     def get_all(self, **kwargs):
-        dynamodb_cl = boto3.client('dynamodb')
-        resp = dynamodb_cl.scan(
-            Select='ALL_ATTRIBUTES',
-            TableName=PERSON_TABLE,
-        )
-        people = []
-        if len(resp['Items']) == 0:
+        people = [self.convert_to_person(p) for p in scan_table(PERSON_TABLE)]
+        if len(people) == 0:
             return None
-        else:
-            for p in resp['Items']:
-                person = {}
-                if 'windows' in p.keys():
-                    person['windows'] = p['windows']['S']
-                if 'req_phys_confirm' in p.keys():
-                    person['req_phys_confirm'] = p['req_phys_confirm']['BOOL']
-                person['PersonName'] = p['PersonName']['S']
-                people.append(self.convert_to_person(person))
-
         return people
 
     def get_person(self, name):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(PERSON_TABLE)
         response = table.query(
             Select='ALL_ATTRIBUTES',
@@ -1,6 +1,9 @@
-from messages.message_manager import MessageManager
-from scheduler.scheduler import Scheduler
+from messages.message_manager import MessagePublisher
+from messages.queue_registry import fifo_queues
+from scheduler.scheduler import Scheduler, queue_lookahead, delivery_time, \
+    occurrence_time, after_delivery
 from person.person import PersonManager
+from helpers.recurrence import rule_cache_stats
 import arrow
 import logging
 
@@ -13,14 +16,13 @@ def handler(event, context):
     scheduler = Scheduler()
     dt = arrow.utcnow()
     logging.info("Getting messages")
-    msgs = scheduler.get_messages()
-    logging.info("messages = %s" % len(msgs))
-    if len(msgs) == 0:
-        logging.info("No messages are ready to be queued")
-    else:
-        logging.info("Number of messages to be scheduled: %s" % len(msgs))
-
-    for m in msgs:
+    publisher = MessagePublisher()
+    # fifo queues can't delay a single message, so they only get what's due
+    lookahead = 0 if fifo_queues() else queue_lookahead()
+    count = 0
+    for m in scheduler.iter_messages(dt.replace(seconds=+lookahead)):
+        count += 1
+        deliver_at = delivery_time(m, dt)
         logging.info("Getting person %s " % m.person_name)
         pm = PersonManager()
         p = pm.get_person(m.person_name)
@@ -29,36 +31,55 @@ def handler(event, context):
                          "does not have an entry in the " +
                          "Person table . . . skipping")
             continue
-        if p.all_available_count(dt) == 0:
+        avail_windows = p.all_available(deliver_at)
+        avail_count = len(avail_windows)
+        if avail_count == 0:
             logging.warn('No locations available for %s . . . skipping' %
                          m.person_name)
             continue
-        avail_windows = p.all_available(dt)
         logging.info('# of locations avail: {}, last_loc={}'
-                     .format(p.all_available_count(dt),
+                     .format(avail_count,
                              m.last_loc))
-        if p.all_available_count(dt) > 1 and \
-                m.last_loc == p.all_available_count(dt)-1:
+        if avail_count > 1 and \
+                m.last_loc == avail_count-1:
             logging.info('Resetting to first location')
             idx = 0
         else:
-            if p.all_available_count(dt) > 1:
+            if avail_count > 1:
                 logging.info('Moving to next location')
                 idx = m.last_loc + 1
             else:
                 idx = 0
 
-            active_window = avail_windows[int(idx)]
-            next_exp = m.next_expiration_utc.isoformat()
-            mm = MessageManager(LocationName=active_window.location_name)
-            logging.info("Publishing message for person %s to location %s"
-                         % (m.person_name, active_window.location_name))
-            mm.publish_message(Body=m.body, UUID=m.uuid_key,
-                               PersonName=m.person_name,
-                               NoMoreOccurrences=m.no_more_occurrences,
-                               BotNames=m.bot_names,
-                               IceBreaker=m.ice_breaker,
-                               RequiredBots=m.required_bots,
-                               ExpirationDateTimeInUtc=next_exp)
-            scheduler.update_queue_status(m.uuid_key, m.person_name, True)
-            scheduler.update_last_location(m.uuid_key, m.person_name, idx)
+        active_window = avail_windows[int(idx)]
+        next_exp = m.next_expiration_utc.isoformat()
+        occurrence = occurrence_time(m, deliver_at)
+        logging.info("Publishing message for person %s to location %s"
+                     % (m.person_name, active_window.location_name))
+        publisher.add(LocationName=active_window.location_name,
+                      Context=idx,
+                      Body=m.body, UUID=m.uuid_key,
+                      PersonName=m.person_name,
+                      NoMoreOccurrences=m.no_more_occurrences,
+                      BotNames=m.bot_names,
+                      IceBreaker=m.ice_breaker,
+                      VoiceId=m.voice_id,
+                      RequiredBots=m.required_bots,
+                      WindowsVersion=p.windows_version,
+                      DeliverAtUtc=deliver_at,
+                      OccurrenceDateTimeInUtc=occurrence.isoformat(),
+                      AfterDelivery=after_delivery(m, occurrence),
+                      ExpirationDateTimeInUtc=next_exp)
+    results = publisher.flush()
+    scheduler.mark_queued_batch([{'UUID': r.uuid_key,
+                                  'PersonName': r.person_name,
+                                  'LocationIndex': r.context}
+                                 for r in results if r.succeeded])
+    failed = [r for r in results if not r.succeeded]
+    if failed:
+        logging.warn('Failed to publish {} messages'.format(len(failed)))
+    if count == 0:
+        logging.info("No messages are ready to be queued")
+    else:
+        logging.info("Number of messages scheduled: %s" % count)
+    logging.info("Rule cache: %s" % rule_cache_stats())
@@ -0,0 +1,313 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""long-running scheduler that sleeps until the next occurrence is due"""
+import heapq
+import logging
+import os
+import threading
+import time
+import arrow
+from helpers import aws
+from boto3.dynamodb.types import TypeDeserializer
+from messages.message_manager import MessageManager
+from person.person import PersonManager
+from time_window.timeline import availability_timeline, person_key
+from .scheduler import Scheduler, MESSAGE_SCHEDULE_DB, \
+    convert_to_scheduled_message, occurrence_time, after_delivery
+from .store import to_micros
+
+# without a table stream, changes are picked up by rereading this often
+RESYNC_SECONDS = 15 * 60
+STREAM_POLL_SECONDS = 1
+STREAM_SHARD_REFRESH_SECONDS = 60
+# how long to wait when a person has no window left in the timeline
+UNAVAILABLE_RETRY_HOURS = 1
+# after a failed pass, wait this long, doubling for every failure in a row
+ERROR_BACKOFF_SECONDS = 5
+ERROR_BACKOFF_MAX_SECONDS = 5 * 60
+
+
+class ScheduleStream(object):
+    """changes to the schedule table read from its DynamoDB stream.
+    enabled is False when the table has no stream"""
+    def __init__(self, **kwargs):
+        table_name = kwargs.get('TableName', MESSAGE_SCHEDULE_DB)
+        self.client = aws.client('dynamodbstreams')
+        self.stream_arn = aws.client('dynamodb') \
+            .describe_table(TableName=table_name)['Table'] \
+            .get('LatestStreamArn')
+        self.iterators = {}
+        self.finished = set()
+        self.last_refresh = 0
+        self.deserializer = TypeDeserializer()
+        if self.stream_arn:
+            self.refresh_shards(initial=True)
+
+    @property
+    def enabled(self):
+        return bool(self.stream_arn)
+
+    def refresh_shards(self, initial=False):
+        # shards that close before we start are covered by the initial
+        # load; shards that open later are read from their beginning
+        kwargs = {'StreamArn': self.stream_arn}
+        while True:
+            desc = self.client.describe_stream(**kwargs)['StreamDescription']
+            for shard in desc['Shards']:
+                shard_id = shard['ShardId']
+                if shard_id in self.iterators or shard_id in self.finished:
+                    continue
+                closed = 'EndingSequenceNumber' in \
+                    shard['SequenceNumberRange']
+                if initial and closed:
+                    self.finished.add(shard_id)
+                    continue
+                self.iterators[shard_id] = self.client.get_shard_iterator(
+                    StreamArn=self.stream_arn,
+                    ShardId=shard_id,
+                    ShardIteratorType='LATEST' if initial else 'TRIM_HORIZON'
+                )['ShardIterator']
+            if not desc.get('LastEvaluatedShardId'):
+                break
+            kwargs['ExclusiveStartShardId'] = desc['LastEvaluatedShardId']
+        self.last_refresh = time.time()
+
+    def changes(self):
+        """(event name, item) for every change since the last call"""
+        if time.time() - self.last_refresh > STREAM_SHARD_REFRESH_SECONDS:
+            self.refresh_shards()
+        for shard_id, iterator in self.iterators.items():
+            response = self.client.get_records(ShardIterator=iterator,
+                                               Limit=1000)
+            for record in response['Records']:
+                image = record['dynamodb'].get('NewImage') or \
+                    record['dynamodb']['Keys']
+                yield record['eventName'], \
+                    dict((k, self.deserializer.deserialize(v))
+                         for k, v in image.items())
+            if response.get('NextShardIterator'):
+                self.iterators[shard_id] = response['NextShardIterator']
+            else:
+                del self.iterators[shard_id]
+                self.finished.add(shard_id)
+
+
+class ScheduleEntry(object):
+    def __init__(self, item, due=None, recheck=False):
+        self.item = item
+        self.due = due
+        # due only marks when to reread a queued message, not a delivery
+        self.recheck = recheck
+
+
+class SchedulerDaemon(object):
+    """keeps every schedule in a min-heap keyed on its next occurrence and
+    publishes each one when it comes due. replaced entries are left in the
+    heap and skipped when they surface"""
+    def __init__(self, **kwargs):
+        self.log = logging.getLogger('SchedulerDaemon')
+        if os.environ.get('LOG_LEVEL') == 'DEBUG':
+            self.log.setLevel(logging.DEBUG)
+        self.scheduler = kwargs.get('Scheduler') or Scheduler()
+        self.person_manager = PersonManager()
+        self.simulate = kwargs.get('Simulate', False)
+        self.resync_seconds = kwargs.get('ResyncSeconds', RESYNC_SECONDS)
+        self.heap = []
+        self.entries = {}
+        self.stream = None
+        self.last_sync = 0
+        self.stopped = threading.Event()
+
+    def load(self, items=None):
+        if items is None:
+            items = self.scheduler.get_all_items(IncludeExpired=False)
+        self.heap = []
+        self.entries = {}
+        for item in items:
+            self.apply(item)
+        self.last_sync = time.time()
+        self.log.info('Loaded {} schedules, {} armed'
+                      .format(len(self.entries), len(self.heap)))
+
+    def apply(self, item):
+        """add or replace one schedule row"""
+        key = (item['uuid'], item['person_name'])
+        entry = ScheduleEntry(item)
+        self.entries[key] = entry
+        if item.get('expired'):
+            return
+        m = convert_to_scheduled_message(item)
+        due = m.pending_occurrence_utc
+        if due and item.get('in_queue'):
+            # still waiting on a device, look again at the next occurrence
+            rule = m.occurrence_rule()
+            due = rule.after(due.datetime) if rule else None
+            if due:
+                due = arrow.get(due)
+                if due > m.end_datetime_in_utc:
+                    due = None
+            entry.recheck = True
+        if due:
+            self.arm(key, entry, due)
+
+    def arm(self, key, entry, due):
+        entry.due = due
+        heapq.heappush(self.heap, (to_micros(due), key))
+
+    def remove(self, key):
+        self.entries.pop(key, None)
+
+    def next_due(self):
+        """micros of the earliest live entry, or None"""
+        while self.heap:
+            due, key = self.heap[0]
+            entry = self.entries.get(key)
+            if entry is not None and entry.due is not None and \
+                    to_micros(entry.due) == due:
+                return due
+            heapq.heappop(self.heap)
+        return None
+
+    def run_pending(self, now=None):
+        """deliver everything due at or before now. returns the number of
+        messages published"""
+        if not now:
+            now = arrow.utcnow()
+        count = 0
+        t = to_micros(now)
+        while True:
+            due = self.next_due()
+            if due is None or due > t:
+                break
+            due, key = heapq.heappop(self.heap)
+            entry = self.entries[key]
+            entry.due = None
+            if entry.recheck:
+                self.refresh(key)
+            elif self.deliver(key, entry, now):
+                count += 1
+        return count
+
+    def refresh(self, key):
+        item = self.scheduler.get_item(*key)
+        if item is None:
+            self.remove(key)
+        else:
+            self.apply(item)
+
+    def deliver(self, key, entry, now):
+        m = convert_to_scheduled_message(entry.item)
+        p = self.person_manager.get_person(m.person_name)
+        if not p:
+            self.log.warn('{} does not have an entry in the Person table'
+                          .format(m.person_name))
+            return False
+        avail_windows = p.all_available(now)
+        if len(avail_windows) == 0:
+            retry = availability_timeline.next_available(
+                person_key(p.name), p.time_windows, now)
+            if retry is None or retry <= now:
+                retry = now.replace(hours=+UNAVAILABLE_RETRY_HOURS)
+            self.log.debug('No locations available for {}, retrying at {}'
+                           .format(m.person_name, retry))
+            self.arm(key, entry, retry)
+            return False
+
+        idx = int(m.last_loc or 0) + 1
+        if idx >= len(avail_windows):
+            idx = 0
+        active_window = avail_windows[idx]
+        self.log.info('Publishing message for person %s to location %s'
+                      % (m.person_name, active_window.location_name))
+        if self.simulate:
+            entry.item['last_occurrence_in_utc'] = now.isoformat()
+            entry.item.pop('next_occurrence_in_utc', None)
+        else:
+            mm = MessageManager(LocationName=active_window.location_name)
+            occurrence = occurrence_time(m, now)
+            mm.publish_message(Body=m.body, UUID=m.uuid_key,
+                               PersonName=m.person_name,
+                               NoMoreOccurrences=m.no_more_occurrences,
+                               BotNames=m.bot_names,
+                               IceBreaker=m.ice_breaker,
+                               VoiceId=m.voice_id,
+                               RequiredBots=m.required_bots,
+                               WindowsVersion=p.windows_version,
+                               OccurrenceDateTimeInUtc=occurrence
+                               .isoformat(),
+                               AfterDelivery=after_delivery(m, occurrence),
+                               ExpirationDateTimeInUtc=m.next_expiration_utc
+                               .isoformat())
+            self.scheduler.update_queue_status(m.uuid_key, m.person_name,
+                                               True)
+            self.scheduler.update_last_location(m.uuid_key, m.person_name,
+                                                idx)
+            entry.item['in_queue'] = True
+        entry.item['last_location_index'] = idx
+        self.apply(entry.item)
+        return True
+
+    def poll_changes(self):
+        if self.stream is not None and self.stream.enabled:
+            for event_name, item in self.stream.changes():
+                key = (item['uuid'], item['person_name'])
+                if event_name == 'REMOVE':
+                    self.remove(key)
+                else:
+                    self.apply(item)
+        elif time.time() - self.last_sync > self.resync_seconds:
+            self.load()
+
+    def wait_seconds(self):
+        if self.stream is not None and self.stream.enabled:
+            limit = STREAM_POLL_SECONDS
+        else:
+            limit = max(0, self.last_sync + self.resync_seconds - time.time())
+        due = self.next_due()
+        if due is None:
+            return limit
+        return max(0, min(limit, (due - to_micros(arrow.utcnow())) / 1e6))
+
+    def open(self):
+        # open the stream before loading so no change falls in between
+        self.stream = ScheduleStream()
+        if not self.stream.enabled:
+            self.log.warn('{} has no stream, rereading every {}s'
+                          .format(MESSAGE_SCHEDULE_DB, self.resync_seconds))
+        self.load()
+
+    def run(self):
+        failures = 0
+        stale = True
+        while not self.stopped.is_set():
+            try:
+                if stale:
+                    self.open()
+                    stale = False
+                self.run_pending()
+                self.poll_changes()
+            except Exception as e:
+                failures += 1
+                wait = min(ERROR_BACKOFF_MAX_SECONDS,
+                           ERROR_BACKOFF_SECONDS * 2 ** (failures - 1))
+                self.log.error('Scheduler pass failed, retrying in {}s: {}'
+                               .format(wait, e))
+                # the heap or the stream position may be off now, so start
+                # over from the table
+                stale = True
+                self.stopped.wait(wait)
+                continue
+            failures = 0
+            self.stopped.wait(self.wait_seconds())
+
+    def stop(self):
+        self.stopped.set()
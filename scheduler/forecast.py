@@ -0,0 +1,189 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""delivery plan for every schedule over a horizon"""
+import csv
+import logging
+import multiprocessing
+import arrow
+import numpy as np
+from person.person import PersonManager
+from time_window.timeline import WindowTimeline
+from .scheduler import Scheduler, convert_to_scheduled_message
+from .store import Interner
+
+FORECAST_HORIZON_DAYS = 30
+# marks an occurrence nobody is available for inside the horizon
+UNDELIVERED = -1
+PLAN_DTYPE = [('delivery', np.int64),
+              ('occurrence', np.int64),
+              ('person', np.int32),
+              ('location', np.int32),
+              ('uuid', np.int32)]
+
+
+def expand_item(args):
+    """epoch minutes of every occurrence of one schedule row in
+    [start, end). an overdue occurrence is reported at start. runs in the
+    worker processes, so it takes and returns plain values"""
+    item, start, end = args
+    if item.get('expired'):
+        return []
+    m = convert_to_scheduled_message(item)
+    start = arrow.get(start)
+    end = min(arrow.get(end), m.end_datetime_in_utc)
+    pending = m.pending_occurrence_utc
+    if not pending or pending >= end:
+        return []
+    occurrences = [max(pending, start)]
+    rule = m.occurrence_rule()
+    if rule:
+        occurrences += [arrow.get(o) for o in
+                        rule.between(max(pending, start).datetime,
+                                     end.datetime)
+                        if arrow.get(o) > pending]
+    return [o.timestamp // 60 for o in occurrences]
+
+
+def next_available(available):
+    """for each minute, the first minute at or after it with a window
+    open (len(available) when there is none)"""
+    horizon = len(available)
+    minutes = np.where(available, np.arange(horizon), horizon)
+    return np.minimum.accumulate(minutes[::-1])[::-1]
+
+
+class DeliveryPlan(object):
+    """sorted (delivery minute, person, location) rows with the string
+    tables needed to read them back"""
+    def __init__(self, rows, people, locations, uuids):
+        self.rows = rows
+        self.people = people
+        self.locations = locations
+        self.uuids = uuids
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        for r in self.rows:
+            yield {
+                'delivery_utc': self._time(r['delivery']),
+                'occurrence_utc': self._time(r['occurrence']),
+                'person_name': self.people.get(r['person']),
+                'location_name': self._location(r['location']),
+                'uuid': self.uuids.get(r['uuid'])
+            }
+
+    def _time(self, minute):
+        if minute == UNDELIVERED:
+            return ''
+        return arrow.get(int(minute) * 60).isoformat()
+
+    def _location(self, i):
+        if i == UNDELIVERED:
+            return ''
+        return self.locations.get(i)
+
+    def per_minute(self):
+        """(epoch minute, deliveries) for every minute with a delivery"""
+        delivered = self.rows['delivery'][self.rows['delivery'] !=
+                                          UNDELIVERED]
+        return np.unique(delivered, return_counts=True)
+
+    def write_csv(self, f):
+        writer = csv.DictWriter(f, ['delivery_utc', 'person_name',
+                                    'location_name', 'uuid',
+                                    'occurrence_utc'])
+        writer.writeheader()
+        for r in self:
+            writer.writerow(r)
+
+    def save(self, path):
+        np.savez_compressed(path, rows=self.rows,
+                            people=np.array(self.people.values),
+                            locations=np.array(self.locations.values),
+                            uuids=np.array(self.uuids.values))
+
+
+def forecast(**kwargs):
+    """expand every schedule and person window set over the horizon into a
+    DeliveryPlan. each occurrence is delivered at the first minute its
+    person has a window open, to the highest priority location open then"""
+    start = arrow.get(kwargs.get('Start') or arrow.utcnow()) \
+        .to('UTC').floor('minute')
+    days = kwargs.get('HorizonDays', FORECAST_HORIZON_DAYS)
+    processes = kwargs.get('Processes')
+    items = kwargs.get('Items')
+    people = kwargs.get('People')
+    if items is None:
+        items = Scheduler().get_all_items(IncludeExpired=False)
+    if people is None:
+        people = PersonManager().get_all() or []
+    items = [i for i in items]
+    end = start.replace(days=+days)
+    horizon = days * 24 * 60
+
+    args = [(i, start.isoformat(), end.isoformat()) for i in items]
+    if processes == 1 or len(args) < 2:
+        expanded = map(expand_item, args)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            expanded = pool.map(expand_item, args,
+                                chunksize=max(1, len(args) // 64))
+        finally:
+            pool.close()
+            pool.join()
+
+    person_names = Interner()
+    locations = Interner()
+    uuids = Interner()
+    timelines = {}
+    for p in people:
+        t = WindowTimeline(p.time_windows, start, horizon)
+        ids = np.array([locations.id(w.location_name) for w in t.windows],
+                       dtype=np.int32)
+        timelines[p.name] = (t, ids, next_available(t.bitmap.any(axis=0)))
+
+    chunks = []
+    origin = start.timestamp // 60
+    for item, minutes in zip(items, expanded):
+        if not minutes:
+            continue
+        occurrence = np.array(minutes, dtype=np.int64)
+        plan = np.zeros(len(occurrence), dtype=PLAN_DTYPE)
+        plan['occurrence'] = occurrence
+        plan['person'] = person_names.id(item['person_name'])
+        plan['uuid'] = uuids.id(item['uuid'])
+        plan['delivery'] = UNDELIVERED
+        plan['location'] = UNDELIVERED
+        if item['person_name'] in timelines:
+            t, ids, first_open = timelines[item['person_name']]
+            delivery = first_open[occurrence - origin]
+            ok = delivery < horizon
+            if ok.any():
+                # rows are in priority order, argmax finds the first open
+                rows = np.argmax(t.bitmap[:, delivery[ok]], axis=0)
+                plan['delivery'][ok] = delivery[ok] + origin
+                plan['location'][ok] = ids[rows]
+        chunks.append(plan)
+
+    if chunks:
+        rows = np.concatenate(chunks)
+    else:
+        rows = np.zeros(0, dtype=PLAN_DTYPE)
+    # undelivered rows sort last
+    key = np.where(rows['delivery'] == UNDELIVERED,
+                   np.iinfo(np.int64).max, rows['delivery'])
+    rows = rows[np.lexsort((rows['location'], rows['person'], key))]
+    logging.info('Forecast: %s occurrences over %s days' % (len(rows), days))
+    return DeliveryPlan(rows, person_names, locations, uuids)
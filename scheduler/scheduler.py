@@ -9,21 +9,209 @@
 # or implied. See the License for the specific language governing permissions
 # and limitations under the License.
 
-import boto3
+from helpers import aws
 import arrow
-from helpers.db_helpers import validate_table
+from boto3.dynamodb.conditions import Key, Attr
+from botocore.exceptions import ClientError
+from helpers.db_helpers import validate_table, scan_table
+from helpers.schema import schema_registry
 from datetime import datetime
 from messages.message import ScheduledMessage  # noqa: E402
+from .store import ScheduleStore
+from multiprocessing.pool import ThreadPool
+import copy
 import logging
 import os
+import sys
+import threading
 
 MESSAGE_SCHEDULE_DB = 'PollexyMessageSchedule'
+DUE_INDEX = 'due_index'
+DUE_BUCKET_FORMAT = 'YYYY-MM-DD'
+# day buckets read by the queue pass. anything it finds still due from
+# before yesterday moves to OVERDUE_BUCKET, which is always read, so only
+# a week with no queue pass at all can leave a row behind (and the first
+# pass of each process, see due_index_ready, picks those up)
+DUE_LOOKBACK_DAYS = 7
+OVERDUE_BUCKET = 'overdue'
+# due candidates checked at a time by iter_messages, so the first ready
+# messages go out while the rest are still being read
+READY_BATCH_SIZE = 100
+# concurrent writers used by the *_batch acknowledgements, kept for the
+# life of the process
+ACK_WORKERS = 8
+_ack_pool = None
+_ack_pool_lock = threading.Lock()
+TRIED_LOCATIONS_APPEND = 'list_append(if_not_exists(tried_locations, ' \
+    ':empty), :tl)'
+# how far ahead the queue pass publishes, relying on DelaySeconds to hold
+# each message back until its occurrence. no more than 15 minutes
+QUEUE_LOOKAHEAD_ENV = 'POLLEXY_QUEUE_LOOKAHEAD_SECONDS'
+
+
+def queue_lookahead():
+    return int(os.environ.get(QUEUE_LOOKAHEAD_ENV, 0))
+
+
+def delivery_time(scheduled_message, now):
+    """when a message picked up by a look-ahead pass is due: its pending
+    occurrence, or now if that has already passed. next_expiration_utc is
+    then worked out from the occurrence rather than from now"""
+    pending = scheduled_message.pending_occurrence_utc
+    if pending is None or pending <= now:
+        return now
+    scheduled_message.compare_datetime_in_utc = pending
+    return pending
+
+
+def occurrence_time(scheduled_message, now):
+    """the occurrence a delivery is for. next_occurrence_utc is 'N/A' on
+    the last occurrence of a COUNT or UNTIL rule, so this goes by the
+    pending occurrence, or now if there isn't one"""
+    pending = scheduled_message.pending_occurrence_utc
+    return pending if pending is not None else now
+
+
+def after_delivery(scheduled_message, occurrence):
+    """the schedule row once occurrence has been spoken: [the pending
+    occurrence after it ('' if there isn't one), the occurrence cursor
+    ('' if there isn't one), the cursor skip]. published with the message
+    so marking it delivered doesn't have to read the row"""
+    m = copy.copy(scheduled_message)
+    m.mark_spoken(arrow.get(occurrence))
+    m.advance_cursor()
+    pending = m.pending_occurrence_utc
+    return [pending.to('UTC').isoformat() if pending else '',
+            m.occurrence_cursor.isoformat() if m.occurrence_cursor else '',
+            m.occurrence_cursor_skip]
+
+
+def ack_pool():
+    global _ack_pool
+    with _ack_pool_lock:
+        if _ack_pool is None:
+            _ack_pool = ThreadPool(ACK_WORKERS)
+        return _ack_pool
+
+
+def due_bucket(dt):
+    return arrow.get(dt).to('UTC').format(DUE_BUCKET_FORMAT)
+
+
+def due_buckets(compare_date, lookback_days=DUE_LOOKBACK_DAYS):
+    day = arrow.get(compare_date).to('UTC').floor('day')
+    return [due_bucket(day.replace(days=-i))
+            for i in range(lookback_days, -1, -1)]
+
+
+def pending_bucket(pending, now=None):
+    """the bucket for an occurrence: its day, or OVERDUE_BUCKET once that
+    day is before yesterday"""
+    if not now:
+        now = arrow.utcnow()
+    bucket = due_bucket(pending)
+    if bucket < due_bucket(arrow.get(now).replace(days=-1)):
+        return OVERDUE_BUCKET
+    return bucket
+
+
+def due_attributes(scheduled_message, now=None):
+    """next_occurrence_in_utc/due_bucket for the due index, or None when
+    the message has nothing left to deliver"""
+    pending = scheduled_message.pending_occurrence_utc
+    if not pending:
+        return None
+    return {
+        'next_occurrence_in_utc': pending.to('UTC').isoformat(),
+        'due_bucket': pending_bucket(pending, now)
+    }
+
+
+def due_index():
+    return {
+        'IndexName': DUE_INDEX,
+        'KeySchema': [
+            {
+                'AttributeName': 'due_bucket',
+                'KeyType': 'HASH'
+            },
+            {
+                'AttributeName': 'next_occurrence_in_utc',
+                'KeyType': 'RANGE'
+            }
+        ],
+        'Projection': {
+            'ProjectionType': 'ALL'
+        },
+        'ProvisionedThroughput': {
+            'ReadCapacityUnits': 1,
+            'WriteCapacityUnits': 1,
+        }
+    }
+
+
+def delivery_update(item, delivered_at, **kwargs):
+    """UpdateExpression and values for a delivered occurrence of item: the
+    last occurrence, the occurrence cursor and the due index, plus in_queue
+    and expired when InQueue/NoMoreOccurrences are passed. without an item,
+    the cursor and due index come from AfterDelivery (after_delivery)"""
+    in_queue = kwargs.get('InQueue')
+    no_more_occurrences = kwargs.get('NoMoreOccurrences', False)
+    after = kwargs.get('AfterDelivery')
+    upd = ['last_occurrence_in_utc=:lo']
+    attr = {':lo': delivered_at.isoformat()}
+    due = None
+    cursor = None
+    if item:
+        m = convert_to_scheduled_message(item)
+        m.mark_spoken(delivered_at)
+        m.advance_cursor()
+        due = due_attributes(m, delivered_at)
+        if m.occurrence_cursor:
+            cursor = m.occurrence_cursor.isoformat()
+            skip = m.occurrence_cursor_skip
+    elif after:
+        pending, cursor, skip = after
+        if pending:
+            due = {'next_occurrence_in_utc': pending,
+                   'due_bucket': pending_bucket(pending, delivered_at)}
+    if cursor:
+        upd.append('occurrence_cursor=:oc')
+        upd.append('occurrence_cursor_skip=:os')
+        attr[':oc'] = cursor
+        attr[':os'] = skip
+    if in_queue is not None:
+        upd.append('in_queue=:iq')
+        attr[':iq'] = in_queue
+    if no_more_occurrences:
+        upd.append('expired=:ex')
+        attr[':ex'] = True
+        due = None
+    if due:
+        upd.append('next_occurrence_in_utc=:no')
+        upd.append('due_bucket=:db')
+        attr[':no'] = due['next_occurrence_in_utc']
+        attr[':db'] = due['due_bucket']
+        return 'SET ' + ', '.join(upd), attr
+    return 'SET ' + ', '.join(upd) + \
+        ' REMOVE next_occurrence_in_utc, due_bucket', attr
+
+
+def not_expired():
+    return Attr('expired').not_exists() | Attr('expired').eq(False)
+
+
+def not_queued():
+    return Attr('in_queue').not_exists() | Attr('in_queue').eq(False)
 
 
 def convert_to_scheduled_message(db_message):
     last = db_message.get("last_occurrence_in_utc", None)
     if db_message.get("last_occurrence_in_utc", None):
         last = arrow.get(last)
+    cursor = db_message.get("occurrence_cursor", None)
+    if cursor:
+        cursor = arrow.get(cursor)
     return (ScheduledMessage(
         UUID=db_message["uuid"],
         StartDateTimeInUtc=arrow.get(db_message["start_datetime_in_utc"]),
@@ -33,9 +221,12 @@ def convert_to_scheduled_message(db_message):
         PersonName=db_message["person_name"],
         LastLocationIndex=db_message.get('last_location_index', 0),
         LastOccurrenceInUtc=last,
+        OccurrenceCursor=cursor,
+        OccurrenceCursorSkip=int(db_message.get("occurrence_cursor_skip", 0)),
         BotNames=db_message.get("bot_names", ""),
         IceBreaker=db_message.get("ice_breaker", ""),
         RequiredBots=db_message.get("required_bots", ""),
+        VoiceId=db_message.get("voice_id", "Joanna"),
         EndDateTimeInUtc=arrow.get(db_message["end_datetime_in_utc"])))
 
 
@@ -56,61 +247,219 @@ class Scheduler(object):
         start_datetime_in_utc = \
             scheduled_message.start_datetime_in_utc.isoformat()
 
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
         logging.info('Storing message in ' + MESSAGE_SCHEDULE_DB)
-        table.put_item(
-           Item={
-               'uuid': scheduled_message.uuid_key,
-               'create_time': datetime_in_utc,
-               'ical': ical,
-               'bot_names': scheduled_message.bot_names,
-               'required_bots': scheduled_message.required_bots,
-               'ice_breaker': scheduled_message.ice_breaker,
-               'person_name': person_name,
-               'start_datetime_in_utc': start_datetime_in_utc,
-               'end_datetime_in_utc': end_datetime_in_utc,
-               'body': body
-            }
-        )
+        item = {
+            'uuid': scheduled_message.uuid_key,
+            'create_time': datetime_in_utc,
+            'ical': ical,
+            'bot_names': scheduled_message.bot_names,
+            'required_bots': scheduled_message.required_bots,
+            'ice_breaker': scheduled_message.ice_breaker,
+            'voice_id': scheduled_message.voice_id,
+            'person_name': person_name,
+            'start_datetime_in_utc': start_datetime_in_utc,
+            'end_datetime_in_utc': end_datetime_in_utc,
+            'body': body
+        }
+        item.update(due_attributes(scheduled_message) or {})
+        table.put_item(Item=item)
 
     def get_messages(self, compare_date='', ready_only=True, **kwargs):
+        scheduled_messages = [m for m in self.iter_messages(compare_date,
+                                                            ready_only,
+                                                            **kwargs)]
+        self.log.debug("Number of scheduled messages: %s"
+                       % len(scheduled_messages))
+        return scheduled_messages
+
+    def iter_messages(self, compare_date='', ready_only=True, **kwargs):
+        """same as get_messages, but yields each message as soon as it's
+        read so callers can start working before the read finishes"""
         include_expired = kwargs.get('IncludeExpired', False)
         self.log.debug("Checking for scheduled messages: compare_date={}," +
                        "ready_only={}".format(compare_date, bool(ready_only)))
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
-        response = table.scan(
-              Select='ALL_ATTRIBUTES'
-              )
-        scheduled_messages = []
         if not compare_date:
             compare_date = arrow.utcnow()
             self.log.debug('Checking messages using uctnow since compare_dt ' +
                            'is empty, compare_date=%s'
                            % compare_date.isoformat())
-            self.log.debug("Total number of scheduled messages in table %s: %s"
-                           % (MESSAGE_SCHEDULE_DB, len(response['Items'])))
-        for item in response['Items']:
+        if ready_only:
+            candidates = 0
+            batch = []
+            for item in self.get_due_items(compare_date):
+                batch.append(item)
+                if len(batch) < READY_BATCH_SIZE:
+                    continue
+                candidates += len(batch)
+                for m in self._ready(batch, compare_date):
+                    yield m
+                batch = []
+            candidates += len(batch)
+            for m in self._ready(batch, compare_date):
+                yield m
+            self.log.debug('Due candidates: %s' % candidates)
+            return
+        for item in self.get_all_items(IncludeExpired=include_expired):
             m = convert_to_scheduled_message(item)
             if m.no_more_occurrences and not include_expired:
                 continue
-            self.log.debug('Message: {}'.format(m.body))
-            if not ready_only or (ready_only and
-                                  m.is_message_ready(
-                                      CompareDateTimeInUtc=compare_date)):
-                self.log.debug('Adding message to response:')
-                scheduled_messages.append(convert_to_scheduled_message(item))
-            else:
-                self.log.debug('Skipping message, ready_only=%s, msg_rdy=%s'
-                               % (ready_only, m.is_message_ready(
-                                  CompareDateTimeInUtc=compare_date)))
-        self.log.debug("Number of scheduled messages: %s"
-                       % len(scheduled_messages))
-        return scheduled_messages
+            self.log.debug('Adding message to response: {}'.format(m.body))
+            yield m
+
+    def _ready(self, items, compare_date):
+        for m in ScheduleStore(items).ready_messages(compare_date):
+            self.log.debug('Adding message to response: {}'.format(m.body))
+            yield m
+
+    def load_store(self, **kwargs):
+        """the whole schedule as a ScheduleStore, for callers that ask
+        "what is ready at T" for many values of T"""
+        include_expired = kwargs.get('IncludeExpired', False)
+        return ScheduleStore(
+            self.get_all_items(IncludeExpired=include_expired))
+
+    def get_all_items(self, **kwargs):
+        include_expired = kwargs.get('IncludeExpired', True)
+        scan_kwargs = {}
+        if not include_expired:
+            scan_kwargs['FilterExpression'] = not_expired()
+        return scan_table(MESSAGE_SCHEDULE_DB, **scan_kwargs)
+
+    def get_due_items(self, compare_date):
+        """query the due index for the overdue bucket and every day bucket
+        up to compare_date. scans instead while the index isn't ready"""
+        if not self.due_index_ready():
+            self.log.warn('{} is not ready, scanning for due messages'
+                          .format(DUE_INDEX))
+            compare_iso = arrow.get(compare_date).to('UTC').isoformat()
+            for item in self.get_all_items(IncludeExpired=False):
+                due = item.get('next_occurrence_in_utc')
+                if not item.get('in_queue') and (not due or
+                                                 due <= compare_iso):
+                    yield item
+            return
+        dynamodb = aws.resource('dynamodb')
+        table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
+        compare_iso = arrow.get(compare_date).to('UTC').isoformat()
+        for bucket in [OVERDUE_BUCKET] + due_buckets(compare_date):
+            kwargs = {
+                'IndexName': DUE_INDEX,
+                'KeyConditionExpression':
+                    Key('due_bucket').eq(bucket) &
+                    Key('next_occurrence_in_utc').lte(compare_iso),
+                'FilterExpression': not_expired() & not_queued()
+            }
+            while True:
+                response = table.query(**kwargs)
+                for item in response['Items']:
+                    self.rebucket(table, item, compare_date)
+                    yield item
+                if 'LastEvaluatedKey' not in response:
+                    break
+                kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def rebucket(self, table, item, now):
+        """move a row that's still due from before yesterday to the
+        overdue bucket, so it can't age out of the day buckets"""
+        bucket = pending_bucket(item['next_occurrence_in_utc'], now)
+        if bucket == item['due_bucket']:
+            return
+        table.update_item(
+            Key={
+                'uuid': item['uuid'],
+                'person_name': item['person_name']
+            },
+            UpdateExpression='SET due_bucket=:db',
+            ExpressionAttributeValues={':db': bucket}
+        )
+
+    def due_index_ready(self):
+        """the first time in a process, make sure the due index exists and
+        every row is in it"""
+        return schema_registry.ensure_step(
+            '{}#{}'.format(MESSAGE_SCHEDULE_DB, DUE_INDEX),
+            self.prepare_due_index)
+
+    def prepare_due_index(self):
+        """True once the due index is active and rows written before it
+        (or stranded in an old day bucket) have been backfilled. creates
+        the index on tables that predate it"""
+        client = aws.client('dynamodb')
+        table = client.describe_table(TableName=MESSAGE_SCHEDULE_DB)['Table']
+        index = [i for i in table.get('GlobalSecondaryIndexes', [])
+                 if i['IndexName'] == DUE_INDEX]
+        if not index:
+            self.log.warn('Creating {} on {}'.format(DUE_INDEX,
+                                                     MESSAGE_SCHEDULE_DB))
+            client.update_table(
+                TableName=MESSAGE_SCHEDULE_DB,
+                AttributeDefinitions=[
+                    {'AttributeName': 'due_bucket', 'AttributeType': 'S'},
+                    {'AttributeName': 'next_occurrence_in_utc',
+                     'AttributeType': 'S'}],
+                GlobalSecondaryIndexUpdates=[{'Create': due_index()}])
+            return False
+        if index[0].get('IndexStatus', 'ACTIVE') != 'ACTIVE':
+            return False
+        count = self.reindex_messages(Stale=True)
+        if count:
+            self.log.info('Added {} messages to {}'.format(count, DUE_INDEX))
+        return True
+
+    def get_item(self, uuid, person_name):
+        dynamodb = aws.resource('dynamodb')
+        table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
+        return table.get_item(Key={
+            'uuid': uuid,
+            'person_name': person_name
+        }).get('Item')
+
+    def reindex_messages(self, **kwargs):
+        """backfill the due index for messages written before it existed.
+        Stale limits it to unexpired rows that aren't in the index or are
+        in a day bucket the queue pass no longer reads"""
+        scan_kwargs = {}
+        if kwargs.get('Stale', False):
+            oldest = due_buckets(arrow.utcnow())[0]
+            scan_kwargs['FilterExpression'] = not_expired() & \
+                (Attr('due_bucket').not_exists() |
+                 Attr('due_bucket').lt(oldest))
+        count = 0
+        for item in scan_table(MESSAGE_SCHEDULE_DB, **scan_kwargs):
+            m = convert_to_scheduled_message(item)
+            self.update_due(m.uuid_key, m.person_name, due_attributes(m))
+            count += 1
+        return count
+
+    def update_due(self, uuid, person_name, due):
+        dynamodb = aws.resource('dynamodb')
+        table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
+        if due:
+            table.update_item(
+                Key={
+                    'uuid': uuid,
+                    'person_name': person_name
+                },
+                UpdateExpression='SET next_occurrence_in_utc=:no, '
+                                 'due_bucket=:db',
+                ExpressionAttributeValues={
+                    ':no': due['next_occurrence_in_utc'],
+                    ':db': due['due_bucket']
+                }
+            )
+        else:
+            table.update_item(
+                Key={
+                    'uuid': uuid,
+                    'person_name': person_name
+                },
+                UpdateExpression='REMOVE next_occurrence_in_utc, due_bucket'
+            )
 
     def create_schedule_table(self):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.create_table(
                     TableName=MESSAGE_SCHEDULE_DB,
                     KeySchema=[
@@ -132,17 +481,30 @@ class Scheduler(object):
                             'AttributeName': 'person_name',
                             'AttributeType': 'S'
                         },
+                        {
+                            'AttributeName': 'due_bucket',
+                            'AttributeType': 'S'
+                        },
+                        {
+                            'AttributeName': 'next_occurrence_in_utc',
+                            'AttributeType': 'S'
+                        },
                     ],
+                    GlobalSecondaryIndexes=[due_index()],
                     ProvisionedThroughput={
                         'ReadCapacityUnits': 1,
                         'WriteCapacityUnits': 1,
+                    },
+                    StreamSpecification={
+                        'StreamEnabled': True,
+                        'StreamViewType': 'NEW_IMAGE'
                     }
                 )
         table.meta.client.get_waiter('table_exists') \
             .wait(TableName=MESSAGE_SCHEDULE_DB)
 
     def update_last_location(self, uuid, person_name, last_loc=0):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
         table.update_item(
             Key={
@@ -156,7 +518,7 @@ class Scheduler(object):
         )
 
     def update_queue_status(self, uuid, person_name, is_queued=True):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
         self.log.debug('Marking message in queue')
         table.update_item(
@@ -171,54 +533,188 @@ class Scheduler(object):
         )
 
     def set_expired(self, uuid, person_name, is_expired=True):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
+        # expired messages drop out of the (sparse) due index
+        upd_expr = 'SET expired=:lo'
+        if is_expired:
+            upd_expr += ' REMOVE next_occurrence_in_utc, due_bucket'
         table.update_item(
             Key={
                 'uuid': uuid,
                 'person_name': person_name
             },
-            UpdateExpression='SET expired=:lo',
+            UpdateExpression=upd_expr,
             ExpressionAttributeValues={
                 ':lo': is_expired
             }
         )
 
     def update_last_occurrence(self, uuid, person_name, last_occurrence=None):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
         if not last_occurrence:
             last_occurrence = arrow.utcnow()
+        item = self.get_item(uuid, person_name)
+        upd_expr, attr = delivery_update(item, last_occurrence)
         table.update_item(
             Key={
                 'uuid': uuid,
                 'person_name': person_name
             },
-            UpdateExpression='SET last_occurrence_in_utc=:lo',
+            UpdateExpression=upd_expr,
+            ExpressionAttributeValues=attr
+        )
+
+    def mark_delivered(self, **kwargs):
+        """record a spoken message: last occurrence, cursor, due index,
+        in_queue and (for the last occurrence) expired in one conditional
+        write"""
+        dynamodb = aws.resource('dynamodb')
+        return self._mark_delivered(dynamodb.Table(MESSAGE_SCHEDULE_DB),
+                                    **kwargs)
+
+    def _mark_delivered(self, table, **kwargs):
+        uuid = kwargs.get('UUID')
+        person_name = kwargs.get('PersonName')
+        key = {
+            'uuid': uuid,
+            'person_name': person_name
+        }
+        delivered_at = kwargs.get('DeliveredDateTimeInUtc') or arrow.utcnow()
+        no_more_occurrences = kwargs.get('NoMoreOccurrences', False)
+        after = kwargs.get('AfterDelivery')
+        # the publisher worked the row out as of the occurrence; it holds
+        # as of now unless the next occurrence has come round since
+        if after and (not after[0] or arrow.get(after[0]) > delivered_at):
+            upd_expr, attr = delivery_update(
+                None, delivered_at, InQueue=False,
+                NoMoreOccurrences=no_more_occurrences, AfterDelivery=after)
+            return self._conditional_update(table, key, upd_expr, attr)
+        item = table.get_item(Key=key).get('Item')
+        if not item:
+            self.log.warn('Delivered message {} is no longer scheduled'
+                          .format(uuid))
+            return False
+        upd_expr, attr = delivery_update(
+            item, delivered_at, InQueue=False,
+            NoMoreOccurrences=no_more_occurrences)
+        return self._conditional_update(table, key, upd_expr, attr)
+
+    def mark_failed(self, **kwargs):
+        """take a message out of the queue after a failed delivery,
+        remembering the location that was tried"""
+        dynamodb = aws.resource('dynamodb')
+        return self._mark_failed(dynamodb.Table(MESSAGE_SCHEDULE_DB),
+                                 **kwargs)
+
+    def _mark_failed(self, table, **kwargs):
+        key = {
+            'uuid': kwargs.get('UUID'),
+            'person_name': kwargs.get('PersonName')
+        }
+        upd_expr = 'SET in_queue=:iq'
+        attr = {':iq': False}
+        location_name = kwargs.get('LocationName')
+        if location_name:
+            upd_expr += ', tried_locations=' + TRIED_LOCATIONS_APPEND
+            attr[':empty'] = []
+            attr[':tl'] = [location_name]
+        return self._conditional_update(table, key, upd_expr, attr)
+
+    def mark_queued_batch(self, queued):
+        """in_queue and last_location_index for every published message,
+        as dicts of UUID, PersonName and LocationIndex"""
+        return self._batch(self._mark_queued, queued)
+
+    def _mark_queued(self, table, **kwargs):
+        table.update_item(
+            Key={
+                'uuid': kwargs.get('UUID'),
+                'person_name': kwargs.get('PersonName')
+            },
+            UpdateExpression='SET in_queue=:iq, last_location_index=:lo',
             ExpressionAttributeValues={
-                ':lo': last_occurrence.isoformat()
+                ':iq': True,
+                ':lo': kwargs.get('LocationIndex', 0)
             }
         )
+        return True
+
+    def mark_taken_batch(self, taken):
+        """in_queue off for every message received from a queue, as dicts
+        of UUID and PersonName"""
+        return self._batch(self._mark_taken, taken)
+
+    def _mark_taken(self, table, **kwargs):
+        key = {
+            'uuid': kwargs.get('UUID'),
+            'person_name': kwargs.get('PersonName')
+        }
+        return self._conditional_update(table, key, 'SET in_queue=:iq',
+                                        {':iq': False})
+
+    def _conditional_update(self, table, key, upd_expr, attr):
+        # never resurrect a row that was deleted while it was queued
+        try:
+            table.update_item(
+                Key=key,
+                UpdateExpression=upd_expr,
+                ExpressionAttributeValues=attr,
+                ConditionExpression=Attr('uuid').exists()
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != \
+                    'ConditionalCheckFailedException':
+                raise
+            self.log.warn('Message {} is no longer scheduled'
+                          .format(key['uuid']))
+            return False
+        return True
+
+    def mark_delivered_batch(self, deliveries):
+        """mark_delivered for every dict of kwargs in deliveries, written
+        concurrently. returns the number of rows updated"""
+        return self._batch(self._mark_delivered, deliveries)
+
+    def mark_failed_batch(self, failures):
+        return self._batch(self._mark_failed, failures)
+
+    def _batch(self, ack, batch):
+        batch = [b for b in batch]
+        table = aws.resource('dynamodb').Table(MESSAGE_SCHEDULE_DB)
+        if len(batch) < 2:
+            return sum(1 for b in batch if ack(table, **b))
+
+        def attempt(b):
+            # the worker's sys.exc_info(), so the traceback survives
+            try:
+                return ack(table, **b), None
+            except Exception:
+                return False, sys.exc_info()
+
+        results = ack_pool().map(attempt, batch)
+        errors = [e for r, e in results if e is not None]
+        if errors:
+            exc_type, exc_value, exc_traceback = errors[0]
+            raise exc_type, exc_value, exc_traceback
+        return sum(1 for r, e in results if r)
 
     def update_tried_locations(self, **kwargs):
         uuid = kwargs.get('UUID')
         person_name = kwargs.get('PersonName')
         location_name = kwargs.get('LocationName')
-        current_locations = kwargs.get('TriedLocations')
-        if not current_locations:
-            current_locations = []
-
-        current_locations.append(location_name)
 
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = aws.resource('dynamodb')
         table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
         table.update_item(
             Key={
                 'uuid': uuid,
                 'person_name': person_name
             },
-            UpdateExpression='SET tried_locations=:lo',
+            UpdateExpression='SET tried_locations=' + TRIED_LOCATIONS_APPEND,
             ExpressionAttributeValues={
-                ':lo': current_locations
+                ':empty': [],
+                ':tl': [location_name]
             }
         )
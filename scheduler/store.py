@@ -0,0 +1,147 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""columnar in-memory copy of the message schedule"""
+import arrow
+import numpy as np
+
+# sentinel for "no time": never due, never ends
+NEVER = np.iinfo(np.int64).max
+# stored as columns or interned, everything else rides along per row
+EXTRA_EXCLUDED = set(['uuid', 'person_name', 'body', 'ical'])
+
+
+def to_micros(dt):
+    if not dt:
+        return NEVER
+    dt = arrow.get(dt)
+    return dt.timestamp * 1000000 + dt.microsecond
+
+
+class Interner(object):
+    """maps equal strings to one small int id (and one string instance)"""
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def id(self, value):
+        i = self.ids.get(value)
+        if i is None:
+            i = len(self.values)
+            self.ids[value] = i
+            self.values.append(value)
+        return i
+
+    def get(self, i):
+        return self.values[i]
+
+
+class ScheduleStore(object):
+    """one row per schedule item, times as int64 microseconds since the
+    epoch. readiness for a whole schedule is one vectorized comparison and
+    ScheduledMessage objects are only built for the rows that are due"""
+    COLUMNS = ('start', 'end', 'last', 'next')
+
+    def __init__(self, items=None):
+        self.people = Interner()
+        self.bodies = Interner()
+        self.icals = Interner()
+        self.uuids = []
+        self.extras = []
+        self._rows = dict((c, []) for c in self.COLUMNS + (
+            'in_queue', 'expired', 'person_id', 'body_id', 'ical_id'))
+        self._frozen = None
+        if items is not None:
+            self.add_items(items)
+
+    def __len__(self):
+        return len(self.uuids)
+
+    def add_items(self, items):
+        for item in items:
+            self.add_item(item)
+
+    def add_item(self, item):
+        """add a raw schedule row as returned by DynamoDB"""
+        rows = self._rows
+        rows['start'].append(to_micros(item['start_datetime_in_utc']))
+        rows['end'].append(to_micros(item.get('end_datetime_in_utc')))
+        rows['last'].append(to_micros(item.get('last_occurrence_in_utc')))
+        rows['next'].append(to_micros(self._pending(item)))
+        rows['in_queue'].append(bool(item.get('in_queue', False)))
+        rows['expired'].append(bool(item.get('expired', False)))
+        rows['person_id'].append(self.people.id(item['person_name']))
+        rows['body_id'].append(self.bodies.id(item['body']))
+        rows['ical_id'].append(self.icals.id(item['ical']))
+        self.uuids.append(item['uuid'])
+        self.extras.append(dict((k, v) for k, v in item.items()
+                                if k not in EXTRA_EXCLUDED))
+        self._frozen = None
+
+    def _pending(self, item):
+        # rows written since the due index carry their pending occurrence,
+        # older ones fall back to evaluating the rule once
+        if 'next_occurrence_in_utc' in item:
+            return item['next_occurrence_in_utc']
+        from .scheduler import convert_to_scheduled_message
+        return convert_to_scheduled_message(item).pending_occurrence_utc
+
+    @property
+    def columns(self):
+        if self._frozen is None:
+            rows = self._rows
+            frozen = dict((c, np.array(rows[c], dtype=np.int64))
+                          for c in self.COLUMNS)
+            frozen['in_queue'] = np.array(rows['in_queue'], dtype=bool)
+            frozen['expired'] = np.array(rows['expired'], dtype=bool)
+            for c in ('person_id', 'body_id', 'ical_id'):
+                frozen[c] = np.array(rows[c], dtype=np.int32)
+            self._frozen = frozen
+        return self._frozen
+
+    def ready_mask(self, compare_date=None, **kwargs):
+        """rows with an undelivered occurrence at or before compare_date
+        that aren't queued or expired"""
+        if not compare_date:
+            compare_date = arrow.utcnow()
+        t = to_micros(compare_date)
+        c = self.columns
+        mask = (c['next'] <= t) & (c['next'] < c['end']) & (c['end'] > t) \
+            & ~c['in_queue'] & ~c['expired']
+        person_name = kwargs.get('PersonName')
+        if person_name is not None:
+            person_id = self.people.ids.get(person_name)
+            if person_id is None:
+                return np.zeros(len(self), dtype=bool)
+            mask &= c['person_id'] == person_id
+        return mask
+
+    def ready_count(self, compare_date=None, **kwargs):
+        return int(self.ready_mask(compare_date, **kwargs).sum())
+
+    def ready_rows(self, compare_date=None, **kwargs):
+        """row numbers that are due, earliest occurrence first"""
+        rows = np.flatnonzero(self.ready_mask(compare_date, **kwargs))
+        return rows[np.argsort(self.columns['next'][rows], kind='mergesort')]
+
+    def item(self, row):
+        c = self.columns
+        item = dict(self.extras[row])
+        item['uuid'] = self.uuids[row]
+        item['person_name'] = self.people.get(c['person_id'][row])
+        item['body'] = self.bodies.get(c['body_id'][row])
+        item['ical'] = self.icals.get(c['ical_id'][row])
+        return item
+
+    def ready_messages(self, compare_date=None, **kwargs):
+        from .scheduler import convert_to_scheduled_message
+        for row in self.ready_rows(compare_date, **kwargs):
+            yield convert_to_scheduled_message(self.item(row))
@@ -0,0 +1,223 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""one mixer for the life of the process, and a queue of sounds to play"""
+import glob
+import logging
+import os
+import Queue
+import threading
+import pygame
+
+CHIME_FOLDER = os.path.expanduser("~/.pollexy/.cache/chimes")
+MIXER_FREQUENCY = 44100
+MIXER_SIZE = -16
+MIXER_CHANNELS = 2
+MIXER_BUFFER = 2048
+# how often to look again once a sound has run its length but the mixer
+# still has some of it buffered
+DRAIN_SECONDS = 0.01
+
+
+class Playback(object):
+    """a sound waiting in, or played by, the engine's queue"""
+    def __init__(self, sound, callback=None, streamed=False):
+        # a Sound, or an iterator of them when streamed
+        self.sound = sound
+        self.streamed = streamed
+        self.callback = callback
+        self.done = threading.Event()
+        self.cancelled = False
+        self.error = None
+
+    def wait(self, timeout=None):
+        """block until played (or cancelled). False if timeout passed"""
+        return self.done.wait(timeout)
+
+    def finish(self):
+        self.done.set()
+        if self.callback is not None:
+            try:
+                self.callback(self)
+            except Exception as e:
+                logging.error('Playback callback failed: {}'.format(e))
+
+
+class AudioEngine(object):
+    """plays Sounds one after another on a thread of its own. the mixer is
+    set up on the first play and left running; chimes are loaded once and
+    kept. play() returns a Playback straight away; pass Wait=True (or call
+    Playback.wait) to block until it's been heard"""
+    def __init__(self, **kwargs):
+        self.log = logging.getLogger("AudioEngine")
+        if os.environ.get('LOG_LEVEL') == 'DEBUG':
+            self.log.setLevel(logging.DEBUG)
+        self.chime_folder = kwargs.get('ChimeFolder', CHIME_FOLDER)
+        self.chimes = {}
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.interrupted = threading.Event()
+        self.channel = None
+        self.thread = None
+        self.played = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            if not pygame.mixer.get_init():
+                pygame.mixer.pre_init(MIXER_FREQUENCY, MIXER_SIZE,
+                                      MIXER_CHANNELS, MIXER_BUFFER)
+                pygame.mixer.init()
+                self.log.debug('Mixer ready: {}'
+                               .format(pygame.mixer.get_init()))
+            # keep the first channel to ourselves
+            pygame.mixer.set_reserved(1)
+            self.channel = pygame.mixer.Channel(0)
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        """cut off what's playing, drop what's queued and end the thread"""
+        self.cancel()
+        self.queue.put(None)
+        if self.thread is not None and \
+                self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def cancel(self):
+        """cut off what's playing and drop what's queued"""
+        while True:
+            try:
+                p = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            if p is not None:
+                p.cancelled = True
+                p.finish()
+        self.interrupted.set()
+
+    def load(self, path):
+        self.start()
+        return pygame.mixer.Sound(path)
+
+    def sound(self, data):
+        """a Sound from raw samples already in the mixer's format"""
+        return pygame.mixer.Sound(buffer=data)
+
+    def chime(self, name, folder=None):
+        """the chime called name (a wav in the chime folder), loaded once"""
+        path = os.path.join(folder or self.chime_folder, '{}.wav'.format(name))
+        with self.lock:
+            sound = self.chimes.get(path)
+        if sound is None:
+            sound = self.load(path)
+            with self.lock:
+                self.chimes[path] = sound
+        return sound
+
+    def preload(self, folder=None):
+        """load every chime in folder ahead of the first reminder"""
+        for path in glob.glob(os.path.join(folder or self.chime_folder,
+                                           '*.wav')):
+            name = os.path.splitext(os.path.basename(path))[0]
+            self.chime(name, folder)
+        return len(self.chimes)
+
+    def play(self, sound, **kwargs):
+        """queue sound (a Sound or a path to one) to play after everything
+        queued before it. Callback is called with the Playback when it's
+        done"""
+        self.start()
+        if isinstance(sound, basestring):
+            sound = self.load(sound)
+        p = Playback(sound, kwargs.get('Callback'))
+        self.queue.put(p)
+        if kwargs.get('Wait', False):
+            p.wait()
+        return p
+
+    def stream(self, sounds, **kwargs):
+        """queue sounds (any iterable of Sounds, read as they're needed) to
+        play back to back with no gap. the first one starts as soon as it
+        arrives; takes Wait and Callback like play()"""
+        self.start()
+        p = Playback(iter(sounds), kwargs.get('Callback'), streamed=True)
+        self.queue.put(p)
+        if kwargs.get('Wait', False):
+            p.wait()
+        return p
+
+    def mixer_format(self):
+        """(frequency, size, channels) sounds have to be in"""
+        self.start()
+        return pygame.mixer.get_init()
+
+    def busy(self):
+        return not self.queue.empty() or \
+            (self.channel is not None and self.channel.get_busy())
+
+    def run(self):
+        while True:
+            p = self.queue.get()
+            if p is None:
+                break
+            self.interrupted.clear()
+            try:
+                if p.streamed:
+                    self._play_stream(p)
+                else:
+                    self._play(p)
+            except Exception as e:
+                self.log.error('Could not play sound: {}'.format(e))
+                p.error = e
+            p.finish()
+
+    def _play(self, p):
+        self.channel.play(p.sound)
+        # sleep through the sound rather than ticking a clock; cancel()
+        # wakes us early
+        if not self.interrupted.wait(p.sound.get_length()):
+            while self.channel.get_busy() and \
+                    not self.interrupted.wait(DRAIN_SECONDS):
+                pass
+        if self.interrupted.is_set():
+            self.channel.stop()
+            p.cancelled = True
+        else:
+            self.played += 1
+
+    def _play_stream(self, p):
+        for sound in p.sound:
+            if self.interrupted.is_set():
+                break
+            if not self.channel.get_busy():
+                self.channel.play(sound)
+                continue
+            # a channel holds one sound in reserve; wait for the reserved
+            # one to start before handing it the next
+            while self.channel.get_queue() is not None and \
+                    not self.interrupted.wait(DRAIN_SECONDS):
+                pass
+            self.channel.queue(sound)
+        while self.channel.get_busy() and \
+                not self.interrupted.wait(DRAIN_SECONDS):
+            pass
+        if self.interrupted.is_set():
+            self.channel.stop()
+            p.cancelled = True
+        else:
+            self.played += 1
+
+
+audio_engine = AudioEngine()
@@ -0,0 +1,54 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""Polly pcm (16 bit, little endian, mono) as the mixer wants it"""
+import numpy
+
+# the highest rate Polly gives pcm at
+PCM_SAMPLE_RATE = 16000
+PCM_SAMPLE_BYTES = 2
+# a quarter of a second of pcm per read from the response
+PCM_CHUNK_BYTES = PCM_SAMPLE_RATE * PCM_SAMPLE_BYTES / 4
+
+
+class PcmConverter(object):
+    """resamples pcm to Rate and copies it to Channels, a chunk at a time.
+    chunks can split anywhere, even mid sample; the position carries over
+    so the joins don't click"""
+    def __init__(self, **kwargs):
+        self.rate_in = kwargs.get('SampleRate', PCM_SAMPLE_RATE)
+        self.rate_out = kwargs.get('Rate', self.rate_in)
+        self.channels = kwargs.get('Channels', 1)
+        self.step = float(self.rate_in) / self.rate_out
+        self.position = 0.0
+        self.leftover = ''
+
+    def convert(self, data):
+        data = self.leftover + data
+        usable = len(data) - len(data) % PCM_SAMPLE_BYTES
+        data, self.leftover = data[:usable], data[usable:]
+        samples = numpy.frombuffer(data, dtype='<i2')
+        picks = numpy.arange(self.position, len(samples), self.step)
+        self.position = (picks[-1] + self.step if len(picks)
+                         else self.position) - len(samples)
+        out = samples[picks.astype(int)]
+        if self.channels > 1:
+            out = numpy.repeat(out, self.channels)
+        return out.astype('<i2').tostring()
+
+
+def pcm_chunks(stream, chunk_bytes=PCM_CHUNK_BYTES):
+    """read stream chunk_bytes at a time until it's empty"""
+    while True:
+        chunk = stream.read(chunk_bytes)
+        if not chunk:
+            break
+        yield chunk
@@ -0,0 +1,154 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""renders speech for upcoming messages before they're due"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+import arrow
+from scheduler.scheduler import Scheduler, delivery_time
+from person.person import PersonManager
+from helpers.speech import SpeechHelper
+from helpers.ssml import SsmlComposer
+
+# render messages due within this long
+PRERENDER_HORIZON_SECONDS = 15 * 60
+PRERENDER_INTERVAL_SECONDS = 60
+
+
+def speech_documents(helper, bodies):
+    """the documents MessageManager.compose_speech makes when bodies are
+    the messages it takes for the person"""
+    composer = SsmlComposer()
+    for body in bodies:
+        composer.paragraph(helper.replace_tokens(body))
+    return composer.documents()
+
+
+class SpeechPrefetcher(object):
+    """every IntervalSeconds, finds the messages due within HorizonSeconds
+    for people with a window at LocationName and hands their speech to
+    Render (Speaker.render) so it's in the audio cache when it's spoken.
+    the device speaks everything it takes for a person at once, so the
+    messages for a person due at the same time are rendered together, in
+    the message's voice. tokens are filled in as of when the speech will
+    be heard, and it's rendered again when they'd come out differently (a
+    new {weather}, or a {datetime} past midnight)"""
+    def __init__(self, **kwargs):
+        self.log = logging.getLogger("SpeechPrefetcher")
+        if os.environ.get('LOG_LEVEL') == 'DEBUG':
+            self.log.setLevel(logging.DEBUG)
+        self.location_name = kwargs.get('LocationName', '').lower()
+        if not self.location_name:
+            raise ValueError('Missing location name')
+        self.render = kwargs['Render']
+        self.stream = kwargs.get('Stream', True)
+        self.horizon = kwargs.get('HorizonSeconds', PRERENDER_HORIZON_SECONDS)
+        self.interval = kwargs.get('IntervalSeconds',
+                                   PRERENDER_INTERVAL_SECONDS)
+        # (person name, uuids) -> the voice and documents last rendered
+        self.rendered = {}
+        self.stopped = threading.Event()
+        self.thread = None
+        self.renders = 0
+        self.rerenders = 0
+        self.failures = 0
+
+    def people(self):
+        """names of everyone with a window at this location"""
+        return set(p.name for p in PersonManager().get_all() or []
+                   if any(w.location_name.lower() == self.location_name
+                          for w in p.time_windows.set_list))
+
+    def upcoming(self, now=None):
+        """(message, when it will be heard) for each message due within
+        the horizon for someone with a window here"""
+        if not now:
+            now = arrow.utcnow()
+        people = self.people()
+        if not people:
+            return []
+        return [(m, delivery_time(m, now)) for m in
+                Scheduler().iter_messages(now.replace(seconds=+self.horizon))
+                if m.person_name in people]
+
+    def prefetch(self, now=None):
+        """render whatever is upcoming and not rendered as it would be
+        heard. returns the number of speeches rendered"""
+        if not now:
+            now = arrow.utcnow()
+        speeches = OrderedDict()
+        for m, at in self.upcoming(now):
+            speeches.setdefault((m.person_name, at), []).append(m)
+        helpers = {}
+        rendered = {}
+        count = 0
+        for (person_name, at), messages in speeches.items():
+            key = (person_name, tuple(m.uuid_key for m in messages))
+            helper = helpers.setdefault(
+                person_name, SpeechHelper(PersonName=person_name))
+            helper.at = at
+            try:
+                # compose_speech speaks in the last message's voice
+                voice_id = messages[-1].voice_id
+                speech = (voice_id,
+                          speech_documents(helper,
+                                           [m.body for m in messages]))
+                if self.rendered.get(key) != speech:
+                    for d in speech[1]:
+                        self.render(Message=d, TextType='ssml',
+                                    VoiceId=voice_id, Stream=self.stream)
+                    count += 1
+                    if key in self.rendered:
+                        self.rerenders += 1
+                rendered[key] = speech
+            except Exception as e:
+                self.log.error('Could not render {} messages for {}: {}'
+                               .format(len(messages), person_name, e))
+                self.failures += 1
+        # forget what's been spoken (or dropped off the schedule)
+        self.rendered = rendered
+        self.renders += count
+        self.log.debug('Rendered {} of {} upcoming speeches'
+                       .format(count, len(rendered)))
+        return count
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None and \
+                self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def run(self):
+        while True:
+            try:
+                self.prefetch()
+            except Exception as e:
+                # the schedule or people table may be back next time
+                self.log.error('Prefetch failed: {}'.format(e))
+            if self.stopped.wait(self.interval):
+                break
+
+    def stats(self):
+        return {'upcoming': len(self.rendered),
+                'renders': self.renders,
+                'rerenders': self.rerenders,
+                'failures': self.failures}
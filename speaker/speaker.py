@@ -9,13 +9,20 @@
 # or implied. See the License for the specific language governing permissions
 # and limitations under the License.
 
-import boto3
-import pygame
+from helpers import aws
+from cache.audio_cache import audio_cache, audio_key, AUDIO_EXTENSIONS
+from engine import audio_engine
+from pcm import PcmConverter, pcm_chunks, PCM_SAMPLE_RATE
 from contextlib import closing
+from StringIO import StringIO
+from multiprocessing.pool import ThreadPool
 import tempfile
 import os
 import logging
 
+# Polly requests in flight at once when speaking several documents
+SYNTHESIS_THREADS = 4
+
 
 class Speaker(object):
     def __init__(self, **kwargs):
@@ -24,8 +31,14 @@ class Speaker(object):
         self.chime_path = kwargs.pop("ChimePath",
                                      os.path.expanduser("~/.pollexy/.cache/chimes"))
         self.no_audio = kwargs.pop("NoAudio", False)
+        self.lexicons = kwargs.pop("LexiconNames", [])
+        # pass Cache=None to always go to Polly
+        self.cache = kwargs.pop("Cache", audio_cache)
+        self.engine = kwargs.pop("Engine", audio_engine)
         self.is_audio_ready = False
         self.audio_file_path = ""
+        # cached files are shared, so only temp files get cleaned up
+        self.owns_audio_file = False
 
     def just_say(self, **kwargs):
         include_chime = kwargs.pop('IncludeChime', False)
@@ -41,23 +54,44 @@ class Speaker(object):
         if not message:
             return
         if not self.no_audio:
-            polly = boto3.client('polly')
-            response = polly.synthesize_speech(
-                Text=message,
-                OutputFormat="ogg_vorbis",
-                TextType=text_type,
-                VoiceId=voice)
-
-            fd, path = tempfile.mkstemp(suffix=".ogg")
-
-            with closing(response["AudioStream"]) as stream:
-                with open(path, 'wb') as file:
-                    file.write(stream.read())
-
-            self.audio_file_path = path
+            key = audio_key(message, text_type, voice, self.output_format,
+                            self.lexicons)
+            path = self.cache.get(key, self.output_format) \
+                if self.cache is not None else None
+            if path:
+                self.audio_file_path = path
+                self.owns_audio_file = False
+            else:
+                self.synthesize(key, message, text_type, voice)
         self.message = message
         self.is_audio_ready = True
 
+    def polly_args(self, message, text_type, voice, output_format):
+        args = {'Text': message,
+                'OutputFormat': output_format,
+                'TextType': text_type,
+                'VoiceId': voice}
+        if self.lexicons:
+            args['LexiconNames'] = self.lexicons
+        return args
+
+    def synthesize(self, key, message, text_type, voice):
+        polly = aws.client('polly')
+        response = polly.synthesize_speech(**self.polly_args(
+            message, text_type, voice, self.output_format))
+        with closing(response["AudioStream"]) as stream:
+            if self.cache is not None:
+                self.audio_file_path = self.cache.put(key, stream,
+                                                      self.output_format)
+                self.owns_audio_file = False
+                return
+            fd, path = tempfile.mkstemp(
+                suffix=AUDIO_EXTENSIONS.get(self.output_format, ".audio"))
+            with os.fdopen(fd, 'wb') as file:
+                file.write(stream.read())
+        self.audio_file_path = path
+        self.owns_audio_file = True
+
     def speak(self, **kwargs):
         include_chime = kwargs.get('IncludeChime', False)
         chime = kwargs.pop("Chime", "three_tone_chime")
@@ -67,26 +101,138 @@ class Speaker(object):
         if self.no_audio:
             print "No audio . . . speech would be:\n%s" % self.message
             return "audio: %s"
+        audio_file_to_play = kwargs.pop("AudioFilePath",
+                                        self.audio_file_path)
+        if include_chime:
+            logging.info('chime={}/{}.wav'.format(self.chime_path, chime))
+            self.engine.play(self.engine.chime(chime, self.chime_path))
+        # Wait=False hands back the Playback instead of blocking on it
+        return self.engine.play(audio_file_to_play,
+                                Wait=kwargs.get('Wait', True),
+                                Callback=kwargs.get('Callback'))
+
+    def stream(self, **kwargs):
+        """say Message while Polly is still synthesizing it. pcm is played
+        a chunk at a time as it arrives, so there's no temp file and no
+        wait for the whole response. Messages (a list, e.g. from
+        SsmlComposer.documents) are played back to back: the first streams
+        while the rest are synthesized alongside it. takes IncludeChime,
+        Chime, Wait and Callback like speak()"""
+        messages = [m for m in kwargs.pop("Messages", None) or
+                    [kwargs.pop("Message", "")] if m]
+        text_type = kwargs.pop("TextType", "text")
+        voice = kwargs.pop("VoiceId", self.voice).capitalize()
+        if not messages:
+            return
+        if self.no_audio:
+            print "No audio . . . speech would be:\n%s" % "\n".join(messages)
+            return "audio: %s"
+        pool = None
+        later = []
+        if len(messages) > 1:
+            pool = ThreadPool(min(SYNTHESIS_THREADS, len(messages) - 1))
+            later = [pool.apply_async(self.pcm_audio, (m, text_type, voice))
+                     for m in messages[1:]]
+            pool.close()
+        if kwargs.get('IncludeChime', False):
+            chime = kwargs.get("Chime", "three_tone_chime")
+            self.engine.play(self.engine.chime(chime, self.chime_path))
+        wait = kwargs.get('Wait', True)
+        p = self.engine.stream(
+            self.pcm_documents(messages[0], text_type, voice, later, pool),
+            Wait=wait, Callback=kwargs.get('Callback'))
+        # synthesis happens on the engine's thread, so its errors land on
+        # the Playback
+        if wait and p.error is not None:
+            raise p.error
+        return p
+
+    def pcm_documents(self, first, text_type, voice, later, pool):
+        try:
+            for sound in self.pcm_sounds(first, text_type, voice):
+                yield sound
+            for result in later:
+                chunks = pcm_chunks(StringIO(result.get()))
+                for sound in self.to_sounds(self.pcm_converter(), chunks):
+                    yield sound
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    def pcm_sounds(self, message, text_type, voice):
+        """message as a run of short Sounds, read from the cache or from
+        Polly as it arrives (and cached once it's all arrived)"""
+        key = audio_key(message, text_type, voice, 'pcm', self.lexicons)
+        converter = self.pcm_converter()
+        path = self.cache.get(key, 'pcm') if self.cache is not None else None
+        if path:
+            with open(path, 'rb') as f:
+                for sound in self.to_sounds(converter, pcm_chunks(f)):
+                    yield sound
+            return
+        received = []
+        with closing(self.pcm_stream(message, text_type, voice)) as stream:
+            for chunk in pcm_chunks(stream):
+                received.append(chunk)
+                for sound in self.to_sounds(converter, [chunk]):
+                    yield sound
+        if self.cache is not None:
+            self.cache.put(key, StringIO(''.join(received)), 'pcm')
+
+    def pcm_audio(self, message, text_type, voice):
+        """all of message as pcm, from the cache or from Polly"""
+        key = audio_key(message, text_type, voice, 'pcm', self.lexicons)
+        path = self.cache.get(key, 'pcm') if self.cache is not None else None
+        if path:
+            with open(path, 'rb') as f:
+                return f.read()
+        with closing(self.pcm_stream(message, text_type, voice)) as stream:
+            data = stream.read()
+        if self.cache is not None:
+            self.cache.put(key, StringIO(data), 'pcm')
+        return data
+
+    def pcm_stream(self, message, text_type, voice):
+        args = self.polly_args(message, text_type, voice, 'pcm')
+        args['SampleRate'] = str(PCM_SAMPLE_RATE)
+        return aws.client('polly').synthesize_speech(**args)["AudioStream"]
+
+    def pcm_converter(self):
+        frequency, size, channels = self.engine.mixer_format()
+        return PcmConverter(SampleRate=PCM_SAMPLE_RATE,
+                            Rate=frequency, Channels=channels)
+
+    def render(self, **kwargs):
+        """synthesize Message into the audio cache without playing it: as
+        pcm for stream() (Stream=True, the default), otherwise in
+        OutputFormat for speak(). returns True if Polly was asked"""
+        message = kwargs.get("Message", "")
+        text_type = kwargs.get("TextType", "text")
+        voice = kwargs.get("VoiceId", self.voice).capitalize()
+        stream = kwargs.get("Stream", True)
+        output_format = 'pcm' if stream else self.output_format
+        key = audio_key(message, text_type, voice, output_format,
+                        self.lexicons)
+        if not message or self.cache is None or \
+                self.cache.has(key, output_format):
+            return False
+        if stream:
+            self.pcm_audio(message, text_type, voice)
         else:
-            audio_file_to_play = kwargs.pop("AudioFilePath",
-                                            self.audio_file_path)
-            pygame.mixer.pre_init(44100, -16, 2, 2048)
-            pygame.init()
-            pygame.mixer.init()
-            if (include_chime):
-                logging.info('chime={}/{}.wav'.format(self.chime_path, chime))
-                pygame.mixer.music.load("%s/%s.wav" % (self.chime_path, chime))
-                pygame.mixer.music.play()
-            while pygame.mixer.music.get_busy():
-                pygame.time.Clock().tick(10)
-            pygame.mixer.music.load(audio_file_to_play)
-            pygame.mixer.music.play(1)
-            while pygame.mixer.music.get_busy():
-                pygame.time.Clock().tick(10)
+            self.synthesize(key, message, text_type, voice)
+        return True
+
+    def to_sounds(self, converter, chunks):
+        for chunk in chunks:
+            data = converter.convert(chunk)
+            # a chunk can be too short to hold a whole sample
+            if data:
+                yield self.engine.sound(data)
 
     def cleanup(self):
-        if (self.audio_file_path):
+        if self.audio_file_path and self.owns_audio_file:
             os.unlink(self.audio_file_path)
-            self.audio_file_path = ""
+        self.audio_file_path = ""
+        self.owns_audio_file = False
         self.message = ""
         self.is_audio_ready = False
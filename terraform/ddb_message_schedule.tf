@@ -4,6 +4,8 @@ resource "aws_dynamodb_table" "ddb_message_schedule" {
   write_capacity = 20
   hash_key       = "uuid"
   range_key      = "person_name"
+  stream_enabled   = true
+  stream_view_type = "NEW_IMAGE"
 
   attribute {
     name = "uuid"
@@ -15,6 +17,25 @@ resource "aws_dynamodb_table" "ddb_message_schedule" {
     type = "S"
   }
 
+  attribute {
+    name = "due_bucket"
+    type = "S"
+  }
+
+  attribute {
+    name = "next_occurrence_in_utc"
+    type = "S"
+  }
+
+  global_secondary_index {
+    name            = "due_index"
+    hash_key        = "due_bucket"
+    range_key       = "next_occurrence_in_utc"
+    read_capacity   = 20
+    write_capacity  = 20
+    projection_type = "ALL"
+  }
+
   ttl {
     attribute_name = "TimeToExist"
     enabled = false
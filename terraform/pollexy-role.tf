@@ -28,6 +28,8 @@ resource "aws_iam_policy" "pollexy-role-policy" {
                 "arn:aws:dynamodb:us-east-1:${data.aws_caller_identity.current.account_id}:table/PollexyPeople",
                 "arn:aws:dynamodb:us-east-1:${data.aws_caller_identity.current.account_id}:table/PollexyLocations",
                 "arn:aws:dynamodb:us-east-1:${data.aws_caller_identity.current.account_id}:table/PollexyMessageSchedule",
+                "arn:aws:dynamodb:us-east-1:${data.aws_caller_identity.current.account_id}:table/PollexyMessageSchedule/stream/*",
+                "arn:aws:dynamodb:us-east-1:${data.aws_caller_identity.current.account_id}:table/PollexyMessageSchedule/index/*",
                 "arn:aws:dynamodb:us-east-1:${data.aws_caller_identity.current.account_id}:table/PollexyMessageLibrary"
             ]
         },
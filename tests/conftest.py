@@ -0,0 +1,24 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import pytest
+from helpers.schema import schema_registry
+
+
+@pytest.fixture(autouse=True)
+def fresh_schema_registry():
+    # every moto mock starts with no tables, so nothing validated in an
+    # earlier test (or listed in a developer's marker) can be trusted
+    schema_registry.clear()
+    schema_registry.use_marker = False
+    yield
+    schema_registry.clear()
+    schema_registry.use_marker = True
@@ -0,0 +1,138 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import time
+import boto3
+from mock import MagicMock, patch
+from moto import mock_sqs
+from messages.acks import AckBuffer
+from messages.heartbeat import VisibilityHeartbeat
+from messages.message_manager import MessageManager, MessagePublisher
+from messages.queue_registry import queue_registry
+
+
+def receive_all(queue):
+    received = []
+    while True:
+        messages = queue.receive_messages(MaxNumberOfMessages=10,
+                                          MessageAttributeNames=['All'])
+        if not messages:
+            return received
+        received.extend(messages)
+
+
+def queue_length(queue):
+    queue.reload()
+    return int(queue.attributes['ApproximateNumberOfMessages']) + \
+        int(queue.attributes['ApproximateNumberOfMessagesNotVisible'])
+
+
+@mock_sqs
+def test_deletes_are_buffered_and_sent_in_batches():
+    queue = boto3.resource('sqs').create_queue(QueueName='acks')
+    for i in range(25):
+        queue.send_message(MessageBody='message {}'.format(i))
+    acks = AckBuffer()
+    client = boto3.client('sqs')
+    with patch('helpers.aws.client', return_value=client), \
+            patch.object(client, 'delete_message_batch',
+                         wraps=client.delete_message_batch) as delete:
+        for m in receive_all(queue):
+            acks.delete(m)
+        assert len(acks) == 25
+        assert delete.call_count == 0
+        result = acks.flush()
+    assert delete.call_count == 3
+    assert result.deleted == 25
+    assert result.succeeded
+    assert queue_length(queue) == 0
+
+
+def test_releases_change_visibility_in_batches():
+    # moto doesn't implement change_message_visibility_batch
+    client = MagicMock()
+    client.change_message_visibility_batch.return_value = {
+        'Successful': [{'Id': '0'}]}
+    acks = AckBuffer()
+    with patch('helpers.aws.client', return_value=client):
+        acks.release(MagicMock(queue_url='url', receipt_handle='a'))
+        acks.delete(MagicMock(queue_url='url', receipt_handle='b'))
+        acks.flush_releases()
+        assert len(acks) == 1
+    entries = client.change_message_visibility_batch.call_args[1]['Entries']
+    assert entries == [{'Id': '0', 'ReceiptHandle': 'a',
+                        'VisibilityTimeout': 0}]
+    assert client.delete_message_batch.call_count == 0
+
+
+def test_overdue_acks_are_sent_on_the_next_ack():
+    client = MagicMock()
+    client.delete_message_batch.side_effect = [
+        {'Successful': [{'Id': '0'}]},
+        {'Failed': [{'Id': '0', 'Code': 'ReceiptHandleIsInvalid',
+                     'SenderFault': True}]}]
+    acks = AckBuffer(DeadlineSeconds=0)
+    with patch('helpers.aws.client', return_value=client):
+        acks.delete(MagicMock(queue_url='url', receipt_handle='a'))
+        acks.delete(MagicMock(queue_url='url', receipt_handle='b'))
+        assert client.delete_message_batch.call_count == 2
+        result = acks.flush()
+    assert result.deleted == 1
+    assert [f.message.receipt_handle for f in result.failed] == ['b']
+    assert not result.succeeded
+
+
+def test_overdue_acks_are_sent_without_another_ack():
+    client = MagicMock()
+    client.delete_message_batch.return_value = {'Successful': [{'Id': '0'}]}
+    acks = AckBuffer(DeadlineSeconds=0.05)
+    with patch('helpers.aws.client', return_value=client):
+        acks.delete(MagicMock(queue_url='url', receipt_handle='a'))
+        deadline = time.time() + 5
+        while len(acks) and time.time() < deadline:
+            time.sleep(0.01)
+        assert len(acks) == 0
+        assert acks.flush().deleted == 1
+
+
+def test_buffered_deletes_stay_held_until_sent():
+    client = MagicMock()
+    client.delete_message_batch.return_value = {'Successful': [{'Id': '0'}]}
+    heartbeat = VisibilityHeartbeat()
+    acks = AckBuffer(Heartbeat=heartbeat)
+    message = MagicMock(queue_url='url', receipt_handle='a')
+    with patch.object(heartbeat, 'start'), \
+            patch('helpers.aws.client', return_value=client):
+        heartbeat.hold(message)
+        acks.delete(message)
+        assert len(heartbeat) == 1
+        acks.flush()
+    assert len(heartbeat) == 0
+
+
+@mock_sqs
+def test_reset_drains_both_queues():
+    queue_registry.clear()
+    publisher = MessagePublisher()
+    for i in range(12):
+        publisher.add(LocationName='kitchen', UUID=str(i),
+                      PersonName='calvin', Body='Message', WindowsVersion='v1',
+                      BotNames='CheckIn' if i % 3 == 0 else None)
+    publisher.flush()
+    mm = MessageManager(LocationName='kitchen')
+    mm._scheduler = MagicMock()
+    result = mm.reset()
+    assert result.deleted == 12
+    failed = [f['UUID'] for c in mm.scheduler.mark_failed_batch.call_args_list
+              for f in c[0][0]]
+    assert sorted(failed, key=int) == [str(i) for i in range(12)]
+    assert queue_length(mm.queue) == 0
+    assert queue_length(mm.bot_queue) == 0
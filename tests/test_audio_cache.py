@@ -0,0 +1,69 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+from cache.audio_cache import AudioCache, audio_key
+
+
+def new_cache(**kwargs):
+    return AudioCache(Folder=os.path.join(tempfile.mkdtemp(), 'speech'),
+                      **kwargs)
+
+
+def test_key_covers_everything_polly_is_asked_for():
+    key = audio_key('Hello', 'text', 'Joanna', 'ogg_vorbis')
+    assert key == audio_key('Hello', 'text', 'Joanna', 'ogg_vorbis', [])
+    assert key != audio_key('Hello', 'ssml', 'Joanna', 'ogg_vorbis')
+    assert key != audio_key('Hello', 'text', 'Matthew', 'ogg_vorbis')
+    assert key != audio_key('Hello', 'text', 'Joanna', 'mp3')
+    assert key != audio_key('Hello', 'text', 'Joanna', 'ogg_vorbis', ['l'])
+    assert audio_key(u'caf\xe9', 'text', 'Joanna', 'mp3', ['a', 'b']) == \
+        audio_key(u'caf\xe9', 'text', 'Joanna', 'mp3', ['b', 'a'])
+
+
+def test_put_then_get_counts_hits_and_misses():
+    cache = new_cache()
+    try:
+        key = audio_key('Hello', 'text', 'Joanna', 'ogg_vorbis')
+        assert cache.get(key) is None
+        path = cache.put(key, StringIO('audio'))
+        assert path.endswith('.ogg')
+        assert cache.get(key) == path
+        with open(path, 'rb') as f:
+            assert f.read() == 'audio'
+        assert [n for n in os.listdir(cache.folder)
+                if n.endswith('.tmp')] == []
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+    finally:
+        shutil.rmtree(os.path.dirname(cache.folder))
+
+
+def test_evicts_least_recently_used_past_max_bytes():
+    cache = new_cache(MaxBytes=10)
+    try:
+        first = cache.put('first', StringIO('1234'))
+        second = cache.put('second', StringIO('1234'))
+        os.utime(first, (1000, 1000))
+        os.utime(second, (2000, 2000))
+        # playing first makes second the oldest
+        cache.get('first')
+        cache.put('third', StringIO('1234'))
+        assert cache.get('second') is None
+        assert cache.get('first') == first
+        assert cache.stats()['evictions'] == 1
+        assert cache.stats()['size'] == 8
+    finally:
+        shutil.rmtree(os.path.dirname(cache.folder))
@@ -0,0 +1,104 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+from mock import MagicMock, patch
+from moto import mock_sqs
+from messages.consumer import QueueConsumer
+from messages.message_manager import MessageManager, MessagePublisher
+from messages.queue_registry import queue_registry
+
+
+def publish(location_name, people, **kwargs):
+    queue_registry.clear()
+    publisher = MessagePublisher()
+    for i, person_name in enumerate(people):
+        publisher.add(LocationName=location_name, UUID=str(i),
+                      PersonName=person_name, Body='Message',
+                      WindowsVersion='v1', **kwargs)
+    publisher.flush()
+
+
+@mock_sqs
+def test_one_receive_is_demultiplexed_by_person():
+    publish('kitchen', ['calvin', 'chloe', 'calvin', 'chloe', 'calvin'])
+    consumer = QueueConsumer(LocationName='kitchen', WaitTimeSeconds=0)
+    calvin = consumer.take(PersonName='calvin')
+    assert sorted(b.queued.uuid_key for b in calvin) == ['0', '2', '4']
+    assert len(consumer) == 2
+    chloe = consumer.take(PersonName='chloe')
+    assert sorted(b.queued.uuid_key for b in chloe) == ['1', '3']
+    assert consumer.receives == 1
+    assert consumer.take(PersonName='chloe') == []
+    assert consumer.empty_receives == 1
+
+
+@mock_sqs
+def test_bot_and_speech_messages_are_kept_apart():
+    publish('den', ['calvin'], BotNames='CheckIn')
+    publish('den', ['calvin'])
+    consumer = QueueConsumer(LocationName='den', WaitTimeSeconds=0)
+    assert len(consumer.take(PersonName='calvin')) == 1
+    bots = consumer.take(PersonName='calvin', MessageType='Bot')
+    assert [b.queued.bot_names for b in bots] == ['CheckIn']
+
+
+@mock_sqs
+def test_buffer_is_bounded():
+    publish('kitchen', ['chloe'] * 8)
+    consumer = QueueConsumer(LocationName='kitchen', WaitTimeSeconds=0,
+                             MaxBuffered=5)
+    assert consumer.take(PersonName='calvin') == []
+    assert len(consumer) == 5
+    with patch('time.sleep') as sleep:
+        assert consumer.poll('Message', 20) == 0
+    # waits for the oldest to go back rather than returning straight away
+    assert 0 < sleep.call_args[0][0] <= consumer.hold_seconds
+
+
+def test_heartbeat_extends_and_releases_buffered_messages():
+    acks = MagicMock()
+    consumer = QueueConsumer.__new__(QueueConsumer)
+    consumer.acks = acks
+    consumer.keepalive = None
+    consumer.visibility_timeout = 30
+    consumer.hold_seconds = 120
+    fresh, expiring, stale = [MagicMock(received=1000.0 - age,
+                                        visible_at=1000.0 - age + 30)
+                              for age in (0, 25, 130)]
+    consumer.buffer = {('Message', 'calvin'): [fresh, expiring, stale]}
+    with patch('time.time', return_value=1000.0):
+        consumer.heartbeat()
+    acks.extend.assert_called_once_with(expiring.message, 30)
+    acks.release.assert_called_once_with(stale.message)
+    assert list(consumer.buffer[('Message', 'calvin')]) == [fresh, expiring]
+    assert expiring.visible_at == 1030.0
+
+
+@mock_sqs
+def test_get_messages_returns_the_whole_batch():
+    publish('kitchen', ['calvin', 'calvin', 'chloe'])
+    mm = MessageManager(LocationName='kitchen')
+    mm._scheduler = MagicMock()
+    msgs = mm.get_messages(PersonName='calvin', WaitTimeSeconds=0)
+    assert len(msgs) == 2
+    assert len(mm.sqs_msgs) == 2
+    assert len(mm.consumer) == 1
+    assert mm.heartbeat.stats()['held'] == 3
+    # one batched write takes both out of the queue
+    taken = mm.scheduler.mark_taken_batch.call_args[0][0]
+    assert sorted(t['UUID'] for t in taken) == ['0', '1']
+    assert mm.scheduler.update_queue_status.call_count == 0
+    mm.delete_sqs_msgs()
+    assert mm.heartbeat.stats()['held'] == 1
+    # moto doesn't implement change_message_visibility_batch
+    with patch('helpers.aws.client'):
+        mm.close()
+    assert mm.heartbeat.stats()['held'] == 0
@@ -0,0 +1,162 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import boto3
+from moto import mock_dynamodb2
+from boto3.dynamodb.conditions import Attr
+from helpers.db_helpers import scan_table
+from helpers import aws
+from helpers.schema import SchemaRegistry, table_key
+from mock import patch, MagicMock
+import sys
+import threading
+import traceback
+
+TEST_TABLE = 'PollexyScanTest'
+
+# moto ignores Segment/TotalSegments and returns the whole table for every
+# segment, so these tests scan with a single segment
+
+
+def create_test_table(count):
+    dynamodb = boto3.resource('dynamodb')
+    table = dynamodb.create_table(
+        TableName=TEST_TABLE,
+        KeySchema=[{'AttributeName': 'name', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'name', 'AttributeType': 'S'}],
+        ProvisionedThroughput={'ReadCapacityUnits': 1,
+                               'WriteCapacityUnits': 1})
+    with table.batch_writer() as batch:
+        for i in range(count):
+            batch.put_item(Item={'name': 'item-%s' % i,
+                                 'expired': i % 2 == 0})
+
+
+@mock_dynamodb2
+def test_scan_returns_every_item_once():
+    create_test_table(50)
+    names = [i['name'] for i in scan_table(TEST_TABLE, Segments=1)]
+    assert len(names) == 50
+    assert len(set(names)) == 50
+
+
+@mock_dynamodb2
+def test_scan_follows_pagination():
+    create_test_table(25)
+    items = list(scan_table(TEST_TABLE, Segments=1, Limit=10))
+    assert len(items) == 25
+
+
+@mock_dynamodb2
+def test_scan_pushes_filter_to_server():
+    create_test_table(20)
+    items = list(scan_table(TEST_TABLE, Segments=1,
+                            FilterExpression=Attr('expired').eq(False)))
+    assert len(items) == 10
+    assert not any(i['expired'] for i in items)
+
+
+@mock_dynamodb2
+def test_scan_returns_empty_table():
+    create_test_table(0)
+    assert list(scan_table(TEST_TABLE)) == []
+
+
+def test_scan_error_keeps_the_worker_traceback():
+    resource = MagicMock()
+    resource.Table.return_value.scan.side_effect = ValueError('throttled')
+    with patch('helpers.aws.resource', return_value=resource):
+        try:
+            list(scan_table(TEST_TABLE, Segments=2))
+        except ValueError:
+            frames = traceback.extract_tb(sys.exc_info()[2])
+        else:
+            assert False, 'scan_table swallowed the error'
+    assert '_scan_segment' in [f[2] for f in frames]
+
+
+FAKE_CREDENTIALS = {'AWS_ACCESS_KEY_ID': 'testing',
+                    'AWS_SECRET_ACCESS_KEY': 'testing'}
+
+
+@patch.dict('os.environ', FAKE_CREDENTIALS)
+def test_aws_clients_are_reused_within_a_thread():
+    assert aws.client('sqs') is aws.client('sqs')
+    assert aws.resource('dynamodb') is aws.resource('dynamodb')
+    assert aws.client('sqs') is not aws.client('sqs', Region='eu-west-1')
+
+
+@patch.dict('os.environ', FAKE_CREDENTIALS)
+def test_aws_clients_are_shared_between_threads():
+    clients = []
+    t = threading.Thread(target=lambda: clients.append(aws.client('sqs')))
+    t.start()
+    t.join()
+    assert clients[0] is aws.client('sqs')
+
+
+@patch.dict('os.environ', FAKE_CREDENTIALS)
+def test_reset_drops_the_clients():
+    sqs = aws.client('sqs')
+    aws.reset()
+    assert aws.client('sqs') is not sqs
+
+
+@patch.dict('os.environ', FAKE_CREDENTIALS)
+def test_aws_clients_follow_the_region():
+    sqs = aws.client('sqs')
+    with patch.dict('os.environ', {'AWS_DEFAULT_REGION': 'eu-west-1'}):
+        assert aws.client('sqs') is not sqs
+        assert aws.client('sqs').meta.region_name == 'eu-west-1'
+
+
+def test_validate_table_only_describes_once():
+    registry = SchemaRegistry(UseMarker=False)
+    created = []
+    with patch('helpers.db_helpers.does_table_exist',
+               return_value=False) as exists:
+        registry.ensure(TEST_TABLE, lambda: created.append(1))
+        registry.ensure(TEST_TABLE, lambda: created.append(1))
+    assert exists.call_count == 1
+    assert len(created) == 1
+
+
+def test_schema_marker_skips_describe(tmpdir):
+    marker = str(tmpdir.join('schema'))
+    registry = SchemaRegistry(MarkerPath=marker)
+    registry.validated.add(table_key(TEST_TABLE))
+    registry.write_marker()
+
+    registry = SchemaRegistry(MarkerPath=marker)
+    with patch('helpers.db_helpers.does_table_exist') as exists:
+        registry.ensure(TEST_TABLE, lambda: None)
+        assert exists.call_count == 0
+        registry.ensure(TEST_TABLE, lambda: None, Force=True)
+        assert exists.call_count == 1
+
+
+def test_unwritable_marker_is_logged_not_raised(tmpdir):
+    blocker = tmpdir.join('home')
+    blocker.write('a file, not a folder')
+    registry = SchemaRegistry(MarkerPath=str(blocker.join('schema')))
+    registry.validated.add(table_key(TEST_TABLE))
+    assert registry.write_marker() is None
+
+
+def test_steps_run_once_per_process_whatever_the_marker_says(tmpdir):
+    marker = str(tmpdir.join('schema'))
+    runs = []
+    for _ in range(2):
+        registry = SchemaRegistry(MarkerPath=marker)
+        assert registry.ensure_step('sweep', lambda: runs.append(1) or True)
+        assert registry.ensure_step('sweep', lambda: runs.append(1) or True)
+        registry.write_marker()
+    assert len(runs) == 2
@@ -0,0 +1,119 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import json
+import pytest
+from mock import MagicMock, patch
+from moto import mock_sqs
+from messages import envelope
+from messages.message import QueuedMessage
+from messages.message_manager import build_message, MessageManager
+from messages.queue_registry import queue_registry
+from person.person import Person, PersonTimeWindow
+from tests.test_person import ical_event
+
+
+def received(entry):
+    return MagicMock(body=entry['MessageBody'],
+                     message_attributes=entry['MessageAttributes'])
+
+
+def test_envelope_is_one_attribute_and_round_trips():
+    entry, _ = build_message(UUID='abc', PersonName='calvin',
+                             Body='Brush your teeth', BotNames='Hygiene',
+                             ExpirationDateTimeInUtc='2017-01-01T07:10:00Z',
+                             WindowsVersion='0123456789ab')
+    assert entry['MessageAttributes'].keys() == [envelope.ENVELOPE_ATTRIBUTE]
+    qm = QueuedMessage(QueuedMessage=received(entry))
+    assert qm.uuid_key == 'abc'
+    assert qm.person_name == 'calvin'
+    assert qm.bot_names == 'Hygiene'
+    assert qm.required_bots == ''
+    assert qm.voice_id == 'Joanna'
+    assert qm.no_more_occurrences is False
+    assert qm.windows_version == '0123456789ab'
+    assert qm.expiration_datetime_in_utc.hour == 7
+    assert qm.is_expired
+    assert not hasattr(qm, '__dict__')
+
+
+def test_after_delivery_rides_in_the_envelope():
+    after = ['2012-01-04T01:01:00+00:00', '2012-01-03T01:01:00+00:00', 0]
+    entry, _ = build_message(UUID='abc', PersonName='calvin', Body='Hi',
+                             WindowsVersion='0123456789ab',
+                             AfterDelivery=after)
+    assert QueuedMessage(QueuedMessage=received(entry)).after_delivery == \
+        after
+
+
+def test_version_1_envelopes_still_decode():
+    attrs = {envelope.ENVELOPE_ATTRIBUTE: {
+        'StringValue': json.dumps([1, 'abc', 'calvin', '', 0, 'Joanna', '',
+                                   '', '', '0123456789ab']),
+        'DataType': 'String'}}
+    qm = QueuedMessage(QueuedMessage=MagicMock(body='Hi',
+                                               message_attributes=attrs))
+    assert qm.windows_version == '0123456789ab'
+    assert not qm.after_delivery
+
+
+def test_unknown_envelope_version_is_rejected():
+    attrs = {envelope.ENVELOPE_ATTRIBUTE: {
+        'StringValue': json.dumps([99, 'abc']), 'DataType': 'String'}}
+    with pytest.raises(ValueError):
+        envelope.decode(attrs)
+
+
+def test_messages_without_an_envelope_still_decode():
+    def attr(value):
+        return {'StringValue': value, 'DataType': 'String'}
+    message = MagicMock(body='Hi', message_attributes={
+        'UUID': attr('abc'), 'PersonName': attr('calvin'),
+        'ExpirationDateTimeInUtc': attr('2299-12-31 00:00:00'),
+        'NoMoreOccurrences': attr('False'), 'Voice': attr('Brian')})
+    qm = QueuedMessage(QueuedMessage=message)
+    assert (qm.uuid_key, qm.voice_id, qm.bot_names) == ('abc', 'Brian', '')
+    assert qm.no_more_occurrences is False
+    assert not qm.is_expired
+
+
+def test_windows_version_follows_the_windows():
+    p = Person(Name='calvin')
+    empty = p.windows_version
+    p.add_window(PersonTimeWindow(LocationName='kitchen', Priority=100,
+                                  ical=ical_event))
+    assert p.windows_version != empty
+    assert len(p.windows_version) == 12
+
+
+def test_missing_person_publishes_without_a_version():
+    with patch('messages.message_manager.PersonManager') as pm:
+        pm.return_value.get_person.return_value = None
+        entry, _ = build_message(UUID='abc', PersonName='nobody', Body='Hi')
+    qm = QueuedMessage(QueuedMessage=received(entry))
+    assert not qm.windows_version
+
+
+@mock_sqs
+def test_stale_windows_are_checked_against_the_location():
+    queue_registry.clear()
+    mm = MessageManager(LocationName='Kitchen')
+    p = Person(Name='calvin')
+    p.add_window(PersonTimeWindow(LocationName='kitchen', Priority=100,
+                                  ical=ical_event))
+    mm.queued_msgs = [MagicMock(windows_version=p.windows_version)]
+    with patch.object(p, 'all_available', return_value=[]):
+        assert mm.windows_current(p)
+        mm.queued_msgs.append(MagicMock(windows_version='0123456789ab'))
+        assert not mm.windows_current(p)
+    with patch.object(p, 'all_available',
+                      return_value=p.time_windows.set_list):
+        assert mm.windows_current(p)
@@ -0,0 +1,79 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import arrow
+from StringIO import StringIO
+from person.person import Person, PersonTimeWindow
+from scheduler.forecast import forecast
+
+ical_hourly = 'BEGIN:VEVENT\r\n' + \
+    'DTSTART;VALUE=DATE-TIME:20120101T000000Z\r\n' + \
+    'RRULE:FREQ=HOURLY\r\n' + \
+    'END:VEVENT\r\n'
+
+ical_morning = """
+BEGIN:VEVENT
+DTSTART;VALUE=DATE-TIME:20120101T070000Z
+DURATION:PT2H
+RRULE:FREQ=DAILY
+END:VEVENT
+"""
+
+
+def _item(uuid, person_name):
+    return {
+        'uuid': uuid,
+        'person_name': person_name,
+        'body': 'Test Message Body',
+        'ical': ical_hourly,
+        'start_datetime_in_utc': '2012-01-01T00:00:00+00:00',
+        'end_datetime_in_utc': '2027-01-01T00:00:00+00:00'
+    }
+
+
+def _person(name):
+    p = Person(Name=name)
+    p.add_window(PersonTimeWindow(LocationName='den', ical=ical_morning,
+                                  Priority=50))
+    p.add_window(PersonTimeWindow(LocationName='kitchen', ical=ical_morning,
+                                  Priority=100))
+    return p
+
+
+def test_forecast_delivers_when_person_is_available():
+    plan = forecast(Start=arrow.get('2012-01-01T00:00:00+00:00'),
+                    HorizonDays=1, Processes=1,
+                    Items=[_item('a', 'calvin')], People=[_person('calvin')])
+    rows = [r for r in plan]
+    assert len(rows) == 24
+    # everything before 07:00 waits for the morning window
+    assert rows[0]['delivery_utc'] == '2012-01-01T07:00:00+00:00'
+    assert rows[0]['occurrence_utc'] == '2012-01-01T00:00:00+00:00'
+    assert set(r['location_name'] for r in rows[:9]) == set(['kitchen'])
+    # nothing is open again until the next morning
+    assert rows[-1]['delivery_utc'] == ''
+    minutes, counts = plan.per_minute()
+    assert counts.max() == 8
+
+
+def test_forecast_on_process_pool_matches_inline():
+    items = [_item(str(i), 'calvin') for i in range(4)] + \
+        [_item('x', 'hobbes')]
+    kwargs = {'Start': arrow.get('2012-01-01T00:00:00+00:00'),
+              'HorizonDays': 2,
+              'Items': items,
+              'People': [_person('calvin')]}
+    inline = StringIO()
+    forecast(Processes=1, **kwargs).write_csv(inline)
+    pooled = StringIO()
+    forecast(Processes=2, **kwargs).write_csv(pooled)
+    assert inline.getvalue() == pooled.getvalue()
+    assert ',hobbes,,x,' in inline.getvalue()
@@ -0,0 +1,65 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import time
+from mock import MagicMock, patch
+from messages.heartbeat import VisibilityHeartbeat
+
+
+def sqs_message(handle, queue_url='url'):
+    return MagicMock(receipt_handle=handle, queue_url=queue_url)
+
+
+def all_succeed(**kwargs):
+    return {'Successful': [{'Id': e['Id']} for e in kwargs['Entries']]}
+
+
+def test_beat_extends_every_held_message_per_queue():
+    client = MagicMock()
+    client.change_message_visibility_batch.side_effect = all_succeed
+    heartbeat = VisibilityHeartbeat(VisibilityTimeout=60)
+    with patch.object(heartbeat, 'start'), \
+            patch('helpers.aws.client', return_value=client):
+        heartbeat.hold(sqs_message('a'))
+        heartbeat.hold(sqs_message('b', 'bot-url'))
+        heartbeat.hold(sqs_message('c'))
+        heartbeat.beat()
+        calls = client.change_message_visibility_batch.call_args_list
+        assert [c[1]['QueueUrl'] for c in calls] == ['url', 'bot-url']
+        assert [e['ReceiptHandle'] for e in calls[0][1]['Entries']] == \
+            ['a', 'c']
+        assert calls[0][1]['Entries'][0]['VisibilityTimeout'] == 60
+        heartbeat.drop(sqs_message('a'))
+        heartbeat.drop(sqs_message('b'))
+        heartbeat.beat()
+    stats = heartbeat.stats()
+    assert stats['extensions'] == 4
+    assert stats['held'] == 1
+    assert stats['beats'] == 2
+
+
+def test_thread_stops_extending_once_dropped():
+    client = MagicMock()
+    client.change_message_visibility_batch.side_effect = all_succeed
+    heartbeat = VisibilityHeartbeat(IntervalSeconds=0.01)
+    message = sqs_message('a')
+    with patch('helpers.aws.client', return_value=client):
+        heartbeat.hold(message)
+        deadline = time.time() + 5
+        while heartbeat.stats()['extensions'] < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        heartbeat.drop(message)
+        extensions = heartbeat.stats()['extensions']
+        time.sleep(0.05)
+        heartbeat.stop()
+    assert extensions >= 2
+    assert heartbeat.stats()['extensions'] <= extensions + 1
+    assert heartbeat.thread is None
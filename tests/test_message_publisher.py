@@ -0,0 +1,140 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import arrow
+import boto3
+from mock import MagicMock, patch
+from moto import mock_sqs
+from messages.message_manager import MessagePublisher, build_message, \
+    delay_seconds, MAX_DELAY_SECONDS
+from messages.queue_registry import queue_registry
+
+
+def add_messages(publisher, location_name, count, **kwargs):
+    return [publisher.add(LocationName=location_name,
+                          Context=i,
+                          UUID='{}-{}'.format(location_name, i),
+                          PersonName='calvin',
+                          Body='Message {}'.format(i),
+                          WindowsVersion='v1',
+                          **kwargs)
+            for i in range(count)]
+
+
+@mock_sqs
+def test_messages_are_sent_in_batches_per_queue():
+    queue_registry.clear()
+    publisher = MessagePublisher()
+    client = boto3.client('sqs')
+    with patch.object(client, 'send_message_batch',
+                      wraps=client.send_message_batch) as send, \
+            patch('helpers.aws.client', return_value=client):
+        add_messages(publisher, 'kitchen', 23)
+        add_messages(publisher, 'den', 2, BotNames='CheckIn')
+        # full batches go out as they fill
+        assert send.call_count == 2
+        results = publisher.flush()
+    assert send.call_count == 4
+    assert [len(c[1]['Entries']) for c in send.call_args_list] == \
+        [10, 10, 3, 2]
+    assert all(r.succeeded for r in results)
+    assert [r.context for r in results[:3]] == [0, 1, 2]
+    assert results[-1].queue_name == 'pollexy-inbox-den-bot'
+    attrs = client.get_queue_attributes(
+        QueueUrl=queue_registry.get_url('pollexy-inbox-kitchen'),
+        AttributeNames=['ApproximateNumberOfMessages'])['Attributes']
+    assert attrs['ApproximateNumberOfMessages'] == '23'
+    assert publisher.flush() == []
+
+
+@mock_sqs
+def test_partial_failures_are_retried():
+    queue_registry.clear()
+    publisher = MessagePublisher(MaxAttempts=3)
+    add_messages(publisher, 'kitchen', 3)
+    client = MagicMock()
+    client.send_message_batch.side_effect = [
+        {'Successful': [{'Id': '0', 'MessageId': 'a'}],
+         'Failed': [{'Id': '1', 'Code': 'InternalError',
+                     'SenderFault': False},
+                    {'Id': '2', 'Code': 'InvalidParameterValue',
+                     'SenderFault': True}]},
+        {'Successful': [{'Id': '1', 'MessageId': 'b'}]}]
+    with patch('helpers.aws.client', return_value=client), \
+            patch('time.sleep'), \
+            patch.object(queue_registry, 'get_url', return_value='url'):
+        results = publisher.flush()
+    assert client.send_message_batch.call_count == 2
+    retried = client.send_message_batch.call_args_list[1][1]['Entries']
+    assert [e['Id'] for e in retried] == ['1']
+    assert [r.message_id for r in results] == ['a', 'b', None]
+    assert results[2].error == 'InvalidParameterValue'
+
+
+@mock_sqs
+def test_a_batch_that_raises_does_not_lose_the_others():
+    queue_registry.clear()
+    publisher = MessagePublisher()
+    client = MagicMock()
+    client.send_message_batch.side_effect = [
+        {'Successful': [{'Id': str(i), 'MessageId': str(i)}
+                        for i in range(10)]},
+        ValueError('connection reset')]
+    with patch('helpers.aws.client', return_value=client), \
+            patch.object(queue_registry, 'get_url', return_value='url'):
+        add_messages(publisher, 'kitchen', 12)
+        results = publisher.flush()
+    assert [r.succeeded for r in results] == [True] * 10 + [False] * 2
+    assert results[-1].error == 'connection reset'
+
+
+def test_fifo_messages_are_grouped_and_deduplicated_per_occurrence():
+    kwargs = dict(UUID='abc', PersonName='calvin', Body='Brush your teeth',
+                  WindowsVersion='v1', Fifo=True,
+                  OccurrenceDateTimeInUtc='2017-01-01T07:00:00+00:00')
+    entry, is_bot = build_message(**kwargs)
+    again, _ = build_message(**kwargs)
+    kwargs['OccurrenceDateTimeInUtc'] = '2017-01-02T07:00:00+00:00'
+    tomorrow, _ = build_message(**kwargs)
+    assert entry['MessageGroupId'] == 'calvin'
+    assert entry['MessageDeduplicationId'] == \
+        again['MessageDeduplicationId']
+    assert entry['MessageDeduplicationId'] != \
+        tomorrow['MessageDeduplicationId']
+    del kwargs['Fifo']
+    assert 'MessageGroupId' not in build_message(**kwargs)[0]
+
+
+@mock_sqs
+def test_fifo_mode_publishes_to_fifo_queues():
+    queue_registry.clear()
+    publisher = MessagePublisher(Fifo=True)
+    add_messages(publisher, 'kitchen', 2)
+    results = publisher.flush()
+    assert [r.succeeded for r in results] == [True, True]
+    url = queue_registry.get_url('pollexy-inbox-kitchen.fifo')
+    attrs = boto3.client('sqs').get_queue_attributes(
+        QueueUrl=url, AttributeNames=['All'])['Attributes']
+    assert attrs['FifoQueue'] == 'true'
+    assert queue_registry.get_url('pollexy-inbox-kitchen') is None
+
+
+def test_deliver_at_becomes_a_capped_delay():
+    now = arrow.utcnow()
+    assert delay_seconds(now.replace(seconds=+90), now) == 90
+    assert delay_seconds(now.replace(hours=+1), now) == MAX_DELAY_SECONDS
+    assert delay_seconds(now.replace(seconds=-5), now) == 0
+    kwargs = dict(UUID='abc', PersonName='calvin', Body='Take your meds',
+                  WindowsVersion='v1', DeliverAtUtc=now.replace(minutes=+5))
+    assert 290 < build_message(**kwargs)[0]['DelaySeconds'] <= 300
+    assert 'DelaySeconds' not in build_message(Fifo=True, **kwargs)[0]
+    kwargs['DeliverAtUtc'] = now
+    assert 'DelaySeconds' not in build_message(**kwargs)[0]
@@ -11,9 +11,16 @@
 
 from moto import mock_dynamodb2
 import datetime
+import sys
+import traceback
 import pytest
 import arrow
-from scheduler.scheduler import Scheduler, MESSAGE_SCHEDULE_DB
+from mock import patch, MagicMock
+from scheduler.scheduler import Scheduler, MESSAGE_SCHEDULE_DB, \
+    due_bucket, due_buckets, delivery_update, delivery_time, \
+    occurrence_time, after_delivery, convert_to_scheduled_message, \
+    OVERDUE_BUCKET
+from scheduler.store import ScheduleStore
 from messages.message import ScheduledMessage
 from helpers.db_helpers import does_table_exist
 
@@ -185,6 +192,23 @@ def test_next_occurrence_before_end_datetime_is_not_expired():
     assert not m.is_expired
 
 
+def test_next_occurrence_recomputed_when_cursor_skip_changes():
+    m = ScheduledMessage(
+        StartDateTimeInUtc=arrow.get('2012-01-01 01:01:00 UTC'),
+        ical="RRULE:FREQ=DAILY",
+        Body="Test Message Body",
+        PersonName="Testperson",
+        CompareDateTimeInUtc=arrow.get('2012-01-05 00:00:00 UTC'),
+        EndDateTimeInUtc=arrow.get('2027-01-03 01:01:01 UTC'))
+    with patch.object(m, '_compute_next_occurrence',
+                      return_value=(None, None)) as compute:
+        m.next_occurrence()
+        assert not compute.called
+        m.occurrence_cursor_skip += 1
+        m.next_occurrence()
+        assert compute.call_count == 1
+
+
 @mock_dynamodb2
 def test_mark_update_last_occurrence_works(good_scheduled_message):
     msg = ScheduledMessage(
@@ -462,3 +486,292 @@ def test_passing_interval_adds_to_ical():
             Interval=5,
             PersonName="test")
     assert ical == m.to_ical()
+
+
+def _due_message(**kwargs):
+    return ScheduledMessage(
+        StartDateTimeInUtc=kwargs.get('Start',
+                                      arrow.get('2012-01-01 01:01 UTC')),
+        ical='BEGIN:VEVENT\r\n' +
+             'DTSTART;VALUE=DATE-TIME:20120101T010100Z\r\n' +
+             'RRULE:FREQ=DAILY\r\n' +
+             'END:VEVENT\r\n',
+        Body="Test Message Body",
+        PersonName="Testperson",
+        BotNames=None,
+        RequiredBots=None,
+        IceBreaker=None,
+        EndDateTimeInUtc=arrow.get('2027-01-01 01:01 UTC'))
+
+
+def test_due_buckets_cover_lookback():
+    buckets = due_buckets(arrow.get('2012-01-10 03:00 UTC'), 2)
+    assert buckets == ['2012-01-08', '2012-01-09', '2012-01-10']
+
+
+def test_pending_occurrence_advances_past_last_occurrence():
+    m = _due_message()
+    assert m.pending_occurrence_utc == arrow.get('2012-01-01 01:01 UTC')
+    m.mark_spoken(arrow.get('2012-01-03 05:00 UTC'))
+    assert m.pending_occurrence_utc == arrow.get('2012-01-04 01:01 UTC')
+
+
+@mock_dynamodb2
+def test_due_index_only_returns_due_messages():
+    scheduler_under_test = Scheduler()
+    now = arrow.utcnow()
+    scheduler_under_test.schedule_message(_due_message(Start=now))
+    scheduler_under_test.schedule_message(
+        _due_message(Start=now.replace(days=2)))
+    assert len(list(scheduler_under_test.get_due_items(now))) == 1
+    later = now.replace(days=3)
+    assert len(list(scheduler_under_test.get_due_items(later))) == 2
+
+
+@mock_dynamodb2
+def test_last_occurrence_moves_message_to_next_bucket():
+    scheduler_under_test = Scheduler()
+    now = arrow.utcnow()
+    msg = _due_message(Start=now.replace(hours=-1))
+    scheduler_under_test.schedule_message(msg)
+    scheduler_under_test.update_last_occurrence(msg.uuid_key,
+                                                msg.person_name, now)
+    assert len(list(scheduler_under_test.get_due_items(now))) == 0
+    items = list(scheduler_under_test.get_due_items(now.replace(days=1)))
+    assert items[0]['due_bucket'] == due_bucket(now.replace(hours=23))
+
+
+@mock_dynamodb2
+def test_set_expired_removes_message_from_due_index():
+    scheduler_under_test = Scheduler()
+    now = arrow.utcnow()
+    msg = _due_message(Start=now)
+    scheduler_under_test.schedule_message(msg)
+    scheduler_under_test.set_expired(msg.uuid_key, msg.person_name)
+    assert len(list(scheduler_under_test.get_due_items(now))) == 0
+
+
+def _put_row(msg, due_at, bucket):
+    from helpers import aws
+    table = aws.resource('dynamodb').Table(MESSAGE_SCHEDULE_DB)
+    key = {'uuid': msg.uuid_key, 'person_name': msg.person_name}
+    if bucket:
+        table.update_item(
+            Key=key,
+            UpdateExpression='SET next_occurrence_in_utc=:no, due_bucket=:db',
+            ExpressionAttributeValues={':no': due_at.isoformat(),
+                                       ':db': bucket})
+    else:
+        table.update_item(
+            Key=key,
+            UpdateExpression='REMOVE next_occurrence_in_utc, due_bucket')
+    return Scheduler().get_item(msg.uuid_key, msg.person_name)
+
+
+@mock_dynamodb2
+def test_due_message_from_before_yesterday_moves_to_overdue_bucket():
+    scheduler_under_test = Scheduler()
+    now = arrow.utcnow()
+    msg = _due_message(Start=now.replace(days=-3))
+    scheduler_under_test.schedule_message(msg)
+    _put_row(msg, now.replace(days=-3), due_bucket(now.replace(days=-3)))
+    assert len(list(scheduler_under_test.get_due_items(now))) == 1
+    item = scheduler_under_test.get_item(msg.uuid_key, msg.person_name)
+    assert item['due_bucket'] == OVERDUE_BUCKET
+    assert len(list(scheduler_under_test.get_due_items(now))) == 1
+
+
+@mock_dynamodb2
+def test_stranded_and_unindexed_rows_are_backfilled():
+    scheduler_under_test = Scheduler()
+    now = arrow.utcnow()
+    stranded = _due_message(Start=now.replace(days=-30))
+    unindexed = _due_message(Start=now.replace(days=-1))
+    scheduler_under_test.schedule_message(stranded)
+    scheduler_under_test.schedule_message(unindexed)
+    _put_row(stranded, now.replace(days=-30),
+             due_bucket(now.replace(days=-30)))
+    _put_row(unindexed, None, None)
+    assert len(list(scheduler_under_test.get_due_items(now))) == 2
+
+
+@mock_dynamodb2
+def test_due_items_are_scanned_until_the_index_exists():
+    from helpers import aws
+    aws.resource('dynamodb').create_table(
+        TableName=MESSAGE_SCHEDULE_DB,
+        KeySchema=[{'AttributeName': 'uuid', 'KeyType': 'HASH'},
+                   {'AttributeName': 'person_name', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[
+            {'AttributeName': 'uuid', 'AttributeType': 'S'},
+            {'AttributeName': 'person_name', 'AttributeType': 'S'}],
+        ProvisionedThroughput={'ReadCapacityUnits': 1,
+                               'WriteCapacityUnits': 1})
+    scheduler_under_test = Scheduler()
+    now = arrow.utcnow()
+    scheduler_under_test.schedule_message(_due_message(Start=now))
+    scheduler_under_test.schedule_message(
+        _due_message(Start=now.replace(days=2)))
+    # moto returns the whole table for every scan segment
+    with patch('helpers.db_helpers.DEFAULT_SCAN_SEGMENTS', 1):
+        assert len(list(scheduler_under_test.get_due_items(now))) == 1
+
+
+def _store_item(uuid, start, **kwargs):
+    item = {
+        'uuid': uuid,
+        'person_name': kwargs.get('PersonName', 'Testperson'),
+        'body': 'Test Message Body',
+        'ical': 'BEGIN:VEVENT\r\n' +
+                'DTSTART;VALUE=DATE-TIME:20120101T010100Z\r\n' +
+                'RRULE:FREQ=DAILY\r\n' +
+                'END:VEVENT\r\n',
+        'start_datetime_in_utc': start.isoformat(),
+        'end_datetime_in_utc': '2027-01-01T01:01:00+00:00',
+        'next_occurrence_in_utc': start.isoformat()
+    }
+    item.update(kwargs.get('Extra', {}))
+    return item
+
+
+def test_store_returns_only_ready_rows():
+    now = arrow.get('2012-01-05 12:00 UTC')
+    store = ScheduleStore([
+        _store_item('due', now.replace(hours=-2)),
+        _store_item('later', now.replace(hours=+2)),
+        _store_item('queued', now.replace(hours=-1),
+                    Extra={'in_queue': True}),
+        _store_item('expired', now.replace(hours=-1),
+                    Extra={'expired': True}),
+        _store_item('other', now.replace(hours=-3), PersonName='Other')])
+    assert [m.uuid_key for m in store.ready_messages(now)] == \
+        ['other', 'due']
+    assert store.ready_count(now, PersonName='Testperson') == 1
+    assert store.ready_count(now, PersonName='Nobody') == 0
+    assert store.ready_count(now.replace(hours=+3)) == 3
+
+
+def test_store_interns_repeated_values():
+    now = arrow.get('2012-01-05 12:00 UTC')
+    store = ScheduleStore([_store_item(str(i), now) for i in range(5)])
+    assert len(store) == 5
+    assert len(store.bodies.values) == 1
+    assert len(store.people.values) == 1
+
+
+def test_delivery_update_sets_queue_status_and_due_index():
+    item = _store_item('a', arrow.get('2012-01-01 01:01 UTC'))
+    upd_expr, attr = delivery_update(item, arrow.get('2012-01-03 05:00 UTC'),
+                                     InQueue=False)
+    assert 'in_queue=:iq' in upd_expr
+    assert 'REMOVE' not in upd_expr
+    assert attr[':iq'] is False
+    assert attr[':db'] == '2012-01-04'
+
+
+def test_delivery_update_of_last_occurrence_expires_message():
+    item = _store_item('a', arrow.get('2012-01-01 01:01 UTC'))
+    upd_expr, attr = delivery_update(item, arrow.get('2012-01-03 05:00 UTC'),
+                                     NoMoreOccurrences=True)
+    assert 'expired=:ex' in upd_expr
+    assert upd_expr.endswith('REMOVE next_occurrence_in_utc, due_bucket')
+    assert 'in_queue' not in upd_expr
+
+
+@mock_dynamodb2
+def test_ready_messages_are_yielded_before_the_read_finishes():
+    now = arrow.get('2012-01-05 12:00 UTC')
+    read = []
+
+    def due_items(compare_date):
+        for i in range(5):
+            read.append(i)
+            yield _store_item(str(i), now.replace(hours=-i))
+
+    scheduler_under_test = Scheduler()
+    with patch.object(scheduler_under_test, 'get_due_items', due_items), \
+            patch('scheduler.scheduler.READY_BATCH_SIZE', 2):
+        messages = scheduler_under_test.iter_messages(now)
+        assert sorted(m.uuid_key for m in [next(messages), next(messages)]) \
+            == ['0', '1']
+        assert len(read) == 2
+        assert len(list(messages)) == 3
+
+
+@mock_dynamodb2
+def test_batch_errors_keep_the_worker_traceback():
+    def ack(table, **kwargs):
+        raise ValueError('throttled')
+
+    try:
+        Scheduler()._batch(ack, [{'UUID': 'a'}, {'UUID': 'b'}])
+    except ValueError:
+        frames = traceback.extract_tb(sys.exc_info()[2])
+    else:
+        assert False, '_batch swallowed the error'
+    assert 'ack' in [f[2] for f in frames]
+
+
+def test_after_delivery_matches_reading_the_row():
+    item = _store_item('a', arrow.get('2012-01-01 01:01 UTC'),
+                       Extra={'last_occurrence_in_utc':
+                              '2012-01-02T01:01:00+00:00'})
+    occurrence = arrow.get('2012-01-03 01:01 UTC')
+    after = after_delivery(convert_to_scheduled_message(item), occurrence)
+    assert after[0] == '2012-01-04T01:01:00+00:00'
+    delivered_at = occurrence.replace(minutes=+3)
+    assert delivery_update(None, delivered_at, InQueue=False,
+                           AfterDelivery=after) == \
+        delivery_update(item, delivered_at, InQueue=False)
+
+
+@mock_dynamodb2
+def test_mark_delivered_only_reads_the_row_when_delivered_late():
+    item = _store_item('a', arrow.get('2012-01-01 01:01 UTC'))
+    occurrence = arrow.get('2012-01-03 01:01 UTC')
+    after = after_delivery(convert_to_scheduled_message(item), occurrence)
+    table = MagicMock()
+    table.get_item.return_value = {'Item': item}
+    scheduler_under_test = Scheduler()
+    assert scheduler_under_test._mark_delivered(
+        table, UUID='a', PersonName='Testperson', AfterDelivery=after,
+        DeliveredDateTimeInUtc=occurrence.replace(minutes=+3))
+    assert table.get_item.call_count == 0
+    assert table.update_item.call_count == 1
+    # the next occurrence has come round since it was published
+    assert scheduler_under_test._mark_delivered(
+        table, UUID='a', PersonName='Testperson', AfterDelivery=after,
+        DeliveredDateTimeInUtc=occurrence.replace(days=+1, minutes=+3))
+    assert table.get_item.call_count == 1
+
+
+def test_lookahead_delivers_at_the_pending_occurrence():
+    now = arrow.get('2012-01-05 12:00 UTC')
+    store = ScheduleStore([
+        _store_item('due', now.replace(hours=-1)),
+        _store_item('soon', now.replace(minutes=+5)),
+        _store_item('later', now.replace(minutes=+20))])
+    soon = now.replace(minutes=+10)
+    due, upcoming = list(store.ready_messages(soon))
+    assert delivery_time(due, now) == now
+    assert delivery_time(upcoming, now) == now.replace(minutes=+5)
+    assert upcoming.next_occurrence_utc == now.replace(minutes=+5)
+
+
+def test_last_occurrence_of_counted_rule_has_an_occurrence_time():
+    start = arrow.get('2012-01-01 01:00 UTC')
+    now = arrow.get('2012-01-03 02:00 UTC')
+    m = ScheduledMessage(
+        StartDateTimeInUtc=start,
+        ical='BEGIN:VEVENT\r\n' +
+             'DTSTART;VALUE=DATE-TIME:20120101T010000Z\r\n' +
+             'RRULE:FREQ=DAILY;COUNT=3\r\n' +
+             'END:VEVENT\r\n',
+        Body='Test Message Body',
+        PersonName='Testperson',
+        EndDateTimeInUtc=start.replace(days=+30),
+        LastOccurrenceInUtc=start.replace(days=+1),
+        CompareDateTimeInUtc=now)
+    assert m.is_message_ready()
+    assert m.next_occurrence_utc == 'N/A'
+    assert occurrence_time(m, now) == arrow.get('2012-01-03 01:00 UTC')
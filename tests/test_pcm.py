@@ -0,0 +1,37 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import numpy
+from StringIO import StringIO
+from speaker.pcm import PcmConverter, pcm_chunks
+
+
+def samples(data):
+    return list(numpy.frombuffer(data, dtype='<i2'))
+
+
+def pcm(values):
+    return numpy.array(values, dtype='<i2').tostring()
+
+
+def test_upsamples_to_stereo():
+    c = PcmConverter(SampleRate=16000, Rate=32000, Channels=2)
+    assert samples(c.convert(pcm([1, 2]))) == [1, 1, 1, 1, 2, 2, 2, 2]
+
+
+def test_chunks_split_mid_sample_join_up():
+    data = pcm(range(100))
+    whole = PcmConverter(SampleRate=16000, Rate=44100).convert(data)
+    c = PcmConverter(SampleRate=16000, Rate=44100)
+    pieces = ''.join(c.convert(chunk)
+                     for chunk in pcm_chunks(StringIO(data), 33))
+    assert pieces == whole
+    assert len(samples(whole)) == 276
@@ -10,6 +10,7 @@
 # and limitations under the License.
 
 import arrow
+from mock import patch
 from moto import mock_dynamodb2
 from person.person import Person, PersonTimeWindow, PersonManager
 
@@ -177,3 +178,71 @@ def test_can_save_physical_confirmation_false_preference():
     pm.update_window_set(p)
     p = pm.get_person('calvin')
     assert not p.require_physical_confirmation
+
+
+ical_event_weekdays = """
+BEGIN:VEVENT
+DTSTART;TZID=EST;VALUE=DATE-TIME:20131122T071200
+DURATION:PT6H
+RRULE:FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR
+END:VEVENT
+"""
+
+
+def test_containing_window_returns_start_and_end():
+    now_dt = arrow.get('2014-01-01T09:09:00.000-05:00')
+    tw = PersonTimeWindow(LocationName='kitchen', ical=ical_event)
+    start, end = tw.containing_window(now_dt)
+    assert start == arrow.get('2014-01-01 07:12:00-05:00')
+    assert end == arrow.get('2014-01-01 13:12:00-05:00')
+    assert tw.containing_window(now_dt.replace(hours=+5)) is None
+
+
+def test_complex_window_reuses_bracket():
+    tw = PersonTimeWindow(LocationName='kitchen', ical=ical_event_weekdays)
+    friday = arrow.get('2014-01-03T09:00:00.000-05:00')
+    assert tw.is_in_window(friday)
+    assert tw.is_in_window(friday.replace(hours=+2))
+    assert not tw.is_in_window(friday.replace(days=+1))
+    assert tw.is_in_window(friday.replace(days=+3))
+
+
+def test_muted_window_masks_same_location():
+    now_dt = arrow.get('2014-01-01T09:09:00.000-05:00')
+    p = Person(Name='calvin')
+    p.add_window(PersonTimeWindow(LocationName='kitchen', ical=ical_event,
+                                  Priority=100))
+    p.add_window(PersonTimeWindow(LocationName='den', ical=ical_event,
+                                  Priority=50))
+    p.add_window(PersonTimeWindow(LocationName='kitchen',
+                                  ical=ical_event_before_school,
+                                  IsMuted=True))
+    assert [w.location_name for w in p.all_available(now_dt)] == \
+        ['kitchen', 'den']
+    early = arrow.get('2014-01-01T07:30:00.000-05:00')
+    assert [w.location_name for w in p.all_available(early)] == ['den']
+
+
+def test_timeline_follows_window_changes():
+    now_dt = arrow.get('2014-01-01T09:09:00.000-05:00')
+    p = Person(Name='calvin')
+    p.add_window(PersonTimeWindow(LocationName='kitchen', ical=ical_event,
+                                  Priority=100))
+    assert p.all_available_count(now_dt) == 1
+    p.add_window(PersonTimeWindow(LocationName='den', ical=ical_event,
+                                  Priority=50))
+    assert p.all_available_count(now_dt) == 2
+    assert p.all_available_count(now_dt.replace(days=+30)) == 2
+    assert p.all_available_count(now_dt.replace(hours=+5)) == 0
+
+
+def test_window_version_is_kept_until_the_windows_change():
+    p = Person(Name='calvin')
+    p.add_window(PersonTimeWindow(LocationName='kitchen', ical=ical_event,
+                                  Priority=100))
+    version = p.time_windows.version
+    with patch.object(p.time_windows, 'to_json') as to_json:
+        assert p.time_windows.version is version
+        assert not to_json.called
+    p.remove_window_location('kitchen')
+    assert p.time_windows.version == '[]'
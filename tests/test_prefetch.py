@@ -0,0 +1,130 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import arrow
+from mock import MagicMock, patch
+from moto import mock_sqs
+from cache.audio_cache import audio_key
+from messages.message_manager import MessageManager, MessagePublisher
+from messages.queue_registry import queue_registry
+from person.person import Person, PersonTimeWindow
+from speaker.prefetch import SpeechPrefetcher
+
+NOW = arrow.get('2017-06-01T10:00:00+00:00')
+ICAL = """
+BEGIN:VEVENT
+DTSTART;TZID=EST;VALUE=DATE-TIME:20131122T060000
+DURATION:PT16H
+RRULE:FREQ=DAILY
+END:VEVENT
+"""
+
+
+def person(name, location):
+    p = Person(Name=name)
+    p.add_window(PersonTimeWindow(LocationName=location, ical=ICAL))
+    return p
+
+
+def message(person_name, body, pending, voice_id='Joanna'):
+    return MagicMock(uuid_key='uuid-' + body, person_name=person_name,
+                     body=body, pending_occurrence_utc=pending,
+                     voice_id=voice_id)
+
+
+def prefetcher(messages):
+    people = [person('calvin', 'kitchen'), person('hobbes', 'garage')]
+    render = MagicMock()
+    patches = [patch('speaker.prefetch.PersonManager'),
+               patch('speaker.prefetch.Scheduler')]
+    pm, scheduler = [p.start() for p in patches]
+    pm.return_value.get_all.return_value = people
+    scheduler.return_value.iter_messages.return_value = messages
+    return SpeechPrefetcher(LocationName='Kitchen', Render=render), \
+        render, patches
+
+
+def test_renders_upcoming_messages_for_people_here_once():
+    messages = [message('calvin', 'Brush your teeth',
+                        NOW.replace(minutes=+5)),
+                message('hobbes', 'Feed the tiger', NOW)]
+    p, render, patches = prefetcher(messages)
+    try:
+        assert p.prefetch(NOW) == 1
+        render.assert_called_once_with(
+            Message='<speak><p>Brush your teeth</p></speak>',
+            TextType='ssml', VoiceId='Joanna', Stream=True)
+        assert p.prefetch(NOW.replace(minutes=+1)) == 0
+        assert p.stats()['renders'] == 1
+    finally:
+        for patcher in patches:
+            patcher.stop()
+
+
+def test_renders_again_when_a_token_would_change():
+    m = message('calvin', '{datetime}', NOW.replace(minutes=+5))
+    p, render, patches = prefetcher([m])
+    try:
+        p.prefetch(NOW)
+        assert 'Thursday, June 01' in render.call_args[1]['Message']
+        m.pending_occurrence_utc = NOW.replace(days=+1)
+        assert p.prefetch(NOW.replace(hours=+23, minutes=+50)) == 1
+        assert 'Friday, June 02' in render.call_args[1]['Message']
+        assert p.stats()['rerenders'] == 1
+    finally:
+        for patcher in patches:
+            patcher.stop()
+
+
+def test_messages_due_together_are_one_speech_in_their_voice():
+    messages = [message('calvin', 'Brush your teeth', NOW, 'Brian'),
+                message('calvin', 'Comb your hair', NOW, 'Brian'),
+                message('calvin', 'Make your bed', NOW.replace(minutes=+5),
+                        'Brian')]
+    p, render, patches = prefetcher(messages)
+    try:
+        assert p.prefetch(NOW) == 2
+        assert [c[1]['Message'] for c in render.call_args_list] == [
+            '<speak><p>Brush your teeth</p><p>Comb your hair</p></speak>',
+            '<speak><p>Make your bed</p></speak>']
+        assert set(c[1]['VoiceId'] for c in render.call_args_list) == \
+            set(['Brian'])
+    finally:
+        for patcher in patches:
+            patcher.stop()
+
+
+@mock_sqs
+def test_prefetched_speech_is_what_the_device_speaks():
+    bodies = ['Brush your teeth', 'Comb your hair']
+    p, render, patches = prefetcher(
+        [message('calvin', b, NOW, 'Brian') for b in bodies])
+    try:
+        p.prefetch(NOW)
+    finally:
+        for patcher in patches:
+            patcher.stop()
+    rendered = set(audio_key(c[1]['Message'], c[1]['TextType'],
+                             c[1]['VoiceId'], 'pcm')
+                   for c in render.call_args_list)
+
+    queue_registry.clear()
+    publisher = MessagePublisher()
+    for b in bodies:
+        publisher.add(LocationName='kitchen', PersonName='calvin', Body=b,
+                      VoiceId='Brian', WindowsVersion='v1')
+    publisher.flush()
+    mm = MessageManager(LocationName='kitchen')
+    mm._scheduler = MagicMock()
+    voice_id, composer = mm.compose_speech(PersonName='calvin')
+    spoken = set(audio_key(d, 'ssml', voice_id, 'pcm')
+                 for d in composer.documents())
+    assert spoken == rendered
@@ -0,0 +1,39 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+from moto import mock_sqs
+from messages.queue_registry import QueueRegistry
+
+
+@mock_sqs
+def test_missing_queue_is_none_unless_created():
+    registry = QueueRegistry()
+    assert registry.get_url('pollexy-inbox-kitchen') is None
+    url = registry.get_url('pollexy-inbox-kitchen', Create=True)
+    assert url.endswith('pollexy-inbox-kitchen')
+    assert registry.get_queue('pollexy-inbox-kitchen').url == url
+
+
+@mock_sqs
+def test_url_is_resolved_once_until_it_expires():
+    registry = QueueRegistry()
+    registry.get_url('pollexy-inbox-den', Create=True)
+    lookups = registry.lookups
+    for _ in range(5):
+        registry.get_url('pollexy-inbox-den')
+    assert registry.lookups == lookups
+    registry.invalidate('pollexy-inbox-den')
+    registry.get_url('pollexy-inbox-den')
+    assert registry.lookups == lookups + 1
+    expiring = QueueRegistry(TtlSeconds=-1)
+    expiring.get_url('pollexy-inbox-den')
+    expiring.get_url('pollexy-inbox-den')
+    assert expiring.lookups == 2
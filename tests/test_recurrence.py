@@ -0,0 +1,119 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import arrow
+from helpers.recurrence import RuleCache, rule_cache
+from messages.message import ScheduledMessage
+
+daily_ical = 'BEGIN:VEVENT\r\n' + \
+    'DTSTART;VALUE=DATE-TIME:20120101T010100Z\r\n' + \
+    'RRULE:FREQ=DAILY\r\n' + \
+    'END:VEVENT\r\n'
+
+no_rule_ical = 'BEGIN:VEVENT\r\n' + \
+    'DTSTART;VALUE=DATE-TIME:20120101T010100Z\r\n' + \
+    'END:VEVENT\r\n'
+
+start = arrow.get('2012-01-01 01:01:00 UTC').datetime
+
+
+def test_second_lookup_is_a_hit():
+    cache = RuleCache()
+    first = cache.get(daily_ical, start)
+    second = cache.get(daily_ical, start)
+    assert first is second
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_ical_without_rrule_is_cached_as_none():
+    cache = RuleCache()
+    assert cache.get(no_rule_ical, start) is None
+    assert cache.get(no_rule_ical, start) is None
+    assert cache.stats()['hits'] == 1
+
+
+def test_cache_evicts_least_recently_used():
+    cache = RuleCache(MaxSize=2)
+    first = arrow.get(start)
+    cache.get(daily_ical, first.datetime)
+    cache.get(daily_ical, first.replace(days=1).datetime)
+    cache.get(daily_ical, first.datetime)
+    cache.get(daily_ical, first.replace(days=2).datetime)
+    assert cache.stats()['size'] == 2
+    cache.get(daily_ical, first.datetime)
+    assert cache.stats()['misses'] == 3
+
+
+def test_str_parses_ical_once_per_compare_time():
+    m = ScheduledMessage(
+        StartDateTimeInUtc=arrow.get(start),
+        ical=daily_ical,
+        Body="Test Message Body",
+        PersonName="Testperson",
+        LastOccurrenceInUtc=arrow.get('2012-01-02 01:01:00 UTC'),
+        CompareDateTimeInUtc=arrow.get('2012-01-05 03:00:00 UTC'),
+        EndDateTimeInUtc=arrow.get('2027-01-03 01:01:01 UTC'))
+    rule_cache.clear()
+    str(m)
+    m.is_message_ready()
+    assert rule_cache.stats()['misses'] == 0
+    m.mark_spoken(arrow.get('2012-01-05 02:00:00 UTC'))
+    assert m.next_occurrence_utc == arrow.get('2012-01-06 01:01:00 UTC')
+
+
+def test_simple_rule_matches_dateutil():
+    from dateutil.rrule import rrulestr
+    from helpers.recurrence import SimpleRule, compile_rule
+    ical = daily_ical.replace('FREQ=DAILY', 'FREQ=HOURLY;INTERVAL=5;COUNT=40')
+    rule = compile_rule(ical, start)
+    assert isinstance(rule, SimpleRule)
+    expected = rrulestr('FREQ=HOURLY;INTERVAL=5;COUNT=40', dtstart=start)
+    dt = arrow.get(start).replace(hours=-7)
+    for i in range(120):
+        for inc in (True, False):
+            assert rule.after(dt.datetime, inc=inc) == \
+                expected.after(dt.datetime, inc=inc)
+            assert rule.before(dt.datetime, inc=inc) == \
+                expected.before(dt.datetime, inc=inc)
+        dt = dt.replace(minutes=+97) if i % 2 else dt.replace(hours=+5)
+
+
+def test_simple_rule_drops_microseconds_like_dateutil():
+    from dateutil.rrule import rrulestr
+    from helpers.recurrence import SimpleRule, compile_rule
+    dtstart = arrow.get(start).replace(microseconds=+123456).datetime
+    rule = compile_rule(daily_ical, dtstart)
+    assert isinstance(rule, SimpleRule)
+    expected = rrulestr('FREQ=DAILY', dtstart=dtstart)
+    dt = arrow.get(start).replace(days=+3, seconds=+30).datetime
+    assert rule.after(dt) == expected.after(dt)
+    assert rule.before(dt) == expected.before(dt)
+    assert rule.after(dtstart, inc=True) == expected.after(dtstart, inc=True)
+
+
+def test_rules_with_by_parts_are_not_simple():
+    from helpers.recurrence import SimpleRule, compile_rule
+    ical = daily_ical.replace('FREQ=DAILY', 'FREQ=WEEKLY;BYDAY=MO,WE')
+    assert not isinstance(compile_rule(ical, start), SimpleRule)
+
+
+def test_cursor_keeps_occurrences_and_count():
+    from dateutil.rrule import rrulestr
+    from helpers.recurrence import advance_cursor, get_rule
+    ical = daily_ical.replace('FREQ=DAILY', 'FREQ=WEEKLY;BYDAY=MO,WE;COUNT=20')
+    expected = rrulestr('FREQ=WEEKLY;BYDAY=MO,WE;COUNT=20', dtstart=start)
+    cursor, skip = advance_cursor(ical, start,
+                                  arrow.get('2012-02-01 12:00 UTC').datetime)
+    assert cursor == expected.before(
+        arrow.get('2012-02-01 12:00 UTC').datetime, inc=True)
+    rule = get_rule(ical, cursor, skip)
+    assert list(rule) == [o for o in expected if o >= cursor]
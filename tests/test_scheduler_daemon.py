@@ -0,0 +1,102 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import arrow
+from mock import MagicMock, patch
+from moto import mock_dynamodb2
+from person.person import Person, PersonTimeWindow
+from scheduler.daemon import SchedulerDaemon
+from scheduler.store import to_micros
+
+ical_hourly = 'BEGIN:VEVENT\r\n' + \
+    'DTSTART;VALUE=DATE-TIME:20120101T000000Z\r\n' + \
+    'RRULE:FREQ=HOURLY\r\n' + \
+    'END:VEVENT\r\n'
+
+ical_morning = """
+BEGIN:VEVENT
+DTSTART;VALUE=DATE-TIME:20120101T070000Z
+DURATION:PT2H
+RRULE:FREQ=DAILY
+END:VEVENT
+"""
+
+
+def _item(uuid, start):
+    return {
+        'uuid': uuid,
+        'person_name': 'calvin',
+        'body': 'Test Message Body',
+        'ical': ical_hourly,
+        'start_datetime_in_utc': start,
+        'end_datetime_in_utc': '2027-01-01T00:00:00+00:00'
+    }
+
+
+def _daemon():
+    p = Person(Name='calvin')
+    p.add_window(PersonTimeWindow(LocationName='kitchen', ical=ical_morning,
+                                  Priority=100))
+    d = SchedulerDaemon(Simulate=True)
+    d.person_manager = MagicMock()
+    d.person_manager.get_person.return_value = p
+    return d
+
+
+@mock_dynamodb2
+def test_daemon_publishes_due_entries_and_rearms():
+    d = _daemon()
+    d.load([_item('now', '2012-01-02T07:00:00+00:00'),
+            _item('later', '2012-01-02T07:30:00+00:00')])
+    now = arrow.get('2012-01-02T07:10:00+00:00')
+    assert d.run_pending(now) == 1
+    assert d.next_due() == to_micros(arrow.get('2012-01-02T07:30:00+00:00'))
+    assert d.entries[('now', 'calvin')].due == \
+        arrow.get('2012-01-02T08:00:00+00:00')
+
+
+@mock_dynamodb2
+def test_daemon_waits_for_person_window():
+    d = _daemon()
+    d.load([_item('early', '2012-01-02T05:00:00+00:00')])
+    assert d.run_pending(arrow.get('2012-01-02T05:00:00+00:00')) == 0
+    assert d.entries[('early', 'calvin')].due == \
+        arrow.get('2012-01-02T07:00:00+00:00')
+    assert d.run_pending(arrow.get('2012-01-02T07:00:00+00:00')) == 1
+
+
+@mock_dynamodb2
+def test_replaced_entry_is_not_delivered_twice():
+    d = _daemon()
+    d.load([_item('a', '2012-01-02T07:00:00+00:00')])
+    d.apply(_item('a', '2012-01-02T08:00:00+00:00'))
+    assert d.run_pending(arrow.get('2012-01-02T07:30:00+00:00')) == 0
+    assert d.run_pending(arrow.get('2012-01-02T08:00:00+00:00')) == 1
+
+
+@mock_dynamodb2
+def test_failed_pass_is_logged_and_retried_from_the_table():
+    d = _daemon()
+    passes = []
+
+    def run_pending():
+        passes.append(1)
+        if len(passes) == 1:
+            raise ValueError('throttled')
+        d.stop()
+
+    with patch.object(d, 'open') as open_, \
+            patch.object(d, 'run_pending', side_effect=run_pending), \
+            patch.object(d, 'poll_changes'), \
+            patch('scheduler.daemon.ERROR_BACKOFF_SECONDS', 0):
+        d.run()
+    assert len(passes) == 2
+    assert open_.call_count == 2
@@ -0,0 +1,39 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import xml.etree.ElementTree as ET
+from helpers.ssml import SsmlComposer
+
+
+def test_document_escapes_paragraphs():
+    c = SsmlComposer().paragraph('Salt & pepper <now>').paragraph('  ')
+    assert c.document() == \
+        '<speak><p>Salt &amp; pepper &lt;now&gt;</p></speak>'
+    assert SsmlComposer().document() is None
+
+
+def test_documents_split_between_paragraphs():
+    c = SsmlComposer(MaxCharacters=60)
+    for text in ['Take your pills.', 'Feed the cat.', 'Call Mom.']:
+        c.paragraph(text)
+    docs = c.documents()
+    assert docs == ['<speak><p>Take your pills.</p><p>Feed the cat.</p>'
+                    '</speak>',
+                    '<speak><p>Call Mom.</p></speak>']
+
+
+def test_long_paragraph_splits_between_sentences_then_words():
+    text = 'One two three. Four five six seven eight nine ten eleven & ' \
+        'twelve. Thirteen.'
+    docs = SsmlComposer(MaxCharacters=50).paragraph(text).documents()
+    assert all(len(d) <= 50 for d in docs)
+    spoken = [p.text for d in docs for p in ET.fromstring(d)]
+    assert ' '.join(spoken) == text
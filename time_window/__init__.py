@@ -10,10 +10,11 @@
 # and limitations under the License.
 
 from icalendar import Calendar
-from dateutil.rrule import rrulestr
 import arrow
 import json
 from helpers.datetime_helpers import check_if_timezone_naive
+from helpers.recurrence import get_rule, SimpleRule
+import logging
 
 LOCATION_TABLE = 'locations'
 
@@ -26,20 +27,39 @@ class TimeWindowSet(object):
     def __init__(self):
         self.set_list = []
 
+    @property
+    def set_list(self):
+        return self._set_list
+
+    @set_list.setter
+    def set_list(self, windows):
+        self._set_list = windows
+        self.changed()
+
+    @property
+    def version(self):
+        """the windows' json, kept until the set changes"""
+        if self._version is None:
+            self._version = self.to_json()
+        return self._version
+
+    def changed(self):
+        """call after editing a window in the set in place"""
+        self._version = None
+
     def add_time_window(self, tw):
         self.set_list.append(tw)
+        self.changed()
 
     def is_available(self, dt):
         is_avail = False
-        print "Checking if window is current with " + dt.isoformat()
+        logging.debug("Checking if window is current with " + dt.isoformat())
         for tw in self.set_list:
-            print 'is it muted? ' + str(tw.is_muted)
-            print "is in window " + str(tw.is_in_window(dt))
-            if tw.is_muted and tw.is_in_window(dt):
-                print "NOT AVAILABLE"
+            in_window = tw.is_in_window(dt)
+            if in_window and tw.is_muted:
+                logging.debug("Muted window is current, NOT AVAILABLE")
                 return False
-            if tw.is_in_window(dt):
-                print "AVAILABLE"
+            if in_window:
                 is_avail = True
         return is_avail
 
@@ -68,30 +88,53 @@ class TimeWindow(object):
         self.is_muted = kwargs.get('IsMuted', False)
         self.compare_dt = kwargs.get('CompareDateTime', None)
         self.priority = kwargs.get('Priority', False)
+        self._bracket = None
         try:
             ev = Calendar.from_ical(self.ical)
             start = arrow.get(ev.get('dtstart').dt)
             self.delta = ev.get('duration').dt
             check_if_timezone_naive(start, 'start')
-            self.rule = rrulestr(ev.get('rrule').to_ical(),
-                                 dtstart=start.datetime)
+            self.rule = get_rule(self.ical, start.datetime)
+            if self.rule is None:
+                raise ValueError('missing RRULE')
         except Exception as ex:
             raise ValueError("Error processing ical: %s" % str(ex))
 
     def previous_start(self, dt=None):
         if not dt and self.compare_dt:
             dt = self.compare_dt
-        return self.rule.before(dt, inc=True)
+        if isinstance(self.rule, SimpleRule):
+            return self.rule.before(dt, inc=True)
+        # complex rules: remember the [start, next start) bracket of the
+        # last lookup, repeated checks in the same interval skip the walk
+        if self._bracket:
+            start, next_start = self._bracket
+            if start <= dt and (next_start is None or dt < next_start):
+                return start
+        start = self.rule.before(dt, inc=True)
+        if start is not None:
+            self._bracket = (start, self.rule.after(dt))
+        return start
 
     def previous_end(self, dt=None):
         if not dt and self.compare_dt:
             dt = self.compare_dt
         return self.previous_start(dt) + self.delta
 
-    def is_in_window(self, dt=None):
+    def containing_window(self, dt=None):
+        """(start, end) of the occurrence dt falls in, or None"""
         if not dt:
             dt = arrow.utcnow()
-        return self.previous_start(dt) < dt < self.previous_end(dt)
+        start = self.previous_start(dt)
+        if start is None:
+            return None
+        end = start + self.delta
+        if start < dt < end:
+            return start, end
+        return None
+
+    def is_in_window(self, dt=None):
+        return self.containing_window(dt) is not None
 
     def to_json(self):
         return {'ical': self.ical,
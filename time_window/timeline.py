@@ -0,0 +1,167 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""minute-resolution availability bitmaps for window sets"""
+import threading
+import arrow
+import numpy as np
+
+TIMELINE_HORIZON_MINUTES = 7 * 24 * 60
+
+
+def minute_offsets(occurrences, start):
+    return np.array([(arrow.get(o) - start).total_seconds()
+                     for o in occurrences], dtype=np.float64) / 60.0
+
+
+def expand_window(tw, start, horizon):
+    """bitmap of the minutes in [start, start + horizon) covered by tw.
+    a minute is covered when the window is open at its first second"""
+    end = start.replace(minutes=+horizon)
+    delta_minutes = tw.delta.total_seconds() / 60.0
+    occurrences = tw.rule.between(start.replace(minutes=-delta_minutes)
+                                  .datetime, end.datetime, inc=True)
+    active = np.zeros(horizon, dtype=bool)
+    if not occurrences:
+        return active
+    offsets = minute_offsets(occurrences, start)
+    first = np.clip(np.ceil(offsets), 0, horizon).astype(np.int64)
+    last = np.clip(np.ceil(offsets + delta_minutes), 0,
+                   horizon).astype(np.int64)
+    changes = np.zeros(horizon + 1, dtype=np.int64)
+    np.add.at(changes, first, 1)
+    np.add.at(changes, last, -1)
+    return np.cumsum(changes[:-1]) > 0
+
+
+class WindowTimeline(object):
+    """availability of one window set over [start, start + horizon).
+    rows are the unmuted windows in priority order; a muted window masks
+    the unmuted windows of the same location (all of them for location
+    window sets, which have no location_name)"""
+    def __init__(self, window_set, start, horizon, version=None):
+        self.start = start
+        self.horizon = horizon
+        self.version = version
+        unmuted = [w for w in window_set.set_list if not w.is_muted]
+        self.windows = sorted(unmuted, key=lambda w: w.priority,
+                              reverse=True)
+        self.bitmap = np.zeros((len(self.windows), horizon), dtype=bool)
+        for i, w in enumerate(self.windows):
+            self.bitmap[i] = expand_window(w, start, horizon)
+
+        masks = {}
+        for w in window_set.set_list:
+            if not w.is_muted:
+                continue
+            key = getattr(w, 'location_name', None)
+            mask = expand_window(w, start, horizon)
+            if key in masks:
+                masks[key] |= mask
+            else:
+                masks[key] = mask
+        for i, w in enumerate(self.windows):
+            mask = masks.get(getattr(w, 'location_name', None))
+            if mask is not None:
+                self.bitmap[i] &= ~mask
+        self.is_muted = np.zeros(horizon, dtype=bool)
+        for mask in masks.values():
+            self.is_muted |= mask
+
+    def index(self, dt):
+        i = int((arrow.get(dt) - self.start).total_seconds() // 60)
+        if i < 0 or i >= self.horizon:
+            return None
+        return i
+
+    def covers(self, dt):
+        return self.index(dt) is not None
+
+    def all_available(self, dt):
+        column = self.bitmap[:, self.index(dt)]
+        return [self.windows[i] for i in np.flatnonzero(column)]
+
+    def all_available_count(self, dt):
+        return int(self.bitmap[:, self.index(dt)].sum())
+
+    def is_available(self, dt):
+        i = self.index(dt)
+        return bool(self.bitmap[:, i].any() and not self.is_muted[i])
+
+    def next_available(self, dt):
+        """first minute at or after dt with a window open, or None when
+        there is none left in the horizon"""
+        i = self.index(dt)
+        later = np.flatnonzero(self.bitmap[:, i:].any(axis=0))
+        if not len(later):
+            return None
+        return self.start.replace(minutes=+int(i + later[0]))
+
+
+class AvailabilityTimeline(object):
+    """process-wide timelines keyed by owner ('person:calvin',
+    'location:kitchen'). an entry is rebuilt when its window set changes
+    or a lookup falls outside its horizon"""
+    def __init__(self, **kwargs):
+        self.horizon = kwargs.get('HorizonMinutes', TIMELINE_HORIZON_MINUTES)
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, window_set, dt):
+        version = window_set.version
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or entry.version != version or \
+                not entry.covers(dt):
+            entry = self.update(key, window_set, dt, version)
+        return entry
+
+    def update(self, key, window_set, dt=None, version=None):
+        if not dt:
+            dt = arrow.utcnow()
+        if version is None:
+            version = window_set.version
+        start = arrow.get(dt).to('UTC').floor('minute')
+        entry = WindowTimeline(window_set, start, self.horizon, version)
+        with self.lock:
+            self.entries[key] = entry
+        return entry
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def all_available(self, key, window_set, dt):
+        return self.get(key, window_set, dt).all_available(dt)
+
+    def all_available_count(self, key, window_set, dt):
+        return self.get(key, window_set, dt).all_available_count(dt)
+
+    def is_available(self, key, window_set, dt):
+        return self.get(key, window_set, dt).is_available(dt)
+
+    def next_available(self, key, window_set, dt):
+        return self.get(key, window_set, dt).next_available(dt)
+
+
+availability_timeline = AvailabilityTimeline()
+
+
+def person_key(name):
+    return 'person:{}'.format(name)
+
+
+def location_key(name):
+    return 'location:{}'.format(name)
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+Benchmarks helpers.db_helpers.scan_table against DynamoDB Local.
+
+    java -Djava.library.path=./DynamoDBLocal_lib -jar DynamoDBLocal.jar
+    PYTHONPATH=. python tools/scan_benchmark.py --sizes 10000,100000,1000000
+
+The benchmark table is created (and loaded) once per size and dropped at
+the end unless --keep is passed.
+"""
+import argparse
+import time
+import uuid
+import boto3
+from boto3.dynamodb.conditions import Attr
+from helpers.db_helpers import scan_table
+
+BENCHMARK_TABLE = 'PollexyScanBenchmark'
+
+
+def load_table(dynamodb, size):
+    table = dynamodb.create_table(
+        TableName=BENCHMARK_TABLE,
+        KeySchema=[{'AttributeName': 'uuid', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'uuid',
+                               'AttributeType': 'S'}],
+        ProvisionedThroughput={'ReadCapacityUnits': 1000,
+                               'WriteCapacityUnits': 1000})
+    table.meta.client.get_waiter('table_exists') \
+        .wait(TableName=BENCHMARK_TABLE)
+    with table.batch_writer() as batch:
+        for i in range(size):
+            batch.put_item(Item={
+                'uuid': str(uuid.uuid4()),
+                'person_name': 'person-%s' % (i % 500),
+                'body': 'Time to brush your teeth, {person}',
+                'ical': 'BEGIN:VEVENT\r\nRRULE:FREQ=DAILY\r\nEND:VEVENT\r\n',
+                'expired': i % 10 == 0,
+                'in_queue': i % 7 == 0})
+    return table
+
+
+def single_scan(dynamodb):
+    # the old behavior: one call, first page only
+    table = dynamodb.Table(BENCHMARK_TABLE)
+    return len(table.scan(Select='ALL_ATTRIBUTES')['Items'])
+
+
+def timed(f):
+    start = time.time()
+    count = f()
+    return count, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--endpoint_url', default='http://localhost:8000')
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--segments', default='1,4,8,16')
+    parser.add_argument('--keep', action='store_true')
+    args = parser.parse_args()
+    dynamodb = boto3.resource('dynamodb', endpoint_url=args.endpoint_url,
+                              region_name='us-east-1')
+    not_done = Attr('expired').eq(False) & Attr('in_queue').eq(False)
+
+    for size in [int(s) for s in args.sizes.split(',')]:
+        print 'Loading {} items . . .'.format(size)
+        table = load_table(dynamodb, size)
+        try:
+            count, secs = timed(lambda: single_scan(dynamodb))
+            print '  single scan call: {} items in {:.2f}s'.format(count,
+                                                                   secs)
+            for segments in [int(s) for s in args.segments.split(',')]:
+                count, secs = timed(lambda: sum(1 for _ in scan_table(
+                    BENCHMARK_TABLE, Segments=segments,
+                    EndpointUrl=args.endpoint_url)))
+                print '  scan_table segments={}: {} items in {:.2f}s' \
+                    .format(segments, count, secs)
+                count, secs = timed(lambda: sum(1 for _ in scan_table(
+                    BENCHMARK_TABLE, Segments=segments,
+                    EndpointUrl=args.endpoint_url,
+                    FilterExpression=not_done,
+                    ProjectionExpression='#u, person_name',
+                    ExpressionAttributeNames={'#u': 'uuid'})))
+                print '  scan_table segments={} (filtered): {} items ' \
+                      'in {:.2f}s'.format(segments, count, secs)
+        finally:
+            if not args.keep:
+                table.delete()
+                table.meta.client.get_waiter('table_not_exists') \
+                    .wait(TableName=BENCHMARK_TABLE)
+
+
+if __name__ == '__main__':
+    main()